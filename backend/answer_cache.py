@@ -0,0 +1,93 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from rerank_cache import normalize_query
+
+
+def context_fingerprint(chunks: List[Dict], context: str) -> str:
+    """Hash of the ordered chunk ids and the exact context text sent to the LLM."""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        digest.update(f"{chunk.get('chunk_id')}|".encode('utf-8'))
+    digest.update(context.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AnswerCache:
+    """Bounded LRU of generated answers with a time-to-live.
+
+    Keyed by prompt version, normalised question and context fingerprint, so a
+    hit only happens when the LLM would have seen exactly the same prompt.
+    Retrieval already filtered the context by clearance, so identical context
+    implies the asker may see every source in the cached answer.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._answers: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, prompt_version: str, query: str, fingerprint: str) -> Tuple:
+        return (prompt_version, normalize_query(query), fingerprint)
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._answers[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._answers.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+
+    def put(self, key: Tuple, result: Dict):
+        with self._lock:
+            self._answers[key] = (copy.deepcopy(result), time.monotonic())
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_entries:
+                self._answers.popitem(last=False)
+                self.evicted += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._answers.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._answers),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache(Config.ANSWER_CACHE_SIZE, Config.ANSWER_CACHE_TTL)
@@ -1,21 +1,32 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 import os
 import io
 from urllib.parse import quote
 import oracledb
 import logging
 
-from database import OracleVectorDB
+from config import Config
+from database import OracleVectorDB, statement_log
+from async_database import AsyncOracleVectorDB
+from catalog import document_catalog
 from auth import authenticate_user, create_token, get_current_user, ensure_can_upload, ensure_level, has_access, ensure_admin, hash_password, LEVEL_ORDER, ROLES, get_current_user_flexible
-from embeddings import EmbeddingGenerator
+from blob_store import content_ref, create_blob_store
+from vector_replica import create_vector_replica
+from model_registry import model_registry
+from rerank_cache import rerank_score_cache, normalize_query
+from retrieval_cache import retrieval_cache
+from answer_cache import answer_cache
+from single_flight import SingleFlight
 from pdf_processor import PDFProcessor
 from retriever import DocumentRetriever
 from hybrid_retriever import HybridRetriever
 from llm_handler import LLMHandler
+from llm_gateway import llm_gateway
 from docx import Document as DocxDocument
 import json
 
@@ -30,12 +41,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-db = OracleVectorDB()
-embedder = EmbeddingGenerator()
+# Sync pool backs the retrievers (run off the event loop); routes use the async pool
+vector_replica = create_vector_replica()
+db = OracleVectorDB(catalog=document_catalog, vector_replica=vector_replica)
+adb = AsyncOracleVectorDB(catalog=document_catalog, vector_replica=vector_replica)
+blob_store = create_blob_store()
+# Models are shared process-wide and loaded lazily / by the startup warm-up
+embedder = model_registry.proxy('embedder')
 pdf_processor = PDFProcessor()
 retriever = DocumentRetriever(db, embedder)
-hybrid_retriever = HybridRetriever(db, embedder)
+hybrid_retriever = HybridRetriever(db, embedder, vector_retriever=retriever)
 llm_handler = LLMHandler()
+ask_flights = SingleFlight()
 
 logger = logging.getLogger("templates")
 if not logger.handlers:
@@ -45,10 +62,31 @@ if not logger.handlers:
     logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
+@app.on_event("startup")
+async def open_async_db():
+    await adb.open()
+    model_registry.warm_up(Config.MODEL_WARMUP)
+    # Deleted or re-indexed documents must not serve stale cross-encoder scores
+    document_catalog.subscribe(rerank_score_cache.invalidate_documents)
+    document_catalog.subscribe(retrieval_cache.invalidate_documents)
+    if vector_replica:
+        document_catalog.subscribe(lambda doc_ids: vector_replica.apply_catalog_changes(document_catalog, doc_ids))
+        vector_replica.start(db, Config.VECTOR_REPLICA_SYNC_SECONDS)
+
+@app.on_event("shutdown")
+async def close_async_db():
+    model_registry.stop()
+    await llm_gateway.close()
+    if vector_replica:
+        vector_replica.stop()
+    await adb.close()
+
 class QuestionRequest(BaseModel):
     question: str
     document_filename: Optional[str] = None
     top_k: Optional[int] = 10
+    # Skip the answer cache (a fresh answer still replaces the cached one)
+    bypass_cache: bool = False
     
 class LoginRequest(BaseModel):
     username: str
@@ -79,10 +117,11 @@ class UploadResponse(BaseModel):
 class PageRequest(BaseModel):
     filename: str
     page_number: int
+    end_page: Optional[int] = None  # Inclusive; omit for a single page
 
 @app.post("/auth/login")
 async def login(request: LoginRequest):
-    user = authenticate_user(request.username, request.password)
+    user = await authenticate_user(adb, request.username, request.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_token({
@@ -107,13 +146,13 @@ async def create_user(req: CreateUserRequest, user=Depends(get_current_user)):
     # role to max_level sanity: enforce ordering (cannot assign max_level higher than SECRET anyway)
     # Insert
     try:
-        with db.get_connection() as conn:
+        async with adb.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT 1 FROM users WHERE username=:u", u=req.username)
-            if cur.fetchone():
+            await cur.execute("SELECT 1 FROM users WHERE username=:u", u=req.username)
+            if await cur.fetchone():
                 raise HTTPException(status_code=400, detail="Username exists")
             id_var = cur.var(oracledb.NUMBER)
-            cur.execute(
+            await cur.execute(
                 "INSERT INTO users (username, password_hash, role, max_level) VALUES (:u, :p, :r, :m) RETURNING id INTO :id",
                 u=req.username, p=hash_password(req.password), r=req.role, m=req.max_level, id=id_var
             )
@@ -122,12 +161,12 @@ async def create_user(req: CreateUserRequest, user=Depends(get_current_user)):
                 raw_val = raw_val[0] if raw_val else None
             new_id = int(raw_val) if raw_val is not None else None
             if new_id is None:
-                cur.execute("SELECT id FROM users WHERE username=:u", u=req.username)
-                row = cur.fetchone()
+                await cur.execute("SELECT id FROM users WHERE username=:u", u=req.username)
+                row = await cur.fetchone()
                 if not row:
                     raise HTTPException(status_code=500, detail="Failed to retrieve new user id")
                 new_id = row[0]
-            conn.commit()
+            await conn.commit()
             return {"id": new_id, "username": req.username, "role": req.role, "max_level": req.max_level}
     except HTTPException:
         raise
@@ -137,12 +176,35 @@ async def create_user(req: CreateUserRequest, user=Depends(get_current_user)):
 @app.get("/admin/users")
 async def list_users(user=Depends(get_current_user)):
     ensure_admin(user)
-    with db.get_connection() as conn:
+    async with adb.get_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, username, role, max_level, created_at FROM users ORDER BY id")
-        rows = cur.fetchall()
+        await cur.execute("SELECT id, username, role, max_level, created_at FROM users ORDER BY id")
+        rows = await cur.fetchall()
         return {"users": [ {"id":r[0], "username":r[1], "role":r[2], "max_level":r[3], "created_at": r[4].isoformat() if r[4] else None } for r in rows ]}
 
+@app.get("/admin/db/stats")
+async def db_stats(user=Depends(get_current_user)):
+    ensure_admin(user)
+    return {
+        "async_pool": await adb.get_pool_stats(),
+        "sync_pool": await run_in_threadpool(db.get_pool_stats),
+        "vector_replica": vector_replica.stats() if vector_replica else None,
+        "statements": statement_log.snapshot()
+    }
+
+@app.get("/admin/retrieval/stats")
+async def retrieval_stats(user=Depends(get_current_user)):
+    ensure_admin(user)
+    return {
+        "rerank": hybrid_retriever.get_rerank_metrics(),
+        "rerank_cache": rerank_score_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "ask_coalescing": ask_flights.stats(),
+        "sql_generation": hybrid_retriever.sql_generator.stats(),
+        "llm": llm_gateway.stats()
+    }
+
 @app.post("/upload")
 async def upload_pdf(
     file: UploadFile = File(...),
@@ -161,8 +223,12 @@ async def upload_pdf(
     
     temp_path = f"temp_{file.filename}"
     pdf_bytes = None
+    file_ref = None
+    new_blob = False
+    doc_id = None
+    stored = False
     try:
-        # อ่านไฟล์ทั้งหมดเพื่อเก็บใน database
+        # อ่านไฟล์ทั้งหมดเพื่อเก็บใน blob store
         file_content = await file.read()
         pdf_bytes = file_content
         
@@ -170,7 +236,7 @@ async def upload_pdf(
         with open(temp_path, "wb") as buffer:
             buffer.write(file_content)
         
-        existing_doc = db.get_document_by_filename(file.filename)
+        existing_doc = await adb.get_document_info(file.filename)
         if existing_doc:
             raise HTTPException(status_code=400, detail="Document already exists")
         
@@ -213,10 +279,18 @@ async def upload_pdf(
         }
         
         print("Generating intelligent title...")
-        intelligent_title = llm_handler.generate_document_title(document_info)
+        try:
+            intelligent_title = await llm_handler.generate_document_title(document_info)
+        except Exception as e:
+            print(f"Title generation failed, keeping extracted title: {e}")
+            intelligent_title = pdf_data['title'] or file.filename
         print(f"Generated title: {intelligent_title}")
         
-        doc_id = db.insert_document(
+        # Original PDF goes to the content-addressed blob store; the row keeps only the ref
+        new_blob = not await run_in_threadpool(blob_store.exists, content_ref(pdf_bytes))
+        file_ref = await run_in_threadpool(blob_store.put, pdf_bytes)
+
+        doc_id = await adb.insert_document(
             filename=file.filename,
             title=intelligent_title,
             abstract=pdf_data['abstract'],
@@ -230,14 +304,17 @@ async def upload_pdf(
                 'extraction_stats': extraction_stats,
                 'classification': classification
             },
-            pdf_file=pdf_bytes,
+            file_ref=file_ref,
+            file_size=len(pdf_bytes),
             classification=classification
         )
         print(f"Document inserted with ID: {doc_id}")
         
+        chunk_embeddings = []
         for i, chunk in enumerate(pdf_data['chunks']):
             embedding = embedder.encode(chunk['text'])
-            db.insert_chunk(
+            chunk_embeddings.append(embedding)
+            await adb.insert_chunk(
                 doc_id=doc_id,
                 chunk_text=chunk['text'],
                 chunk_type=chunk['type'],
@@ -248,6 +325,19 @@ async def upload_pdf(
             )
         
         print(f"All chunks inserted successfully")
+
+        # Document-level routing vector for two-stage retrieval
+        doc_vector = embedder.document_vector(
+            intelligent_title,
+            pdf_data['abstract'],
+            chunk_embeddings,
+            table_of_contents=pdf_data.get('table_of_contents')
+        )
+        await adb.upsert_document_vector(doc_id, doc_vector)
+        stored = True
+        if vector_replica:
+            # Make the new segments searchable now rather than at the next sync tick
+            await run_in_threadpool(vector_replica.sync, db)
         
         response = {
             "status": "success",
@@ -266,67 +356,105 @@ async def upload_pdf(
     
     except Exception as e:
         print(f"Error uploading PDF: {str(e)}")
+        if not stored:
+            await discard_failed_upload(doc_id, file_ref if new_blob else None)
         raise HTTPException(status_code=500, detail=str(e))
     
     finally:
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
+async def discard_failed_upload(doc_id: Optional[int], file_ref: Optional[str]):
+    """Undo a partly stored upload so it leaves nothing behind and can be retried.
+
+    The document row goes first (its segments and routing vector cascade);
+    file_ref is passed only for a blob this upload created, and is deleted
+    unless another document row references the same content.
+    """
+    try:
+        if doc_id is not None:
+            await adb.delete_document(doc_id)
+        if file_ref and not await adb.file_ref_in_use(file_ref):
+            await run_in_threadpool(blob_store.delete, file_ref)
+    except Exception as e:
+        print(f"Cleanup after failed upload incomplete (doc_id {doc_id}, blob {file_ref}): {e}")
+
+async def check_question_access(request: QuestionRequest, user):
+    # If specific document specified, verify access
+    if request.document_filename:
+        doc = await adb.get_document_info(request.document_filename)
+        if not doc:
+            raise HTTPException(status_code=404, detail="Document not found")
+        if not has_access(user, doc['classification']):
+            raise HTTPException(status_code=403, detail="No access to this document")
+
+async def ask_context(request: QuestionRequest, max_level: str) -> Tuple[List[Dict], Optional[Dict]]:
+    """Retrieved chunks for a question, or the canned reply when nothing matched."""
+    level_index = {lvl:i for i,lvl in enumerate(LEVEL_ORDER)}
+    allowed_levels = [lvl for lvl in LEVEL_ORDER if level_index[lvl] <= level_index[max_level]]
+    context_chunks = await hybrid_retriever.retrieve(
+        query=request.question,
+        doc_filename=request.document_filename,
+        top_k=request.top_k or 15,
+        allowed_levels=allowed_levels
+    )
+    
+    print(f"Found {len(context_chunks)} relevant chunks")
+    
+    if not context_chunks:
+        q = request.question.strip()
+        list_patterns = [
+            ('เอกสาร' in q or 'ไฟล์' in q or 'document' in q or 'documents' in q or 'files' in q),
+            ('อะไร' in q or 'บ้าง' in q or 'ไหน' in q or 'list' in q or 'รายการ' in q)
+        ]
+        if all(list_patterns):
+            # Fallback: list accessible documents
+            docs = await adb.list_documents(max_level=max_level)
+            if docs:
+                answer_lines = ["เอกสารที่คุณเข้าถึงได้ (จำกัดตามระดับสิทธิ์):"]
+                for d in docs:
+                    answer_lines.append(f"- {d['title']} (ไฟล์: {d['filename']}, ระดับ: {d.get('classification','?')})")
+                return [], {
+                    "answer": "\n".join(answer_lines),
+                    "sources": [{
+                        "doc_id": d['doc_id'],
+                        "filename": d['filename'],
+                        "title": d['title'],
+                        "classification": d.get('classification')
+                    } for d in docs]
+                }
+            else:
+                return [], {"answer": "ยังไม่มีเอกสารที่คุณเข้าถึงได้", "sources": []}
+        return [], {"answer": "ไม่พบข้อมูลที่เกี่ยวข้องกับคำถามของคุณ", "sources": []}
+    
+    return context_chunks, None
+
+async def answer_question(request: QuestionRequest, max_level: str) -> Dict:
+    """Retrieval and answer generation for /ask, once access has been checked."""
+    context_chunks, fallback = await ask_context(request, max_level)
+    if fallback:
+        return fallback
+    
+    result = await llm_handler.generate_answer(request.question, context_chunks, use_cache=not request.bypass_cache)
+    
+    return result
+
 @app.post("/ask")
 async def ask_question(request: QuestionRequest, user=Depends(get_current_user)):
     try:
         print(f"Question received: {request.question}")
-
-        # If specific document specified, verify access
-        if request.document_filename:
-            doc = db.get_document_by_filename(request.document_filename)
-            if not doc:
-                raise HTTPException(status_code=404, detail="Document not found")
-            if not has_access(user, doc['classification']):
-                raise HTTPException(status_code=403, detail="No access to this document")
+        statement_log.record_request()
+        await check_question_access(request, user)
 
         # If no document specified and user is very low level (PUBLIC) we still allow, but all retrieval will be limited by list_documents filtering already.
 
-        level_index = {lvl:i for i,lvl in enumerate(LEVEL_ORDER)}
-        allowed_levels = [lvl for lvl in LEVEL_ORDER if level_index[lvl] <= level_index[user.max_level]]
-        context_chunks = await hybrid_retriever.retrieve(
-            query=request.question,
-            doc_filename=request.document_filename,
-            top_k=request.top_k or 15,
-            allowed_levels=allowed_levels
+        # Identical questions asked at the same time (same scope and clearance)
+        # share one retrieval + LLM run
+        flight_key = (
+            normalize_query(request.question), request.document_filename, user.max_level,
+            request.top_k, request.bypass_cache
         )
-        
-        print(f"Found {len(context_chunks)} relevant chunks")
-        
-        if not context_chunks:
-            q = request.question.strip()
-            list_patterns = [
-                ('เอกสาร' in q or 'ไฟล์' in q or 'document' in q or 'documents' in q or 'files' in q),
-                ('อะไร' in q or 'บ้าง' in q or 'ไหน' in q or 'list' in q or 'รายการ' in q)
-            ]
-            if all(list_patterns):
-                # Fallback: list accessible documents
-                docs = db.list_documents(max_level=user.max_level)
-                if docs:
-                    answer_lines = ["เอกสารที่คุณเข้าถึงได้ (จำกัดตามระดับสิทธิ์):"]
-                    for d in docs:
-                        answer_lines.append(f"- {d['title']} (ไฟล์: {d['filename']}, ระดับ: {d.get('classification','?')})")
-                    return {
-                        "answer": "\n".join(answer_lines),
-                        "sources": [{
-                            "doc_id": d['doc_id'],
-                            "filename": d['filename'],
-                            "title": d['title'],
-                            "classification": d.get('classification')
-                        } for d in docs]
-                    }
-                else:
-                    return {"answer": "ยังไม่มีเอกสารที่คุณเข้าถึงได้", "sources": []}
-            return {"answer": "ไม่พบข้อมูลที่เกี่ยวข้องกับคำถามของคุณ", "sources": []}
-        
-        result = llm_handler.generate_answer(request.question, context_chunks)
-        
-        return result
+        return await ask_flights.run(flight_key, lambda: answer_question(request, user.max_level))
     
     except Exception as e:
         print(f"Error in ask_question: {str(e)}")
@@ -334,10 +462,51 @@ async def ask_question(request: QuestionRequest, user=Depends(get_current_user))
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest, user=Depends(get_current_user)):
+    """/ask as Server-Sent Events: a 'sources' event once retrieval is done, then
+    'token' events as DeepSeek produces the answer, then 'done' (or 'error')."""
+    try:
+        print(f"Question received (stream): {request.question}")
+        statement_log.record_request()
+        await check_question_access(request, user)
+        context_chunks, fallback = await ask_context(request, user.max_level)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in ask_question_stream: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        try:
+            if fallback:
+                yield sse_event('sources', fallback['sources'])
+                yield sse_event('token', fallback['answer'])
+                yield sse_event('done', {'cached': False})
+                return
+            async for event, data in llm_handler.stream_answer(
+                request.question, context_chunks, use_cache=not request.bypass_cache
+            ):
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"Error streaming answer: {str(e)}")
+            yield sse_event('error', {'detail': str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/documents")
 async def list_documents(user=Depends(get_current_user)):
     try:
-        documents = db.list_documents(max_level=user.max_level)
+        documents = await adb.list_documents(max_level=user.max_level)
         return {"documents": documents}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -345,12 +514,18 @@ async def list_documents(user=Depends(get_current_user)):
 @app.post("/page")
 async def get_page(request: PageRequest, user=Depends(get_current_user)):
     try:
-        doc = db.get_document_by_filename(request.filename)
+        doc = await adb.get_document_info(request.filename)
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
         if not has_access(user, doc['classification']):
             raise HTTPException(status_code=403, detail="No access to this document")
-        content = retriever.get_page_content(request.filename, request.page_number)
+        end_page = request.end_page or request.page_number
+        if end_page < request.page_number or end_page - request.page_number + 1 > Config.PAGE_WINDOW_MAX_PAGES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid page range (max {Config.PAGE_WINDOW_MAX_PAGES} pages)"
+            )
+        content = await adb.get_page_window(doc['doc_id'], request.page_number, end_page)
         if not content:
             raise HTTPException(status_code=404, detail="Page not found")
         
@@ -359,60 +534,96 @@ async def get_page(request: PageRequest, user=Depends(get_current_user)):
         return {
             "filename": request.filename,
             "page": request.page_number,
+            "end_page": end_page,
             "content": page_text,
             "chunks": content
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "models": model_registry.status()}
+
+@app.get("/ready")
+async def readiness_check():
+    # 503 until the warm-up models are loaded, so traffic waits for a warm worker;
+    # a worker whose warm-up failed stays 503 and says which models failed
+    if not model_registry.ready:
+        status = model_registry.status()
+        return JSONResponse(status_code=503, content={
+            "status": "failed" if status['failed'] else "warming up",
+            "models": status
+        })
+    return {"status": "ready", "models": model_registry.status()}
+
+async def _resolve_pdf(meta: Dict) -> Optional[Dict]:
+    """Return the blob store path/ref for a document's PDF (None if missing).
+
+    meta is the catalog entry, so the common case needs no database call.
+    Legacy rows that still hold the PDF inline are moved to the blob store on
+    first access.
+    """
+    ref = meta.get('file_ref')
+    if not ref:
+        info = await adb.get_document_file(meta['doc_id'])
+        if info and info['has_blob']:
+            print(f"Moving legacy PDF for doc_id {meta['doc_id']} into blob store")
+            ref = await adb.move_pdf_to_blob_store(meta['doc_id'], blob_store)
+    path = blob_store.local_path(ref) if ref else None
+    if not path:
+        return None
+    return {'path': path, 'ref': ref, 'filename': meta['filename']}
+
+def _pdf_response(request: Request, pdf: Dict, disposition: str):
+    """Serve a stored PDF with a strong ETag and HTTP Range support.
+
+    FileResponse streams from disk (sendfile where the server supports it)
+    and answers Range requests with 206, so the browser PDF viewer can fetch
+    just the byte ranges it needs.
+    """
+    etag = f'"{pdf["ref"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={Config.PDF_CACHE_MAX_AGE}",
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    # Encode filename for Content-Disposition header
+    encoded_filename = quote(pdf['filename'].encode('utf-8'))
+    headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{encoded_filename}"
+    return FileResponse(pdf['path'], media_type="application/pdf", headers=headers)
 
 @app.get("/document/{doc_id}/check-pdf")
 async def check_pdf_exists(doc_id: int, user=Depends(get_current_user_flexible)):
     try:
-        meta = db.get_document_meta(doc_id)
-        if not meta or not has_access(user, meta['classification']):
+        info = await adb.get_document_file(doc_id)
+        if not info or not has_access(user, info['classification']):
             return {"exists": False, "filename": None}
-        pdf_data, filename = db.get_pdf_file(doc_id)
+        exists = bool(info['file_ref'] or info['has_blob'])
         return {
-            "exists": pdf_data is not None,
-            "filename": filename if pdf_data else None
+            "exists": exists,
+            "filename": info['filename'] if exists else None
         }
     except Exception as e:
         print(f"Error checking PDF: {str(e)}")
         return {"exists": False, "filename": None}
 
 @app.get("/document/{doc_id}/pdf")
-async def get_pdf(doc_id: int, user=Depends(get_current_user_flexible)):
+async def get_pdf(doc_id: int, request: Request, user=Depends(get_current_user_flexible)):
     try:
-        print(f"Requesting PDF for doc_id: {doc_id}")
-        meta = db.get_document_meta(doc_id)
+        meta = await adb.get_document_meta(doc_id)
         if not meta or not has_access(user, meta['classification']):
             raise HTTPException(status_code=403, detail="No access to this document")
-        pdf_data, filename = db.get_pdf_file(doc_id)
-        
-        if not pdf_data:
+        pdf = await _resolve_pdf(meta)
+        if not pdf:
             print(f"PDF not found for doc_id: {doc_id}")
             raise HTTPException(status_code=404, detail="ไม่พบไฟล์ PDF หรือเอกสารนี้อัพโหลดก่อนระบบเก็บ PDF")
-        
-        print(f"Returning PDF: {filename.encode('utf-8', 'ignore').decode('utf-8')} ({len(pdf_data)} bytes)")
-        
-        # Encode filename for Content-Disposition header
-        encoded_filename = quote(filename.encode('utf-8'))
-        
-        return StreamingResponse(
-            io.BytesIO(pdf_data),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}",
-                "Content-Type": "application/pdf",
-                "Cache-Control": "no-cache",
-                "Access-Control-Allow-Origin": "*",
-                "X-Content-Type-Options": "nosniff"
-            }
-        )
+        return _pdf_response(request, pdf, "inline")
     except HTTPException:
         raise
     except Exception as e:
@@ -422,26 +633,15 @@ async def get_pdf(doc_id: int, user=Depends(get_current_user_flexible)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/document/{doc_id}/download")
-async def download_pdf(doc_id: int, user=Depends(get_current_user_flexible)):
+async def download_pdf(doc_id: int, request: Request, user=Depends(get_current_user_flexible)):
     try:
-        meta = db.get_document_meta(doc_id)
+        meta = await adb.get_document_meta(doc_id)
         if not meta or not has_access(user, meta['classification']):
             raise HTTPException(status_code=403, detail="No access to this document")
-        pdf_data, filename = db.get_pdf_file(doc_id)
-        if not pdf_data:
+        pdf = await _resolve_pdf(meta)
+        if not pdf:
             raise HTTPException(status_code=404, detail="ไม่พบไฟล์ PDF หรือเอกสารนี้อัพโหลดก่อนระบบเก็บ PDF")
-        
-        # Encode filename for Content-Disposition header
-        encoded_filename = quote(filename.encode('utf-8'))
-        
-        return StreamingResponse(
-            io.BytesIO(pdf_data),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
-                "Content-Type": "application/pdf"
-            }
-        )
+        return _pdf_response(request, pdf, "attachment")
     except HTTPException:
         raise
     except Exception as e:
@@ -502,7 +702,7 @@ async def upload_template(
 
     # Insert into DB
     template_name = os.path.splitext(os.path.basename(filename))[0]
-    template_id = db.insert_template(
+    template_id = await adb.insert_template(
         name=template_name,
         original_filename=filename,
         doc_type=doc_type or 'unknown',
@@ -514,9 +714,9 @@ async def upload_template(
     logger.info("[UPLOAD] Inserted template id=%s name=%s", template_id, template_name)
 
     # Analyze placeholders with LLM
-    fields = llm_handler.analyze_template_placeholders(content_text)
+    fields = await llm_handler.analyze_template_placeholders(content_text)
     try:
-        db.update_template_fields(template_id, json.dumps(fields, ensure_ascii=False))
+        await adb.update_template_fields(template_id, json.dumps(fields, ensure_ascii=False))
     except Exception as e:
         logger.exception("[UPLOAD] Failed to save fields_json")
 
@@ -534,12 +734,12 @@ async def upload_template(
 
 @app.get("/templates")
 async def list_templates_api(user=Depends(get_current_user)):
-    items = db.list_templates()
+    items = await adb.list_templates()
     return {"templates": items}
 
 @app.get("/templates/{template_id}/fields")
 async def get_template_fields(template_id: int, user=Depends(get_current_user)):
-    t = db.get_template_by_id(template_id)
+    t = await adb.get_template_by_id(template_id)
     if not t:
         raise HTTPException(status_code=404, detail="Template not found")
     try:
@@ -555,7 +755,7 @@ async def get_template_fields(template_id: int, user=Depends(get_current_user)):
 
 @app.post("/templates/{template_id}/generate")
 async def generate_contract(template_id: int, payload: Dict, user=Depends(get_current_user)):
-    t = db.get_template_by_id(template_id)
+    t = await adb.get_template_by_id(template_id)
     if not t:
         raise HTTPException(status_code=404, detail="Template not found")
 
@@ -577,7 +777,7 @@ async def generate_contract(template_id: int, payload: Dict, user=Depends(get_cu
 
     template_text = t.get('content_text') or ''
     logger.info("[GENERATE] Calling LLM to fill template (template_text_len=%d)", len(template_text))
-    final_text = llm_handler.fill_template_with_values(template_text, values)
+    final_text = await llm_handler.fill_template_with_values(template_text, values)
     logger.info("[GENERATE] Final text length=%d", len(final_text))
 
     # Build docx from final_text (paragraphs by newline)
@@ -0,0 +1,376 @@
+import asyncio
+import oracledb
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Tuple
+from config import Config
+from catalog import DocumentCatalog
+from database import (
+    INSERT_DOCUMENT_SQL, INSERT_CHUNK_SQL, DOCUMENT_BY_FILENAME_SQL, CATALOG_ENTRIES_SQL, CATALOG_VERSION_SQL,
+    CREATE_VECTOR_INDEX_SQL, DOCUMENT_FILE_SQL, MOVE_PDF_TO_BLOB_STORE_SQL, DELETE_DOCUMENT_SQL, FILE_REF_IN_USE_SQL,
+    PDF_BY_ID_SQL, PDF_BY_FILENAME_SQL, INSERT_TEMPLATE_SQL, UPDATE_TEMPLATE_FIELDS_SQL,
+    LIST_TEMPLATES_SQL, TEMPLATE_BY_ID_SQL, CHUNK_NEIGHBOURS_SQL, SEGMENTS_BY_ID_SQL, UPSERT_DOCUMENT_VECTOR_SQL,
+    document_params, chunk_params, similar_chunks_query, lexical_chunks_query, similar_documents_query, document_match_from_row, page_window_query, json_id_list, hydrate_replica_hits,
+    segment_from_row, tune_cursor, document_from_row, document_file_from_row, catalog_entry_from_row,
+    template_summary_from_row, template_from_row, returned_id, schema_error, parse_json,
+    PoolWaitStats, pool_stats, SESSION_CURSOR_STATS_SQL, statement_log
+)
+
+
+async def _read_lob(value, default=''):
+    """Materialize an AsyncLOB (or pass through an already-fetched value)."""
+    if value is None:
+        return default
+    if hasattr(value, 'read'):
+        return await value.read()
+    return value
+
+
+async def _init_session(conn, requested_tag):
+    """Async pool session_callback: run Config.DB_SESSION_INIT_SQL on new sessions."""
+    cur = conn.cursor()
+    for statement in Config.DB_SESSION_INIT_SQL:
+        await cur.execute(statement)
+
+
+class AsyncOracleVectorDB:
+    """asyncio counterpart of OracleVectorDB for use inside FastAPI routes.
+
+    Built on oracledb.create_pool_async so waiting on Oracle yields the event
+    loop instead of blocking every other request on the worker. Statement text
+    and row mapping are shared with database.py.
+    """
+
+    def __init__(self, catalog: Optional[DocumentCatalog] = None, vector_replica=None):
+        self.pool = None
+        self.wait_stats = PoolWaitStats()
+        self.catalog = catalog or DocumentCatalog(Config.CATALOG_REFRESH_SECONDS)
+        self.vector_replica = vector_replica
+
+    async def open(self):
+        """Create the async pool; call from the application startup hook."""
+        params = Config.pool_params()
+        if Config.DB_SESSION_INIT_SQL:
+            params['session_callback'] = _init_session
+        self.pool = oracledb.create_pool_async(**params)
+        # Verify schema exists (no auto-creation). Will raise if missing.
+        await self._check_schema()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def get_connection(self):
+        """Async context manager: ``async with db.get_connection() as conn``."""
+        start = time.perf_counter()
+        try:
+            conn = await self.pool.acquire()
+        except oracledb.Error:
+            self.wait_stats.record_failure()
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def get_pool_stats(self) -> Dict:
+        cursor_rows = None
+        try:
+            async with self.get_connection() as conn:
+                cur = conn.cursor()
+                await cur.execute(SESSION_CURSOR_STATS_SQL)
+                cursor_rows = await cur.fetchall()
+        except oracledb.Error as e:
+            print(f"Cursor cache stats unavailable: {e}")
+        return pool_stats(self.pool, self.wait_stats, cursor_rows)
+
+    async def get_user_for_login(self, username: str) -> Optional[Tuple]:
+        """Return (id, username, password_hash, role, max_level) or None."""
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(
+                "SELECT id, username, password_hash, role, max_level FROM users WHERE username = :u",
+                u=username
+            )
+            return await cur.fetchone()
+
+    def _parse_json(self, data):
+        return parse_json(data)
+
+    async def insert_document(self, filename: str, title: str, abstract: str, total_pages: int, metadata: Dict,
+                              file_ref: Optional[str] = None, file_size: Optional[int] = None,
+                              classification: str = "PUBLIC") -> int:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            id_var = cur.var(oracledb.NUMBER)
+            params = document_params(filename, title, abstract, total_pages, metadata, file_ref, file_size, classification)
+            params['id'] = id_var
+            await cur.execute(INSERT_DOCUMENT_SQL, params)
+            doc_id = returned_id(id_var)
+            if doc_id is None:
+                raise RuntimeError("Failed to retrieve returned document ID")
+            await conn.commit()
+            self.catalog.invalidate()
+            return doc_id
+
+    async def delete_document(self, doc_id: int):
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(DELETE_DOCUMENT_SQL, i=doc_id)
+            await conn.commit()
+        self.catalog.invalidate()
+
+    async def file_ref_in_use(self, file_ref: str) -> bool:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(FILE_REF_IN_USE_SQL, r=file_ref)
+            row = await cur.fetchone()
+            return bool(row and row[0])
+
+    async def insert_chunk(self, doc_id: int, chunk_text: str, chunk_type: str,
+                           page_number: int, chunk_order: int, embedding: List[float], metadata: Dict):
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(
+                INSERT_CHUNK_SQL,
+                chunk_params(doc_id, chunk_text, chunk_type, page_number, chunk_order, embedding, metadata)
+            )
+            await conn.commit()
+
+    async def search_similar_chunks(self, query_embedding: List[float], doc_id: Optional[int] = None,
+                                    top_k: int = 10, allowed_levels: Optional[List[str]] = None,
+                                    doc_ids: Optional[List[int]] = None) -> List[Dict]:
+        if self.vector_replica is not None and self.vector_replica.ready:
+            hits = self.vector_replica.search(query_embedding, top_k, doc_id, allowed_levels, doc_ids)
+            if not hits:
+                return []
+            segments = await self.fetch_segments(SEGMENTS_BY_ID_SQL, {'ids': json_id_list(sid for sid, _ in hits)})
+            return hydrate_replica_hits(hits, segments)
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=top_k)
+            sql, params = similar_chunks_query(query_embedding, doc_id, top_k, allowed_levels, doc_ids)
+            statement_log.record(sql)
+            await cur.execute(sql, params)
+            return [dict(segment_from_row(r), distance=r[10]) for r in await cur.fetchall()]
+
+    async def search_lexical_chunks(self, text_query: str, doc_id: Optional[int] = None,
+                                    top_k: int = 20, allowed_levels: Optional[List[str]] = None,
+                                    doc_ids: Optional[List[int]] = None) -> List[Dict]:
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=top_k)
+            sql, params = lexical_chunks_query(text_query, doc_id, top_k, allowed_levels, doc_ids)
+            statement_log.record(sql)
+            await cur.execute(sql, params)
+            return [dict(segment_from_row(r), lexical_score=r[10]) for r in await cur.fetchall()]
+
+    async def search_documents(self, query_embedding: List[float], top_m: int = 5,
+                               allowed_levels: Optional[List[str]] = None) -> List[Dict]:
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=top_m)
+            sql, params = similar_documents_query(query_embedding, top_m, allowed_levels)
+            statement_log.record(sql)
+            await cur.execute(sql, params)
+            return [document_match_from_row(r) for r in await cur.fetchall()]
+
+    async def upsert_document_vector(self, doc_id: int, vector: List[float]):
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(UPSERT_DOCUMENT_VECTOR_SQL, {'doc_id': doc_id, 'embed': str(vector)})
+            await conn.commit()
+
+    async def fetch_segments(self, sql: str, params: Dict, arraysize: int = 100) -> List[Dict]:
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=arraysize)
+            statement_log.record(sql)
+            await cur.execute(sql, params)
+            return [segment_from_row(r) for r in await cur.fetchall()]
+
+    async def get_page_window(self, doc_id: int, first_page: int, last_page: Optional[int] = None,
+                              pages: Optional[List[int]] = None) -> List[Dict]:
+        sql, params = page_window_query(doc_id, first_page, last_page, pages)
+        return await self.fetch_segments(sql, params, arraysize=200)
+
+    async def get_chunk_neighbours(self, chunk_ids: List[int], radius: int = 1) -> List[Dict]:
+        if not chunk_ids:
+            return []
+        return await self.fetch_segments(
+            CHUNK_NEIGHBOURS_SQL,
+            {'ids': json_id_list(chunk_ids), 'radius': radius},
+            arraysize=200
+        )
+
+    async def fetch_dicts(self, sql: str, params: Dict, arraysize: int = 100) -> List[Dict]:
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=arraysize)
+            statement_log.record(sql)
+            await cur.execute(sql, params)
+            columns = [col[0].lower() for col in cur.description]
+            return [dict(zip(columns, row)) for row in await cur.fetchall()]
+
+    async def get_document_by_filename(self, filename: str) -> Optional[Dict]:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(DOCUMENT_BY_FILENAME_SQL, fn=filename)
+            row = await cur.fetchone()
+            if not row:
+                return None
+            return document_from_row(row)
+
+    async def _fresh_catalog(self) -> DocumentCatalog:
+        """Return the catalog, reloading it if the version counter moved."""
+        if not self.catalog.is_stale():
+            return self.catalog
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            version = None
+            try:
+                await cur.execute(CATALOG_VERSION_SQL)
+                row = await cur.fetchone()
+                version = row[0] if row else None
+            except oracledb.Error as e:
+                print(f"Catalog version unavailable, reloading catalog: {e}")
+            if version is None or version != self.catalog.version:
+                await cur.execute(CATALOG_ENTRIES_SQL)
+                self.catalog.load([catalog_entry_from_row(r) for r in await cur.fetchall()], version)
+            else:
+                self.catalog.mark_checked()
+        return self.catalog
+
+    async def _lookup_document(self, where: str, **params) -> Optional[Dict]:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            sql = f"{CATALOG_ENTRIES_SQL} WHERE {where}"
+            statement_log.record(sql)
+            await cur.execute(sql, params)
+            row = await cur.fetchone()
+        if not row:
+            return None
+        self.catalog.invalidate()
+        return catalog_entry_from_row(row)
+
+    async def get_document_meta(self, doc_id: int) -> Optional[Dict]:
+        return (await self._fresh_catalog()).get_by_id(doc_id) or await self._lookup_document("id = :i", i=doc_id)
+
+    async def get_document_info(self, filename: str) -> Optional[Dict]:
+        return ((await self._fresh_catalog()).get_by_filename(filename)
+                or await self._lookup_document("file_name = :fn", fn=filename))
+
+    async def list_documents(self, max_level: Optional[str] = None) -> List[Dict]:
+        return (await self._fresh_catalog()).list(max_level)
+
+    async def create_vector_index(self):
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                await cur.execute(CREATE_VECTOR_INDEX_SQL)
+                await conn.commit()
+                print("Vector index created")
+            except Exception as e:
+                print(f"Vector index existing or error: {e}")
+
+    async def get_document_file(self, doc_id: int) -> Optional[Dict]:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(DOCUMENT_FILE_SQL, i=doc_id)
+            row = await cur.fetchone()
+            return document_file_from_row(row) if row else None
+
+    async def move_pdf_to_blob_store(self, doc_id: int, blob_store) -> Optional[str]:
+        pdf_data, _ = await self.get_pdf_file(doc_id)
+        if not pdf_data:
+            return None
+        ref = await asyncio.to_thread(blob_store.put, pdf_data)
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(MOVE_PDF_TO_BLOB_STORE_SQL, r=ref, s=len(pdf_data), i=doc_id)
+            await conn.commit()
+        return ref
+
+    async def get_pdf_file(self, doc_id: int) -> Tuple[Optional[bytes], Optional[str]]:
+        """Get PDF file content by document ID."""
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(PDF_BY_ID_SQL, id=doc_id)
+            row = await cur.fetchone()
+            if not row:
+                print(f"No document found with doc_id {doc_id}")
+                return None, None
+            pdf_blob, filename = row
+            if not pdf_blob:
+                print(f"No PDF data for doc_id {doc_id}")
+                return None, None
+            return await _read_lob(pdf_blob, None), filename
+
+    async def get_pdf_file_by_filename(self, filename: str) -> Optional[bytes]:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(PDF_BY_FILENAME_SQL, fn=filename)
+            row = await cur.fetchone()
+            if row and row[0]:
+                return await _read_lob(row[0], None)
+            return None
+
+    async def _check_schema(self):
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                await cur.execute("SELECT 1 FROM user_tables WHERE table_name = 'DOCUMENTS'")
+                has_docs = await cur.fetchone() is not None
+                await cur.execute("SELECT 1 FROM user_tables WHERE table_name = 'CONTENT_SEGMENTS'")
+                has_segments = await cur.fetchone() is not None
+            except Exception as e:
+                raise RuntimeError(f"Schema check failed: {e}")
+            error = schema_error(has_docs, has_segments)
+            if error:
+                raise error
+
+    # ================= Templates API =================
+    async def insert_template(self, name: str, original_filename: str, doc_type: str, language: str,
+                              file_bytes: bytes, content_text: str, created_by: str) -> int:
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            id_var = cur.var(oracledb.NUMBER)
+            await cur.execute(
+                INSERT_TEMPLATE_SQL,
+                name=name,
+                original_filename=original_filename,
+                doc_type=doc_type,
+                language=language,
+                content_text=content_text,
+                file_data=file_bytes,
+                created_by=created_by,
+                id=id_var
+            )
+            new_id = returned_id(id_var)
+            if new_id is None:
+                await cur.execute("SELECT MAX(id) FROM templates")
+                row = await cur.fetchone()
+                if not row or row[0] is None:
+                    raise RuntimeError("Failed to retrieve new template id")
+                new_id = int(row[0])
+            await conn.commit()
+            return new_id
+
+    async def update_template_fields(self, template_id: int, fields_json: str):
+        async with self.get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(UPDATE_TEMPLATE_FIELDS_SQL, f=fields_json, i=template_id)
+            await conn.commit()
+
+    async def list_templates(self) -> List[Dict]:
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor())
+            await cur.execute(LIST_TEMPLATES_SQL)
+            return [template_summary_from_row(r) for r in await cur.fetchall()]
+
+    async def get_template_by_id(self, template_id: int) -> Optional[Dict]:
+        async with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=1)
+            await cur.execute(TEMPLATE_BY_ID_SQL, i=template_id)
+            row = await cur.fetchone()
+            if not row:
+                return None
+            return template_from_row(row)
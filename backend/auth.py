@@ -5,8 +5,6 @@ from fastapi import HTTPException, Depends, Header, Query
 from pydantic import BaseModel
 from jose import jwt, JWTError
 import bcrypt
-import oracledb
-from config import Config
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change")
 JWT_ALG = "HS256"
@@ -42,20 +40,14 @@ def decode_token(token: str) -> dict:
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-def get_db_conn():
-    dsn = Config.build_dsn()
-    return oracledb.connect(user=Config.DB_USER, password=Config.DB_PASSWORD, dsn=dsn)
-
-def authenticate_user(username: str, password: str):
-    with get_db_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT id, username, password_hash, role, max_level FROM users WHERE username = :u", u=username)
-        row = cur.fetchone()
-        if not row:
-            return None
-        if not verify_password(password, row[2]):
-            return None
-        return {"id": row[0], "username": row[1], "role": row[3], "max_level": row[4]}
+async def authenticate_user(db, username: str, password: str):
+    """Check credentials against the users table via the shared async pool."""
+    row = await db.get_user_for_login(username)
+    if not row:
+        return None
+    if not verify_password(password, row[2]):
+        return None
+    return {"id": row[0], "username": row[1], "role": row[3], "max_level": row[4]}
 
 def get_current_user(authorization: Optional[str] = Header(None)) -> TokenData:
     if not authorization or not authorization.startswith("Bearer "):
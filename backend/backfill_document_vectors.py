@@ -0,0 +1,27 @@
+"""Compute document routing vectors for documents ingested before they existed.
+
+Run once after applying database/alter_add_document_vectors.sql:
+    python backfill_document_vectors.py
+"""
+from database import OracleVectorDB
+from embeddings import EmbeddingGenerator
+
+
+def main():
+    db = OracleVectorDB()
+    embedder = EmbeddingGenerator()
+    docs = db.get_documents_without_vector()
+    print(f"{len(docs)} documents without a routing vector")
+    for doc in docs:
+        vector = embedder.document_vector(
+            doc['title'],
+            doc['abstract'],
+            db.get_segment_vectors(doc['doc_id']),
+            table_of_contents=doc['table_of_contents']
+        )
+        db.upsert_document_vector(doc['doc_id'], vector)
+        print(f"  doc_id {doc['doc_id']}: {doc['title'][:60]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Time QueryAnalysis on a question set.
+
+Each question (one per line; a built-in Thai/English sample when no file is
+given) is analysed repeatedly without the memo cache, so the figure is the
+cost of a cold analysis: one keyword-automaton pass plus the page regexes.
+
+    python benchmark_query_analysis.py [questions.txt] [--rounds 2000] [--budget-us 50]
+
+Exits non-zero if the mean exceeds the budget.
+"""
+import argparse
+import statistics
+import sys
+import time
+from query_analysis import QueryAnalysis
+
+SAMPLE_QUESTIONS = [
+    'ขอดูเนื้อหาหน้า 5',
+    'หน้า 12-15 พูดถึงอะไร',
+    'สรุปหน้า 3 และ 7 ให้หน่อย',
+    'เอกสารที่มีมากกว่า 10 หน้ามีอะไรบ้าง',
+    'มีเอกสารทั้งหมดกี่ไฟล์',
+    'เอกสารที่อัพโหลดเดือนมีนาคม 2567',
+    'เอกสารระดับลับมากมีอะไรบ้าง',
+    'สัญญาไหนกำหนดค่าปรับกรณีส่งมอบล่าช้า',
+    'ค่าปรับกรณีผิดสัญญาคิดอย่างไร',
+    'สรุปภาพรวมของสัญญาเช่าฉบับนี้ เกี่ยวกับค่าปรับและการบอกเลิกสัญญา',
+    'ผู้เช่าต้องแจ้งล่วงหน้ากี่วันก่อนบอกเลิกสัญญา',
+    'which document mentions the termination penalty for late payment?',
+    'summarize the confidentiality obligations in this document',
+    'how many pages does the lease agreement have',
+    'show me the tables from page 4 to 6',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('questions', nargs='?')
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--budget-us', type=float, default=50.0)
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = SAMPLE_QUESTIONS
+
+    for question in questions:
+        QueryAnalysis(question)  # warm up
+
+    per_question = []
+    for question in questions:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            QueryAnalysis(question)
+        per_question.append((time.perf_counter() - start) / args.rounds * 1e6)
+
+    print(f"{len(questions)} questions x {args.rounds} rounds")
+    print(f"mean   {statistics.mean(per_question):.1f} us/query")
+    print(f"median {statistics.median(per_question):.1f} us/query")
+    print(f"max    {max(per_question):.1f} us/query  ({questions[per_question.index(max(per_question))][:60]})")
+    if statistics.mean(per_question) > args.budget_us:
+        print(f"Over budget ({args.budget_us} us)")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
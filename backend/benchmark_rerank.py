@@ -0,0 +1,98 @@
+"""Compare single-stage and cascade reranking on real candidates.
+
+Each question in the file (one per line) is embedded, its vector candidates are
+fetched the way DocumentRetriever fetches them, and the same candidates are
+reranked twice: by the large model alone and by the cascade. The score cache is
+disabled so both runs pay for inference.
+
+    python benchmark_rerank.py questions.txt [--doc contract.pdf] [--candidates 50] [--top-k 10]
+
+Reports per-stage latency, large-model pairs saved, and how far the cascade's
+top-k drifts from the single-stage top-k (overlap@k, top-1 agreement).
+"""
+import argparse
+import statistics
+from config import Config
+from database import OracleVectorDB
+from embeddings import EmbeddingGenerator
+from rerank_cache import RerankScoreCache
+from reranker import Reranker
+
+
+def top_ids(chunks, top_k):
+    return [c.get('chunk_id') for c in chunks[:top_k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('questions')
+    parser.add_argument('--doc', help='restrict candidates to one document filename')
+    parser.add_argument('--candidates', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.questions, encoding='utf-8') as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    db = OracleVectorDB()
+    embedder = EmbeddingGenerator()
+    reranker = Reranker()
+    reranker.score_cache = RerankScoreCache(0)
+    first_stage = reranker.first_stage_model
+    if first_stage is None:
+        reranker.load_first_stage(Config.RERANK_FIRST_STAGE_MODEL)
+        first_stage = reranker.first_stage_model
+    if first_stage is None:
+        raise SystemExit("First-stage model could not be loaded")
+
+    doc_id = None
+    if args.doc:
+        doc = db.get_document_info(args.doc)
+        if not doc:
+            raise SystemExit(f"Document not found: {args.doc}")
+        doc_id = doc['doc_id']
+
+    single_ms, stage1_ms, stage2_ms, pruned, overlaps, top1 = [], [], [], [], [], []
+    for question in questions:
+        candidates = db.search_similar_chunks(embedder.encode(question), doc_id, args.candidates)
+        for chunk in candidates:
+            chunk['score'] = 1 - chunk.pop('distance')
+        if not candidates:
+            print(f"  (no candidates) {question[:60]}")
+            continue
+
+        # rerank stamps the chunks it is given; each run gets fresh copies so the
+        # cascade run scores every pair instead of reusing the single-stage scores
+        reranker.first_stage_model = None
+        stats = {}
+        single = reranker.rerank(question, [dict(c) for c in candidates], top_k=args.top_k, rerank_stats=stats)
+        single_ms.append(stats.get('stage2_ms', 0.0))
+
+        reranker.first_stage_model = first_stage
+        stats = {}
+        cascade = reranker.rerank(question, [dict(c) for c in candidates], top_k=args.top_k, rerank_stats=stats)
+        stage1_ms.append(stats.get('stage1_ms', 0.0))
+        stage2_ms.append(stats.get('stage2_ms', 0.0))
+        pruned.append(stats.get('pairs_pruned', 0))
+
+        expected = top_ids(single, args.top_k)
+        got = top_ids(cascade, args.top_k)
+        overlaps.append(len(set(expected) & set(got)) / len(expected))
+        top1.append(bool(expected) and bool(got) and expected[0] == got[0])
+        print(f"  {single_ms[-1]:7.0f} ms single | {stage1_ms[-1]:6.0f} + {stage2_ms[-1]:6.0f} ms cascade | "
+              f"{pruned[-1]:3d}/{len(candidates)} pruned | overlap@{args.top_k} {overlaps[-1]:.2f} | {question[:50]}")
+
+    if not single_ms:
+        return
+    print(f"\n{len(single_ms)} questions, {args.candidates} candidates, top_k={args.top_k}")
+    print(f"single-stage   mean {statistics.mean(single_ms):7.0f} ms  median {statistics.median(single_ms):7.0f} ms")
+    cascade_total = [a + b for a, b in zip(stage1_ms, stage2_ms)]
+    print(f"cascade        mean {statistics.mean(cascade_total):7.0f} ms  median {statistics.median(cascade_total):7.0f} ms "
+          f"(first stage {statistics.mean(stage1_ms):.0f} ms, large model {statistics.mean(stage2_ms):.0f} ms)")
+    print(f"pruned pairs   mean {statistics.mean(pruned):.1f}")
+    print(f"overlap@{args.top_k}     mean {statistics.mean(overlaps):.3f}")
+    print(f"top-1 agrees   {sum(top1)}/{len(top1)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import hashlib
+import importlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Optional
+from config import Config
+
+
+def content_ref(data: bytes) -> str:
+    """The reference every backend stores data under: its SHA-256 hex digest."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore(ABC):
+    """Content-addressed storage for original PDFs.
+
+    Blobs are keyed by the SHA-256 of their bytes; the database stores only
+    that reference. Backends must be able to expose a local file path so the
+    API can serve it with FileResponse (sendfile, Range requests).
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def exists(self, ref: str) -> bool:
+        ...
+
+    @abstractmethod
+    def local_path(self, ref: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def delete(self, ref: str):
+        """Remove a blob; a missing one is not an error."""
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs under root/ab/cd/<sha256> on local disk (or a mounted volume)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, ref: str) -> str:
+        if len(ref) != 64 or any(ch not in '0123456789abcdef' for ch in ref):
+            raise ValueError(f"Invalid blob reference: {ref!r}")
+        return os.path.join(self.root, ref[:2], ref[2:4], ref)
+
+    def put(self, data: bytes) -> str:
+        ref = content_ref(data)
+        path = self._path(ref)
+        if os.path.exists(path):
+            return ref  # Identical content already stored
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file in the same directory, then rename atomically so
+        # readers never see a partially written blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return ref
+
+    def exists(self, ref: str) -> bool:
+        return os.path.exists(self._path(ref))
+
+    def local_path(self, ref: str) -> Optional[str]:
+        path = self._path(ref)
+        return path if os.path.exists(path) else None
+
+    def delete(self, ref: str):
+        try:
+            os.remove(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+
+def create_blob_store() -> BlobStore:
+    """Build the configured backend.
+
+    BLOB_STORE_BACKEND is 'local' or a dotted 'module:ClassName' whose
+    constructor takes the BLOB_STORE_PATH value.
+    """
+    backend = Config.BLOB_STORE_BACKEND
+    if backend == 'local':
+        return LocalBlobStore(Config.BLOB_STORE_PATH)
+    module_name, _, class_name = backend.partition(':')
+    store_cls = getattr(importlib.import_module(module_name), class_name)
+    return store_cls(Config.BLOB_STORE_PATH)
@@ -0,0 +1,189 @@
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence
+import numpy as np
+
+# Score columns a CandidateSet carries; a NaN cell means the chunk dict has no such key
+SCORE_COLUMNS = ('score', 'weighted_score', 'final_weighted_score')
+
+# Words marking the sections that summarise a document
+OVERVIEW_KEYWORDS = ['บทคัดย่อ', 'abstract', 'สรุป', 'summary', 'บทนำ', 'introduction',
+                     'วัตถุประสงค์', 'objective', 'ภาพรวม', 'overview']
+
+
+def candidate_key(chunk: Dict) -> tuple:
+    return (chunk.get('doc_id', 0), chunk.get('page', 0), chunk.get('chunk_id', 0))
+
+
+def descending_order(values: np.ndarray) -> np.ndarray:
+    """Indices sorting values high to low; ties keep their current order, as
+    list.sort(reverse=True) does."""
+    return np.argsort(-values, kind='stable')
+
+
+def occurrence_rank(keys: Sequence[Hashable]) -> np.ndarray:
+    """For each position, how many earlier positions share its key
+    (0 for the first chunk of a page, 1 for the second, ...)."""
+    codes: Dict[Hashable, int] = {}
+    groups = np.fromiter((codes.setdefault(k, len(codes)) for k in keys), dtype=np.int64, count=len(keys))
+    n = len(groups)
+    by_group = np.argsort(groups, kind='stable')
+    sorted_groups = groups[by_group]
+    positions = np.arange(n)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    run_start = np.maximum.accumulate(np.where(starts, positions, 0))
+    rank = np.empty(n, dtype=np.int64)
+    rank[by_group] = positions - run_start
+    return rank
+
+
+class Candidate:
+    """One retrieved chunk in a CandidateSet. The chunk dict is referenced,
+    never copied; its scores live in the set's columns."""
+
+    __slots__ = ('key', 'chunk', 'sources')
+
+    def __init__(self, key: tuple, chunk: Dict, sources: List[str]):
+        self.key = key
+        self.chunk = chunk
+        self.sources = sources
+
+
+class CandidateSet:
+    """Request-local fusion of retrieval results.
+
+    Candidates are kept in insertion order with one float64 array per score
+    column and an index from candidate key (doc, page, chunk id) to position,
+    so merging is a dict lookup and weighting, penalties, boosts and sorting
+    are array operations. Scores are written back to the chunk dicts only by
+    chunks(), which returns them best first.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.records: List[Candidate] = []
+        self.index: Dict[tuple, int] = {}
+        self.columns = {name: np.full(max(capacity, 8), np.nan) for name in SCORE_COLUMNS}
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Dict]) -> 'CandidateSet':
+        """Wrap already-scored chunks, reading whichever score columns they carry."""
+        chunks = list(chunks)
+        candidates = cls(len(chunks))
+        for chunk in chunks:
+            position = candidates._append(chunk, list(chunk.get('sources') or []))
+            for name in SCORE_COLUMNS:
+                if name in chunk:
+                    candidates.columns[name][position] = chunk[name]
+        return candidates
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name][:len(self.records)]
+
+    def add(self, chunks: List[Dict], source: str, weight: float, scores: Optional[np.ndarray] = None):
+        """Add one branch's chunks with weighted_score = score * weight.
+
+        A chunk already in the set (same key) gains the weighted score and
+        the source instead of being added again. scores defaults to each
+        chunk's 'score' (0.5 if missing).
+        """
+        if scores is None:
+            scores = np.fromiter((c.get('score', 0.5) for c in chunks), dtype=np.float64, count=len(chunks))
+        weighted = scores * weight
+        self._reserve(len(self.records) + len(chunks))
+        positions = np.empty(len(chunks), dtype=np.int64)
+        fresh = np.zeros(len(chunks), dtype=bool)
+        for i, chunk in enumerate(chunks):
+            position = self.index.get(candidate_key(chunk))
+            if position is None:
+                position = self._append(chunk, [source])
+                if 'score' in chunk:
+                    self.columns['score'][position] = chunk['score']
+                fresh[i] = True
+            else:
+                self.records[position].sources.append(source)
+            positions[i] = position
+
+        weighted_column = self.columns['weighted_score']
+        weighted_column[positions[fresh]] = 0.0
+        np.add.at(weighted_column, positions, weighted)
+
+    def penalise_repeats(self, max_per_page: int = 2, page_penalty: float = 0.7,
+                         max_per_document: int = 5, document_penalty: float = 0.8):
+        """final_weighted_score = weighted_score, damped for chunks that come after
+        max_per_page better ones from the same page or max_per_document from the
+        same document."""
+        self._sort_by(self.column('weighted_score'))
+        pages = occurrence_rank([(r.chunk.get('doc_id', 0), r.chunk.get('page', 0)) for r in self.records])
+        documents = occurrence_rank([r.chunk.get('doc_id', 0) for r in self.records])
+        penalty = (np.where(pages >= max_per_page, page_penalty, 1.0)
+                   * np.where(documents >= max_per_document, document_penalty, 1.0))
+        self.column('final_weighted_score')[:] = self.column('weighted_score') * penalty
+        self._sort_by(self.column('final_weighted_score'))
+
+    def boost_overview(self, preferred_types: List[str]):
+        """Scale every score column by 1.5 for a preferred chunk type and by
+        1 + 0.2 per distinct overview keyword in the text, then re-sort by the
+        most specific score each chunk has."""
+        preferred = np.fromiter((r.chunk.get('type') in preferred_types for r in self.records),
+                                dtype=bool, count=len(self.records))
+        # Chunk texts are long and the list is short: substring tests beat one automaton pass
+        keywords = np.fromiter(
+            (sum(1 for keyword in OVERVIEW_KEYWORDS if keyword in text)
+             for text in (r.chunk.get('text', '').lower() for r in self.records)),
+            dtype=np.float64, count=len(self.records)
+        )
+        boost = np.where(preferred, 1.5, 1.0) * (1.0 + 0.2 * keywords)
+        for name in SCORE_COLUMNS:
+            self.column(name)[:] *= boost  # NaN (absent) stays absent
+        for record, factor in zip(self.records, boost):
+            record.chunk['overview_boost'] = float(factor)
+        self._sort_by(self.ranking_score())
+
+    def ranking_score(self) -> np.ndarray:
+        """final_weighted_score, else weighted_score, else score, else 0."""
+        final = self.column('final_weighted_score')
+        weighted = self.column('weighted_score')
+        score = np.nan_to_num(self.column('score'), nan=0.0)
+        return np.where(np.isnan(final), np.where(np.isnan(weighted), score, weighted), final)
+
+    def chunks(self) -> List[Dict]:
+        """The chunk dicts in current order with their scores and sources set."""
+        columns = {name: self.column(name).tolist() for name in SCORE_COLUMNS}
+        chunks = []
+        for i, record in enumerate(self.records):
+            chunk = record.chunk
+            for name, values in columns.items():
+                if values[i] == values[i]:  # not NaN
+                    chunk[name] = values[i]
+            if record.sources:
+                chunk['sources'] = record.sources
+            chunks.append(chunk)
+        return chunks
+
+    def _append(self, chunk: Dict, sources: List[str]) -> int:
+        position = len(self.records)
+        key = candidate_key(chunk)
+        self.records.append(Candidate(key, chunk, sources))
+        self.index.setdefault(key, position)
+        return position
+
+    def _reserve(self, size: int):
+        capacity = len(self.columns['score'])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name, values in self.columns.items():
+            grown = np.full(capacity, np.nan)
+            grown[:len(values)] = values
+            self.columns[name] = grown
+
+    def _sort_by(self, values: np.ndarray):
+        order = descending_order(values)
+        self.records = [self.records[i] for i in order]
+        for name in SCORE_COLUMNS:
+            self.columns[name][:len(order)] = self.column(name)[order]
+        self.index = {}
+        for position, record in enumerate(self.records):
+            self.index.setdefault(record.key, position)
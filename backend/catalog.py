@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from config import Config
+
+# Ascending clearance order; a user at level N may read levels 1..N
+LEVEL_RANK = {"PUBLIC": 1, "INTERNAL": 2, "CONFIDENTIAL": 3, "SECRET": 4}
+
+# Entry fields used by the backend only, left out of list()
+PRIVATE_FIELDS = ('file_ref',)
+
+
+class DocumentCatalog:
+    """Process-wide in-memory index of document metadata.
+
+    Holds id, filename, title, page count, classification and upload date for
+    every document, indexed by id and by filename, so per-request lookups do
+    not cost a database round-trip. The DB layers reload it when the
+    catalog_state.version counter (bumped by a trigger on documents) changes;
+    the counter itself is checked at most every refresh_seconds.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.version = None
+        self._lock = threading.Lock()
+        self._by_id: Dict[int, Dict] = {}
+        self._by_filename: Dict[str, Dict] = {}
+        self._loaded = False
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[set], None]] = []
+
+    def is_stale(self) -> bool:
+        return not self._loaded or time.monotonic() - self._checked_at >= self.refresh_seconds
+
+    def mark_checked(self):
+        self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Force a version check on the next lookup (call after local writes)."""
+        self._checked_at = 0.0
+
+    def subscribe(self, callback: Callable[[set], None]):
+        """Register callback(doc_ids) for documents added, changed or removed."""
+        self._listeners.append(callback)
+
+    def load(self, entries: List[Dict], version):
+        by_id = {e['doc_id']: e for e in entries}
+        by_filename = {e['filename']: e for e in entries}
+        with self._lock:
+            old = self._by_id
+            changed = {
+                doc_id for doc_id in set(old) | set(by_id)
+                if old.get(doc_id) != by_id.get(doc_id)
+            }
+            # Swap whole dicts so readers never see a half-built index
+            self._by_id = by_id
+            self._by_filename = by_filename
+            was_loaded = self._loaded
+            self._loaded = True
+            self.version = version
+            self.mark_checked()
+        if was_loaded and changed:
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"Catalog listener error: {e}")
+
+    def get_by_id(self, doc_id: int) -> Optional[Dict]:
+        entry = self._by_id.get(doc_id)
+        return dict(entry) if entry else None
+
+    def get_by_filename(self, filename: str) -> Optional[Dict]:
+        entry = self._by_filename.get(filename)
+        return dict(entry) if entry else None
+
+    def list(self, max_level: Optional[str] = None) -> List[Dict]:
+        entries = list(self._by_id.values())
+        if max_level and max_level in LEVEL_RANK:
+            allowed = LEVEL_RANK[max_level]
+            entries = [e for e in entries if LEVEL_RANK.get(e['classification'], 99) <= allowed]
+        entries.sort(key=lambda e: e['upload_date'] or '', reverse=True)
+        # Listings go straight to API clients; blob store keys stay internal
+        return [{k: v for k, v in e.items() if k not in PRIVATE_FIELDS} for e in entries]
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+# Shared by the sync and async DB layers so the process holds one copy
+document_catalog = DocumentCatalog(Config.CATALOG_REFRESH_SECONDS)
@@ -1,4 +1,5 @@
 import os
+import oracledb
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,11 +12,128 @@ class Config:
     DB_PORT = int(os.getenv('DB_PORT', '1521'))
     DB_SERVICE = os.getenv('DB_SERVICE', 'FREEPDB1')
 
+    # Connection pool (shared by the sync and async layers and by auth)
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '2'))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+    DB_POOL_INCREMENT = int(os.getenv('DB_POOL_INCREMENT', '1'))
+    # Max time to wait for a free connection before failing (ms); 0 waits forever
+    DB_POOL_WAIT_TIMEOUT_MS = int(os.getenv('DB_POOL_WAIT_TIMEOUT_MS', '5000'))
+    DB_STMT_CACHE_SIZE = int(os.getenv('DB_STMT_CACHE_SIZE', '50'))
+    # Seconds a connection may sit idle before it is pinged on acquire; negative disables
+    DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', '60'))
+    # Statements run once on every new pooled session, separated by ';'
+    # e.g. "ALTER SESSION SET TIME_ZONE='Asia/Bangkok'"
+    DB_SESSION_INIT_SQL = [s.strip() for s in os.getenv('DB_SESSION_INIT_SQL', '').split(';') if s.strip()]
+    # Requests per statement fingerprint log line: distinct SQL texts issued per
+    # this many /ask requests (database.StatementLog)
+    SQL_FINGERPRINT_WINDOW = int(os.getenv('SQL_FINGERPRINT_WINDOW', '1000'))
+
+    # Max seconds between document catalog version checks (catalog.py)
+    CATALOG_REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', '5'))
+
+    # Original PDFs: 'local' or 'module:ClassName' (see blob_store.py)
+    BLOB_STORE_BACKEND = os.getenv('BLOB_STORE_BACKEND', 'local')
+    BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', '/app/blob_store')
+    # Browser cache lifetime for served PDFs; revalidated with the content ETag
+    PDF_CACHE_MAX_AGE = int(os.getenv('PDF_CACHE_MAX_AGE', '86400'))
+
+    # Optional in-process copy of segment vectors for candidate generation
+    # (vector_replica.py); Oracle remains the source of truth
+    VECTOR_REPLICA_ENABLED = os.getenv('VECTOR_REPLICA_ENABLED', 'false').lower() == 'true'
+    VECTOR_REPLICA_PATH = os.getenv('VECTOR_REPLICA_PATH', '/app/vector_replica')
+    VECTOR_REPLICA_SYNC_SECONDS = int(os.getenv('VECTOR_REPLICA_SYNC_SECONDS', '30'))
+    EMBEDDING_DIM = 1024  # multilingual-e5-large; matches VECTOR(1024, FLOAT32)
+
+    # Models loaded and warmed in the background at startup (model_registry.py);
+    # any other model (e.g. 'ocr') is loaded on demand and unloaded when idle
+    MODEL_WARMUP = [m.strip() for m in os.getenv('MODEL_WARMUP', 'embedder,reranker').split(',') if m.strip()]
+    MODEL_IDLE_UNLOAD_SECONDS = int(os.getenv('MODEL_IDLE_UNLOAD_SECONDS', '900'))
+
+    # Cross-encoder reranker. RERANK_BACKEND=onnx runs the int8 export written by
+    # `python onnx_reranker.py export` to RERANK_ONNX_DIR (CPU only; falls back to torch)
+    RERANK_MODEL = os.getenv('RERANK_MODEL', 'BAAI/bge-reranker-v2-m3')
+    RERANK_BACKEND = os.getenv('RERANK_BACKEND', 'torch')
+    RERANK_ONNX_DIR = os.getenv('RERANK_ONNX_DIR', '/app/models/bge-reranker-v2-m3-int8')
+    RERANK_ONNX_THREADS = int(os.getenv('RERANK_ONNX_THREADS', '0'))  # 0 = onnxruntime default
+
+    # Cross-encoder score cache entries (rerank_cache.py); 0 disables
+    RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', '50000'))
+
+    # Cascade reranking: a small cross-encoder trims the candidates and the large
+    # model scores only the survivors. Survivors are the first-stage scores within
+    # RERANK_CASCADE_MARGIN (sigmoid scores, 0-1) of the best one, clamped to
+    # [max(MIN_KEEP, top_k), MAX_KEEP]
+    RERANK_CASCADE = os.getenv('RERANK_CASCADE', 'false').lower() == 'true'
+    RERANK_FIRST_STAGE_MODEL = os.getenv('RERANK_FIRST_STAGE_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+    RERANK_CASCADE_MIN_KEEP = int(os.getenv('RERANK_CASCADE_MIN_KEEP', '10'))
+    RERANK_CASCADE_MAX_KEEP = int(os.getenv('RERANK_CASCADE_MAX_KEEP', '24'))
+    RERANK_CASCADE_MARGIN = float(os.getenv('RERANK_CASCADE_MARGIN', '0.3'))
+
+    # Final retrieval results reused for near-identical questions (retrieval_cache.py);
+    # 0 disables. Similarity is cosine between query embeddings
+    RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '2000'))
+    RETRIEVAL_CACHE_SIMILARITY = float(os.getenv('RETRIEVAL_CACHE_SIMILARITY', '0.97'))
+    RETRIEVAL_CACHE_TTL = int(os.getenv('RETRIEVAL_CACHE_TTL', '3600'))
+
+    # DeepSeek calls (llm_gateway.py): completions in flight per worker, retries of
+    # transient errors, and the per-purpose deadline (seconds) covering queueing,
+    # every attempt and backoff
+    LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+    LLM_TIMEOUT_ANSWER = float(os.getenv('LLM_TIMEOUT_ANSWER', '90'))
+    LLM_TIMEOUT_SQL = float(os.getenv('LLM_TIMEOUT_SQL', '12'))
+    LLM_TIMEOUT_TITLE = float(os.getenv('LLM_TIMEOUT_TITLE', '20'))
+    LLM_TIMEOUT_TEMPLATE = float(os.getenv('LLM_TIMEOUT_TEMPLATE', '120'))
+    # A streamed answer's budget covers the first token; after that the stream
+    # only fails if no chunk arrives for this many seconds
+    LLM_STREAM_IDLE_TIMEOUT = float(os.getenv('LLM_STREAM_IDLE_TIMEOUT', '30'))
+
+    # Generated /ask answers reused for the same question over the same context
+    # (answer_cache.py); 0 disables
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '21600'))
+
+    # LLM-written SQL plans reused for questions with the same template
+    # (sql_plans.py); 0 disables
+    SQL_PLAN_CACHE_SIZE = int(os.getenv('SQL_PLAN_CACHE_SIZE', '5000'))
+
     # Features
     USE_SQL_SEARCH = True
+    # Oracle Text keyword search fused with vector results (reciprocal rank fusion)
+    USE_LEXICAL_SEARCH = os.getenv('USE_LEXICAL_SEARCH', 'true').lower() == 'true'
+    RRF_K = int(os.getenv('RRF_K', '60'))
+    # Two-stage retrieval: route unscoped queries to the top-M documents first
+    DOC_ROUTING_ENABLED = os.getenv('DOC_ROUTING_ENABLED', 'true').lower() == 'true'
+    DOC_ROUTING_TOP_M = int(os.getenv('DOC_ROUTING_TOP_M', '5'))
+    # Hybrid path: SQL (LLM-generated) and vector branches run concurrently
+    SEARCH_EXECUTOR_WORKERS = int(os.getenv('SEARCH_EXECUTOR_WORKERS', '8'))
+    HYBRID_SQL_TIMEOUT = float(os.getenv('HYBRID_SQL_TIMEOUT', '15'))
+    HYBRID_VECTOR_TIMEOUT = float(os.getenv('HYBRID_VECTOR_TIMEOUT', '20'))
+    # How long SQL may keep running once vector results are in
+    HYBRID_SQL_GRACE = float(os.getenv('HYBRID_SQL_GRACE', '1.0'))
     DEFAULT_TOP_K = 15
+    # Largest page range /page will return in one request
+    PAGE_WINDOW_MAX_PAGES = int(os.getenv('PAGE_WINDOW_MAX_PAGES', '20'))
 
     @classmethod
     def build_dsn(cls) -> str:
         # Easy thin format host:port/service_name
         return f"{cls.DB_HOST}:{cls.DB_PORT}/{cls.DB_SERVICE}"
+
+    @classmethod
+    def pool_params(cls) -> dict:
+        """Keyword arguments common to create_pool and create_pool_async."""
+        params = {
+            'user': cls.DB_USER,
+            'password': cls.DB_PASSWORD,
+            'dsn': cls.build_dsn(),
+            'min': cls.DB_POOL_MIN,
+            'max': cls.DB_POOL_MAX,
+            'increment': cls.DB_POOL_INCREMENT,
+            'stmtcachesize': cls.DB_STMT_CACHE_SIZE,
+            'ping_interval': cls.DB_POOL_PING_INTERVAL,
+        }
+        if cls.DB_POOL_WAIT_TIMEOUT_MS > 0:
+            params['getmode'] = oracledb.POOL_GETMODE_TIMEDWAIT
+            params['wait_timeout'] = cls.DB_POOL_WAIT_TIMEOUT_MS
+        return params
@@ -1,211 +1,870 @@
+import hashlib
 import oracledb
 import os
+import re
 import json
+import threading
+import time
 import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 from config import Config
+from catalog import DocumentCatalog, LEVEL_RANK
 
 load_dotenv()
 
 
-class OracleVectorDB:
+def levels_up_to(max_level: str) -> List[str]:
+    """Return every classification level readable at max_level."""
+    allowed = LEVEL_RANK.get(max_level, 0)
+    return [lvl for lvl, rank in LEVEL_RANK.items() if rank <= allowed]
+
+
+def classification_filter(column: str, allowed_levels: List[str]) -> Tuple[str, Dict[str, str]]:
+    """Build an IN (...) predicate on column with one bind per level.
+
+    Levels are always a prefix of LEVEL_RANK, so at most four distinct SQL
+    texts are produced and Oracle can reuse their cursors.
+    """
+    binds = {f"cl{i}": lvl for i, lvl in enumerate(allowed_levels)}
+    placeholders = ', '.join(f":{k}" for k in binds)
+    return f"{column} IN ({placeholders})", binds
+
+
+# ================= Shared SQL =================
+# Statement text and row mapping live here so the sync (OracleVectorDB) and
+# asyncio (AsyncOracleVectorDB) layers issue identical SQL.
+
+# The PDF itself lives in the blob store; file_ref is its SHA-256
+INSERT_DOCUMENT_SQL = """
+    INSERT INTO documents (file_name, name, page_count, created_at, classification_level, properties, file_ref, file_size)
+    VALUES (:file_name, :name, :page_count, CURRENT_TIMESTAMP, :classification_level, :properties, :file_ref, :file_size)
+    RETURNING id INTO :id
+"""
+
+# classification_level is copied from documents (and kept in sync by a trigger);
+# searches still filter on d.classification_level, the source of truth
+INSERT_CHUNK_SQL = """
+    INSERT INTO content_segments
+    (document_id, category, page_ref, sequence_num, vector_data, attributes, content, classification_level)
+    VALUES (:doc_id, :category, :page_ref, :sequence_num, TO_VECTOR(:embed), :attributes, :content,
+            (SELECT classification_level FROM documents WHERE id = :doc_id))
+"""
+
+DOCUMENT_BY_FILENAME_SQL = (
+    "SELECT id, file_name, name, page_count, properties, classification_level FROM documents WHERE file_name = :fn"
+)
+
+# Document catalog (see catalog.py): all entries, plus the version counter
+# bumped by trg_documents_catalog whenever documents change
+CATALOG_ENTRIES_SQL = (
+    "SELECT id, file_name, name, page_count, created_at, classification_level, file_ref FROM documents"
+)
+
+CATALOG_VERSION_SQL = "SELECT version FROM catalog_state WHERE id = 1"
+
+CREATE_VECTOR_INDEX_SQL = """
+    CREATE VECTOR INDEX idx_segment_vector
+    ON content_segments(vector_data)
+    ORGANIZATION INMEMORY NEIGHBOR GRAPH
+    DISTANCE COSINE WITH TARGET ACCURACY 95
+"""
+
+# has_blob flags legacy rows whose PDF is still stored inline in file_data
+DOCUMENT_FILE_SQL = """
+    SELECT id, file_name, classification_level, file_ref, file_size,
+           CASE WHEN file_data IS NULL THEN 0 ELSE 1 END has_blob
+      FROM documents WHERE id = :i
+"""
+
+MOVE_PDF_TO_BLOB_STORE_SQL = (
+    "UPDATE documents SET file_ref = :r, file_size = :s, file_data = NULL WHERE id = :i"
+)
+
+DELETE_DOCUMENT_SQL = "DELETE FROM documents WHERE id = :i"  # segments and vectors cascade
+
+FILE_REF_IN_USE_SQL = "SELECT COUNT(*) FROM documents WHERE file_ref = :r"
+
+PDF_BY_ID_SQL = "SELECT file_data, file_name FROM documents WHERE id = :id"
+
+PDF_BY_FILENAME_SQL = "SELECT file_data FROM documents WHERE file_name = :fn"
+
+INSERT_TEMPLATE_SQL = """
+    INSERT INTO templates (name, original_filename, doc_type, language, fields_json, content_text, file_data, created_by)
+    VALUES (:name, :original_filename, :doc_type, :language, EMPTY_CLOB(), :content_text, :file_data, :created_by)
+    RETURNING id INTO :id
+"""
+
+UPDATE_TEMPLATE_FIELDS_SQL = "UPDATE templates SET fields_json = :f WHERE id = :i"
+
+LIST_TEMPLATES_SQL = """
+    SELECT id, name, original_filename, doc_type, language, created_at, fields_json
+      FROM templates
+     ORDER BY created_at DESC
+"""
+
+TEMPLATE_BY_ID_SQL = (
+    "SELECT id, name, original_filename, doc_type, language, fields_json, content_text, file_data FROM templates WHERE id = :i"
+)
+
+
+# Server-side parse counters summed over this backend's sessions: every session
+# of the same database user, program and machine as the one running the query
+# (the sync and async pools of all workers on this host). Needs SELECT on
+# v$sesstat / v$session / v$statname (SELECT_CATALOG_ROLE); stats degrade to
+# None without it.
+SESSION_CURSOR_STATS_SQL = """
+    SELECT n.name, SUM(st.value), COUNT(DISTINCT st.sid)
+      FROM v$sesstat st
+      JOIN v$statname n ON st.statistic# = n.statistic#
+      JOIN v$session s ON s.sid = st.sid
+      JOIN v$session me ON me.sid = SYS_CONTEXT('USERENV', 'SID')
+     WHERE n.name IN ('session cursor cache hits', 'parse count (total)', 'parse count (hard)')
+       AND s.username = me.username AND s.program = me.program AND s.machine = me.machine
+     GROUP BY n.name
+"""
+
+
+class PoolWaitStats:
+    """Thread-safe counters for time spent waiting in pool.acquire()."""
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self.acquires = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.acquires += 1
+            self.total_wait += seconds
+            if seconds > self.max_wait:
+                self.max_wait = seconds
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'acquires': self.acquires,
+                'acquire_failures': self.failures,
+                'avg_wait_ms': round(self.total_wait / self.acquires * 1000, 3) if self.acquires else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }
+
+
+def sql_fingerprint(sql: str) -> str:
+    """Whitespace-insensitive hash of a statement's text (not its binds)."""
+    return hashlib.blake2b(re.sub(r'\s+', ' ', sql.strip()).encode('utf-8'), digest_size=8).hexdigest()
+
+
+class StatementLog:
+    """Counts distinct SQL texts issued by the dynamic query paths.
+
+    Oracle hard-parses every new text, so with bind variables the number of
+    distinct fingerprints should stay flat as traffic grows. Every `window`
+    requests one line is printed with the distinct texts seen in that window.
+    """
+
+    def __init__(self, window: int = 1000, max_tracked: int = 10000):
+        self.window = window
+        self.max_tracked = max_tracked
+        self._lock = threading.Lock()
+        self._texts: Dict[str, Dict] = {}
+        self._window_fingerprints: set = set()
+        self._window_statements = 0
+        self._window_requests = 0
+        self.last_window: Optional[Dict] = None
+
+    def record(self, sql: str):
+        fingerprint = sql_fingerprint(sql)
+        with self._lock:
+            entry = self._texts.get(fingerprint)
+            if entry is None and len(self._texts) < self.max_tracked:
+                entry = self._texts[fingerprint] = {'count': 0, 'sql': re.sub(r'\s+', ' ', sql.strip())[:200]}
+            if entry is not None:
+                entry['count'] += 1
+            self._window_fingerprints.add(fingerprint)
+            self._window_statements += 1
+
+    def record_request(self):
+        with self._lock:
+            self._window_requests += 1
+            if self._window_requests < self.window:
+                return
+            self.last_window = {
+                'requests': self._window_requests,
+                'statements': self._window_statements,
+                'distinct_texts': len(self._window_fingerprints),
+            }
+            self._window_fingerprints = set()
+            self._window_statements = 0
+            self._window_requests = 0
+        print(f"SQL fingerprints: {self.last_window['distinct_texts']} distinct texts in "
+              f"{self.last_window['statements']} statements over the last {self.last_window['requests']} requests")
+
+    def snapshot(self, top: int = 10) -> Dict:
+        with self._lock:
+            busiest = sorted(self._texts.items(), key=lambda item: item[1]['count'], reverse=True)[:top]
+            return {
+                'distinct_texts': len(self._texts),
+                'window': self.window,
+                'current_window': {
+                    'requests': self._window_requests,
+                    'statements': self._window_statements,
+                    'distinct_texts': len(self._window_fingerprints),
+                },
+                'last_window': self.last_window,
+                'top': [dict(entry, fingerprint=fp) for fp, entry in busiest],
+            }
+
+
+statement_log = StatementLog(Config.SQL_FINGERPRINT_WINDOW)
+
+
+def pool_stats(pool, wait_stats: PoolWaitStats, cursor_rows: Optional[List[Tuple]] = None) -> Dict:
+    """Combine pool occupancy, acquire wait times and server parse counters.
+
+    python-oracledb does not expose hits of its client statement cache
+    (stmtcachesize); a statement it serves never reaches the server as a
+    parse call. What Oracle can report is, across this backend's sessions,
+    the share of parse calls found in the session cursor cache
+    (session_cursor_cache_hit_ratio) and how many were hard parses.
+    """
+    stats = {
+        'open': pool.opened,
+        'busy': pool.busy,
+        'min': pool.min,
+        'max': pool.max,
+        'stmtcachesize': pool.stmtcachesize,
+    }
+    stats.update(wait_stats.snapshot())
+    stats.update(session_cursor_cache_hit_ratio=None, hard_parses=None, parse_stats_sessions=None)
+    if cursor_rows:
+        values = {name: value for name, value, _ in cursor_rows}
+        parses = values.get('parse count (total)') or 0
+        if parses:
+            stats['session_cursor_cache_hit_ratio'] = round(values.get('session cursor cache hits', 0) / parses, 4)
+        stats['hard_parses'] = values.get('parse count (hard)')
+        stats['parse_stats_sessions'] = max(sessions for _, _, sessions in cursor_rows)
+    return stats
+
+
+def init_session(conn, requested_tag):
+    """Pool session_callback: run Config.DB_SESSION_INIT_SQL on new sessions."""
+    cur = conn.cursor()
+    for statement in Config.DB_SESSION_INIT_SQL:
+        cur.execute(statement)
+
+
+def lob_free_output_handler(cursor, metadata):
+    """Fetch CLOB/NCLOB/BLOB columns inline as str/bytes (fetch_lobs=False).
+
+    Returning LONG variables instead of LOB locators means the value arrives in
+    the same round-trip as the row, rather than one extra .read() per row.
+    """
+    if metadata.type_code is oracledb.DB_TYPE_CLOB:
+        return cursor.var(oracledb.DB_TYPE_LONG, arraysize=cursor.arraysize)
+    if metadata.type_code is oracledb.DB_TYPE_NCLOB:
+        return cursor.var(oracledb.DB_TYPE_LONG_NVARCHAR, arraysize=cursor.arraysize)
+    if metadata.type_code is oracledb.DB_TYPE_BLOB:
+        return cursor.var(oracledb.DB_TYPE_LONG_RAW, arraysize=cursor.arraysize)
+
+
+def tune_cursor(cursor, arraysize: int = 100, prefetchrows: Optional[int] = None):
+    """Prepare a cursor for LOB-free, single round-trip fetches.
+
+    prefetchrows defaults to arraysize + 1 so a result of up to arraysize
+    rows (and its end-of-fetch marker) comes back with the execute call.
+    """
+    cursor.arraysize = max(arraysize, 1)
+    cursor.prefetchrows = prefetchrows if prefetchrows is not None else cursor.arraysize + 1
+    cursor.outputtypehandler = lob_free_output_handler
+    return cursor
+
+
+def parse_json(data):
+    if data is None:
+        return {}
+    if isinstance(data, dict):
+        return data
+    if isinstance(data, str):
+        try:
+            return json.loads(data)
+        except:
+            return {}
+    return {}
+
+
+def returned_id(id_var) -> Optional[int]:
+    """Unwrap a RETURNING ... INTO variable into an int (or None)."""
+    raw_val = id_var.getvalue()
+    # oracledb may return the scalar or a one-element list depending on mode
+    if isinstance(raw_val, list):
+        raw_val = raw_val[0] if raw_val else None
+    return int(raw_val) if raw_val is not None else None
+
+
+def document_params(filename: str, title: str, abstract: str, total_pages: int, metadata: Dict,
+                    file_ref: Optional[str], file_size: Optional[int], classification: str) -> Dict:
+    # Ensure we don't mutate caller's dict
+    props = dict(metadata or {})
+    if abstract:
+        props.setdefault('abstract', abstract)
+    return {
+        'file_name': filename,
+        'name': title,
+        'page_count': total_pages,
+        'classification_level': classification,
+        'properties': json.dumps(props),
+        'file_ref': file_ref,
+        'file_size': file_size,
+    }
+
+
+def chunk_params(doc_id: int, chunk_text: str, chunk_type: str, page_number: int,
+                 chunk_order: int, embedding: List[float], metadata: Dict) -> Dict:
+    embedding_array = np.array(embedding, dtype=np.float32)
+    return {
+        'doc_id': doc_id,
+        'category': chunk_type,
+        'page_ref': page_number,
+        'sequence_num': chunk_order,
+        'embed': str(embedding_array.tolist()),
+        'attributes': json.dumps(metadata),
+        'content': chunk_text,
+    }
+
+
+def segment_scope(doc_id: Optional[int], allowed_levels: Optional[List[str]],
+                  doc_ids: Optional[List[int]] = None) -> Tuple[List[str], Dict]:
+    """WHERE conditions (bind variables only) limiting segments to one document,
+    a routed set of documents, and the caller's classification levels."""
+    conditions = []
+    params = {}
+    if doc_id is not None:
+        conditions.append("c.document_id = :doc_id")
+        params['doc_id'] = doc_id
+    elif doc_ids:
+        conditions.append(
+            "c.document_id IN (SELECT j.id FROM JSON_TABLE(:doc_ids, '$[*]' COLUMNS (id NUMBER PATH '$')) j)"
+        )
+        params['doc_ids'] = json_id_list(doc_ids)
+    if allowed_levels:
+        clause, binds = classification_filter("d.classification_level", allowed_levels)
+        conditions.append(clause)
+        params.update(binds)
+    return conditions, params
+
+
+def similar_chunks_query(query_embedding: List[float], doc_id: Optional[int], top_k: int,
+                         allowed_levels: Optional[List[str]],
+                         doc_ids: Optional[List[int]] = None) -> Tuple[str, Dict]:
+    """Nearest segments by cosine distance.
+
+    Document and classification constraints are applied in the WHERE clause
+    (bind variables only) so the distance is computed just for rows the
+    caller may read, and low-clearance users still get a full top_k.
+    """
+    conditions, params = segment_scope(doc_id, allowed_levels, doc_ids)
+    params.update({'embed': str(query_embedding), 'limit': top_k})
+    sql = (
+        f"SELECT {SEGMENT_COLUMNS}, VECTOR_DISTANCE(c.vector_data, TO_VECTOR(:embed), COSINE) distance "
+        "FROM content_segments c JOIN documents d ON c.document_id = d.id "
+    )
+    if conditions:
+        sql += "WHERE " + " AND ".join(conditions) + " "
+    sql += "ORDER BY distance FETCH FIRST :limit ROWS ONLY"
+    return sql, params
+
+
+def lexical_chunks_query(text_query: str, doc_id: Optional[int], top_k: int,
+                         allowed_levels: Optional[List[str]],
+                         doc_ids: Optional[List[int]] = None) -> Tuple[str, Dict]:
+    """Best Oracle Text matches for a CONTAINS expression (see lexical_retriever)."""
+    conditions, params = segment_scope(doc_id, allowed_levels, doc_ids)
+    conditions.insert(0, "CONTAINS(c.content, :text_query, 1) > 0")
+    params.update({'text_query': text_query, 'limit': top_k})
+    sql = (
+        f"SELECT {SEGMENT_COLUMNS}, SCORE(1) lexical_score "
+        "FROM content_segments c JOIN documents d ON c.document_id = d.id "
+        "WHERE " + " AND ".join(conditions) + " "
+        "ORDER BY SCORE(1) DESC FETCH FIRST :limit ROWS ONLY"
+    )
+    return sql, params
+
+
+# Document-level routing vectors (one row per document, see
+# EmbeddingGenerator.document_vector)
+UPSERT_DOCUMENT_VECTOR_SQL = """
+    MERGE INTO document_vectors v
+    USING (SELECT :doc_id document_id FROM dual) src ON (v.document_id = src.document_id)
+    WHEN MATCHED THEN UPDATE SET v.vector_data = TO_VECTOR(:embed), v.updated_at = CURRENT_TIMESTAMP
+    WHEN NOT MATCHED THEN INSERT (document_id, vector_data) VALUES (src.document_id, TO_VECTOR(:embed))
+"""
+
+DOCUMENTS_WITHOUT_VECTOR_SQL = """
+    SELECT d.id, d.name, d.properties FROM documents d
+    WHERE NOT EXISTS (SELECT 1 FROM document_vectors v WHERE v.document_id = d.id)
+    ORDER BY d.id
+"""
+
+DOCUMENT_SEGMENT_VECTORS_SQL = "SELECT vector_data FROM content_segments WHERE document_id = :doc_id"
+
+
+def similar_documents_query(query_embedding: List[float], top_m: int,
+                            allowed_levels: Optional[List[str]]) -> Tuple[str, Dict]:
+    """Nearest documents by their routing vector."""
+    params = {'embed': str(query_embedding), 'limit': top_m}
+    sql = (
+        "SELECT d.id, d.file_name, d.name, d.classification_level, "
+        "JSON_VALUE(d.properties, '$.abstract' RETURNING VARCHAR2(2000) TRUNCATE) abstract, "
+        "VECTOR_DISTANCE(v.vector_data, TO_VECTOR(:embed), COSINE) distance "
+        "FROM document_vectors v JOIN documents d ON v.document_id = d.id "
+    )
+    if allowed_levels:
+        clause, binds = classification_filter("d.classification_level", allowed_levels)
+        sql += f"WHERE {clause} "
+        params.update(binds)
+    sql += "ORDER BY distance FETCH FIRST :limit ROWS ONLY"
+    return sql, params
+
+
+def document_match_from_row(r) -> Dict:
+    return {
+        'doc_id': r[0],
+        'filename': r[1],
+        'title': r[2],
+        'classification': r[3],
+        'abstract': r[4] or '',
+        'distance': r[5]
+    }
+
+
+# Canonical segment select list; segment_from_row maps it to a chunk dict.
+# Queries may append extra columns (e.g. distance) after these ten.
+SEGMENT_COLUMNS = (
+    "c.id, c.document_id, c.category, c.page_ref, c.sequence_num, c.attributes, c.content, "
+    "d.file_name, d.name, d.classification_level"
+)
+
+
+def segment_from_row(r) -> Dict:
+    return {
+        'chunk_id': r[0],
+        'doc_id': r[1],
+        'type': r[2],
+        'page': r[3],
+        'order': r[4],
+        'metadata': parse_json(r[5]),
+        'text': r[6] or '',
+        'filename': r[7],
+        'title': r[8],
+        'classification': r[9]
+    }
+
+
+# Page and neighbour windows. Page lists and chunk ids are bound as JSON arrays
+# (expanded with JSON_TABLE) so each statement keeps a single SQL text no
+# matter how many values are passed, and stays in the statement cache.
+PAGE_RANGE_SQL = f"""
+    SELECT {SEGMENT_COLUMNS}
+    FROM content_segments c JOIN documents d ON c.document_id = d.id
+    WHERE c.document_id = :doc_id AND c.page_ref BETWEEN :first_page AND :last_page
+    ORDER BY c.page_ref, c.sequence_num
+"""
+
+PAGE_SET_SQL = f"""
+    SELECT {SEGMENT_COLUMNS}
+    FROM content_segments c JOIN documents d ON c.document_id = d.id
+    WHERE c.document_id = :doc_id
+      AND c.page_ref IN (SELECT p.page FROM JSON_TABLE(:pages, '$[*]' COLUMNS (page NUMBER PATH '$')) p)
+    ORDER BY c.page_ref, c.sequence_num
+"""
+
+CHUNK_NEIGHBOURS_SQL = f"""
+    SELECT {SEGMENT_COLUMNS}
+    FROM content_segments c JOIN documents d ON c.document_id = d.id
+    WHERE c.id IN (
+        SELECT n.id
+        FROM JSON_TABLE(:ids, '$[*]' COLUMNS (id NUMBER PATH '$')) j
+        JOIN content_segments s ON s.id = j.id
+        JOIN content_segments n ON n.document_id = s.document_id
+         AND n.sequence_num BETWEEN s.sequence_num - :radius AND s.sequence_num + :radius
+    )
+    ORDER BY c.document_id, c.sequence_num
+"""
+
+
+def json_id_list(values) -> str:
+    return json.dumps(sorted({int(v) for v in values}))
+
+
+SEGMENTS_BY_ID_SQL = f"""
+    SELECT {SEGMENT_COLUMNS}
+    FROM content_segments c JOIN documents d ON c.document_id = d.id
+    WHERE c.id IN (SELECT j.id FROM JSON_TABLE(:ids, '$[*]' COLUMNS (id NUMBER PATH '$')) j)
+"""
+
+
+def hydrate_replica_hits(hits: List[Tuple[int, float]], segments: List[Dict]) -> List[Dict]:
+    """Order segments fetched by id as the replica ranked them, adding distance.
+
+    Ids no longer present in Oracle (deleted since the last sync) drop out.
+    """
+    by_id = {s['chunk_id']: s for s in segments}
+    return [dict(by_id[sid], distance=dist) for sid, dist in hits if sid in by_id]
+
+
+def page_window_query(doc_id: int, first_page: int, last_page: Optional[int] = None,
+                      pages: Optional[List[int]] = None) -> Tuple[str, Dict]:
+    """All segments of a page range, or of an explicit (sparse) page set."""
+    if pages is not None:
+        return PAGE_SET_SQL, {'doc_id': doc_id, 'pages': json_id_list(pages)}
+    last_page = first_page if last_page is None else last_page
+    return PAGE_RANGE_SQL, {'doc_id': doc_id, 'first_page': first_page, 'last_page': last_page}
+
+
+def document_from_row(row) -> Dict:
+    metadata = parse_json(row[4])
+    return {
+        'doc_id': row[0],
+        'filename': row[1],
+        'title': row[2],
+        'total_pages': row[3],
+        'metadata': metadata,
+        'abstract': metadata.get('abstract', ''),
+        'classification': row[5]
+    }
+
+
+def document_file_from_row(row) -> Dict:
+    return {
+        'doc_id': row[0],
+        'filename': row[1],
+        'classification': row[2],
+        'file_ref': row[3],
+        'file_size': row[4],
+        'has_blob': bool(row[5])
+    }
+
+
+def catalog_entry_from_row(r) -> Dict:
+    return {
+        'doc_id': r[0],
+        'filename': r[1],
+        'title': r[2],
+        'total_pages': r[3],
+        'upload_date': r[4].isoformat() if r[4] else None,
+        'classification': r[5],
+        'file_ref': r[6]
+    }
+
+
+def template_summary_from_row(r) -> Dict:
+    item = {
+        'id': r[0],
+        'name': r[1],
+        'original_filename': r[2],
+        'doc_type': r[3],
+        'language': r[4],
+        'created_at': r[5].isoformat() if r[5] else None,
+        'fields_json': r[6] or ''
+    }
+    try:
+        arr = json.loads(item['fields_json'] or '[]')
+        item['fields_count'] = len(arr) if isinstance(arr, list) else 0
+    except Exception:
+        item['fields_count'] = 0
+    return item
+
+
+def template_from_row(row) -> Dict:
+    return {
+        'id': row[0],
+        'name': row[1],
+        'original_filename': row[2],
+        'doc_type': row[3],
+        'language': row[4],
+        'fields_json': row[5] or '',
+        'content_text': row[6] or '',
+        'file_data': row[7]
+    }
+
+
+def schema_error(has_docs: bool, has_segments: bool) -> Optional[RuntimeError]:
+    if not (has_docs and has_segments):
+        return RuntimeError(
+            "Schema missing. Run database/setup.sql first (as APPUSER) before starting backend."
+        )
+    return None
+
+
+class OracleVectorDB:
+    def __init__(self, catalog: Optional[DocumentCatalog] = None, vector_replica=None):
         self.pool = None
+        self.catalog = catalog or DocumentCatalog(Config.CATALOG_REFRESH_SECONDS)
+        # Optional VectorReplica: candidates come from it, rows from Oracle
+        self.vector_replica = vector_replica
         self._init_pool()
         # Verify schema exists (no auto-creation). Will raise if missing.
         self._check_schema()
 
     def _init_pool(self):
-        """Create a simple thin connection pool to Oracle Free"""
-        dsn = Config.build_dsn()
-        self.pool = oracledb.create_pool(
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            dsn=dsn,
-            min=2,
-            max=10,
-            increment=1
-        )
+        """Create the thin connection pool to Oracle Free (sized from Config)"""
+        self.wait_stats = PoolWaitStats()
+        params = Config.pool_params()
+        if Config.DB_SESSION_INIT_SQL:
+            params['session_callback'] = init_session
+        self.pool = oracledb.create_pool(**params)
 
     def get_connection(self):
-        return self.pool.acquire()
-    
+        start = time.perf_counter()
+        try:
+            conn = self.pool.acquire()
+        except oracledb.Error:
+            self.wait_stats.record_failure()
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return conn
+
+    def get_pool_stats(self) -> Dict:
+        cursor_rows = None
+        try:
+            with self.get_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(SESSION_CURSOR_STATS_SQL)
+                cursor_rows = cur.fetchall()
+        except oracledb.Error as e:
+            print(f"Cursor cache stats unavailable: {e}")
+        return pool_stats(self.pool, self.wait_stats, cursor_rows)
+
     def _parse_json(self, data):
-        if data is None:
-            return {}
-        if isinstance(data, dict):
-            return data
-        if isinstance(data, str):
-            try:
-                return json.loads(data)
-            except:
-                return {}
-        return {}
-    
-    def insert_document(self, filename: str, title: str, abstract: str, total_pages: int,
-                        metadata: Dict, pdf_file: Optional[bytes] = None, classification: str = "PUBLIC") -> int:
+        return parse_json(data)
+
+    def insert_document(self, filename: str, title: str, abstract: str, total_pages: int, metadata: Dict,
+                        file_ref: Optional[str] = None, file_size: Optional[int] = None,
+                        classification: str = "PUBLIC") -> int:
         """Insert a document and return its generated ID.
 
         The former 'description' column was removed from schema; we now persist any
-        provided abstract inside properties JSON under key 'abstract'.
+        provided abstract inside properties JSON under key 'abstract'. The PDF is
+        referenced by its blob store key (file_ref), not stored in the row.
         """
         with self.get_connection() as conn:
             cur = conn.cursor()
             id_var = cur.var(oracledb.NUMBER)
-            # Ensure we don't mutate caller's dict
-            props = dict(metadata or {})
-            if abstract:
-                props.setdefault('abstract', abstract)
-            cur.execute(
-                """
-                INSERT INTO documents (file_name, name, page_count, created_at, classification_level, properties, file_data)
-                VALUES (:file_name, :name, :page_count, CURRENT_TIMESTAMP, :classification_level, :properties, :file_data)
-                RETURNING id INTO :id
-                """,
-                file_name=filename,
-                name=title,
-                page_count=total_pages,
-                classification_level=classification,
-                properties=json.dumps(props),
-                file_data=pdf_file,
-                id=id_var
-            )
-            raw_val = id_var.getvalue()
-            # oracledb may return the scalar or a one-element list depending on mode
-            if isinstance(raw_val, list):
-                raw_val = raw_val[0] if raw_val else None
-            if raw_val is None:
+            params = document_params(filename, title, abstract, total_pages, metadata, file_ref, file_size, classification)
+            params['id'] = id_var
+            cur.execute(INSERT_DOCUMENT_SQL, params)
+            doc_id = returned_id(id_var)
+            if doc_id is None:
                 raise RuntimeError("Failed to retrieve returned document ID")
-            doc_id = int(raw_val)
             conn.commit()
+            self.catalog.invalidate()
             return doc_id
-    
+
     def insert_chunk(self, doc_id: int, chunk_text: str, chunk_type: str,
                      page_number: int, chunk_order: int, embedding: List[float], metadata: Dict):
         with self.get_connection() as conn:
             cur = conn.cursor()
-            embedding_array = np.array(embedding, dtype=np.float32)
-            embedding_str = str(embedding_array.tolist())
             cur.execute(
-                """
-                INSERT INTO content_segments 
-                (document_id, category, page_ref, sequence_num, vector_data, attributes, content)
-                VALUES (:1, :2, :3, :4, TO_VECTOR(:5), :6, :7)
-                """,
-                [doc_id, chunk_type, page_number, chunk_order, embedding_str, json.dumps(metadata), chunk_text]
+                INSERT_CHUNK_SQL,
+                chunk_params(doc_id, chunk_text, chunk_type, page_number, chunk_order, embedding, metadata)
             )
             conn.commit()
-    
+
     def search_similar_chunks(self, query_embedding: List[float], doc_id: Optional[int] = None,
-                               top_k: int = 10) -> List[Dict]:
+                               top_k: int = 10, allowed_levels: Optional[List[str]] = None,
+                               doc_ids: Optional[List[int]] = None) -> List[Dict]:
+        if self.vector_replica is not None and self.vector_replica.ready:
+            hits = self.vector_replica.search(query_embedding, top_k, doc_id, allowed_levels, doc_ids)
+            if not hits:
+                return []
+            segments = self.fetch_segments(SEGMENTS_BY_ID_SQL, {'ids': json_id_list(sid for sid, _ in hits)})
+            return hydrate_replica_hits(hits, segments)
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=top_k)
+            sql, params = similar_chunks_query(query_embedding, doc_id, top_k, allowed_levels, doc_ids)
+            statement_log.record(sql)
+            cur.execute(sql, params)
+            return [dict(segment_from_row(r), distance=r[10]) for r in cur.fetchall()]
+
+    def search_lexical_chunks(self, text_query: str, doc_id: Optional[int] = None,
+                              top_k: int = 20, allowed_levels: Optional[List[str]] = None,
+                              doc_ids: Optional[List[int]] = None) -> List[Dict]:
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=top_k)
+            sql, params = lexical_chunks_query(text_query, doc_id, top_k, allowed_levels, doc_ids)
+            statement_log.record(sql)
+            cur.execute(sql, params)
+            return [dict(segment_from_row(r), lexical_score=r[10]) for r in cur.fetchall()]
+
+    def search_documents(self, query_embedding: List[float], top_m: int = 5,
+                         allowed_levels: Optional[List[str]] = None) -> List[Dict]:
+        """Documents nearest to the query by routing vector, with distance."""
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=top_m)
+            sql, params = similar_documents_query(query_embedding, top_m, allowed_levels)
+            statement_log.record(sql)
+            cur.execute(sql, params)
+            return [document_match_from_row(r) for r in cur.fetchall()]
+
+    def upsert_document_vector(self, doc_id: int, vector: List[float]):
         with self.get_connection() as conn:
             cur = conn.cursor()
-            embedding_str = str(query_embedding)
-            sql = (
-                "SELECT c.id, c.document_id, c.category, c.page_ref, c.sequence_num, c.attributes, "
-                "d.file_name, d.name, d.classification_level, VECTOR_DISTANCE(c.vector_data, TO_VECTOR(:embed), COSINE) distance, c.content "
-                "FROM content_segments c JOIN documents d ON c.document_id = d.id "
-                "WHERE (:doc_id IS NULL OR c.document_id = :doc_id) "
-                "ORDER BY distance FETCH FIRST :limit ROWS ONLY"
-            )
-            cur.execute(sql, embed=embedding_str, doc_id=doc_id, limit=top_k)
-            rows = cur.fetchall()
-            results = []
-            for r in rows:
-                results.append({
-                    'chunk_id': r[0],
-                    'doc_id': r[1],
-                    'chunk_type': r[2],
-                    'page_number': r[3],
-                    'chunk_order': r[4],
-                    'metadata': self._parse_json(r[5]),
-                    'filename': r[6],
-                    'title': r[7],
-                    'classification': r[8],
-                    'distance': r[9],
-                    'chunk_text': r[10].read() if r[10] else ''
-                })
-            return results
-    
+            cur.execute(UPSERT_DOCUMENT_VECTOR_SQL, {'doc_id': doc_id, 'embed': str(vector)})
+            conn.commit()
+
+    def get_documents_without_vector(self) -> List[Dict]:
+        """Documents ingested before routing vectors existed (for backfill)."""
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor())
+            cur.execute(DOCUMENTS_WITHOUT_VECTOR_SQL)
+            docs = []
+            for r in cur.fetchall():
+                props = parse_json(r[2])
+                docs.append({'doc_id': r[0], 'title': r[1] or '', 'abstract': props.get('abstract', ''),
+                             'table_of_contents': props.get('table_of_contents')})
+            return docs
+
+    def get_segment_vectors(self, doc_id: int) -> List[List[float]]:
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=500)
+            cur.execute(DOCUMENT_SEGMENT_VECTORS_SQL, {'doc_id': doc_id})
+            return [list(r[0]) for r in cur.fetchall() if r[0] is not None]
+
+    def fetch_segments(self, sql: str, params: Dict, arraysize: int = 100) -> List[Dict]:
+        """Run a query selecting SEGMENT_COLUMNS and map rows to chunk dicts."""
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=arraysize)
+            statement_log.record(sql)
+            cur.execute(sql, params)
+            return [segment_from_row(r) for r in cur.fetchall()]
+
+    def get_page_window(self, doc_id: int, first_page: int, last_page: Optional[int] = None,
+                        pages: Optional[List[int]] = None) -> List[Dict]:
+        """Segments for first_page..last_page (or an explicit page list) in one query."""
+        sql, params = page_window_query(doc_id, first_page, last_page, pages)
+        return self.fetch_segments(sql, params, arraysize=200)
+
+    def get_chunk_neighbours(self, chunk_ids: List[int], radius: int = 1) -> List[Dict]:
+        """The given chunks plus `radius` segments either side by sequence_num."""
+        if not chunk_ids:
+            return []
+        return self.fetch_segments(
+            CHUNK_NEIGHBOURS_SQL,
+            {'ids': json_id_list(chunk_ids), 'radius': radius},
+            arraysize=200
+        )
+
+    def fetch_dicts(self, sql: str, params: Dict, arraysize: int = 100) -> List[Dict]:
+        """Run an arbitrary SELECT and return rows keyed by lower-case column name."""
+        with self.get_connection() as conn:
+            cur = tune_cursor(conn.cursor(), arraysize=arraysize)
+            statement_log.record(sql)
+            cur.execute(sql, params)
+            columns = [col[0].lower() for col in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+
     def get_document_by_filename(self, filename: str) -> Optional[Dict]:
         with self.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                "SELECT id, file_name, name, page_count, properties, classification_level FROM documents WHERE file_name = :fn",
-                fn=filename
-            )
+            cur.execute(DOCUMENT_BY_FILENAME_SQL, fn=filename)
             row = cur.fetchone()
             if not row:
                 return None
-            metadata = self._parse_json(row[4])
-            return {
-                'doc_id': row[0],
-                'filename': row[1],
-                'title': row[2],
-                'total_pages': row[3],
-                'metadata': metadata,
-                'abstract': metadata.get('abstract', ''),
-                'classification': row[5]
-            }
+            return document_from_row(row)
 
-    def get_document_meta(self, doc_id: int) -> Optional[Dict]:
+    def _fresh_catalog(self) -> DocumentCatalog:
+        """Return the catalog, reloading it if the version counter moved."""
+        if not self.catalog.is_stale():
+            return self.catalog
         with self.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id, file_name, classification_level FROM documents WHERE id = :i", i=doc_id)
-            row = cur.fetchone()
-            if not row:
-                return None
-            return { 'doc_id': row[0], 'filename': row[1], 'classification': row[2] }
-    
-    def list_documents(self, max_level: Optional[str] = None) -> List[Dict]:
+            version = None
+            try:
+                cur.execute(CATALOG_VERSION_SQL)
+                row = cur.fetchone()
+                version = row[0] if row else None
+            except oracledb.Error as e:
+                print(f"Catalog version unavailable, reloading catalog: {e}")
+            if version is None or version != self.catalog.version:
+                cur.execute(CATALOG_ENTRIES_SQL)
+                self.catalog.load([catalog_entry_from_row(r) for r in cur.fetchall()], version)
+            else:
+                self.catalog.mark_checked()
+        return self.catalog
+
+    def refresh_catalog(self) -> DocumentCatalog:
+        """Pick up documents changed by other workers; listeners see the change."""
+        return self._fresh_catalog()
+
+    def _lookup_document(self, where: str, **params) -> Optional[Dict]:
+        """Catalog miss fallback: the row may be newer than the last refresh."""
         with self.get_connection() as conn:
             cur = conn.cursor()
-            level_order = {"PUBLIC":1, "INTERNAL":2, "CONFIDENTIAL":3, "SECRET":4}
-            if max_level and max_level in level_order:
-                allowed = level_order[max_level]
-                cur.execute(
-                    "SELECT id, file_name, name, page_count, created_at, classification_level FROM documents ORDER BY created_at DESC"
-                )
-                rows = [r for r in cur.fetchall() if level_order.get(r[5], 99) <= allowed]
-            else:
-                cur.execute("SELECT id, file_name, name, page_count, created_at, classification_level FROM documents ORDER BY created_at DESC")
-                rows = cur.fetchall()
-            return [
-                {
-                    'doc_id': r[0],
-                    'filename': r[1],
-                    'title': r[2],
-                    'total_pages': r[3],
-                    'upload_date': r[4].isoformat() if r[4] else None,
-                    'classification': r[5]
-                } for r in rows
-            ]
-    
+            sql = f"{CATALOG_ENTRIES_SQL} WHERE {where}"
+            statement_log.record(sql)
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        if not row:
+            return None
+        self.catalog.invalidate()
+        return catalog_entry_from_row(row)
+
+    def get_document_meta(self, doc_id: int) -> Optional[Dict]:
+        """Catalog entry (id, filename, title, pages, classification) by id."""
+        return self._fresh_catalog().get_by_id(doc_id) or self._lookup_document("id = :i", i=doc_id)
+
+    def get_document_info(self, filename: str) -> Optional[Dict]:
+        """Catalog entry (id, filename, title, pages, classification) by filename."""
+        return (self._fresh_catalog().get_by_filename(filename)
+                or self._lookup_document("file_name = :fn", fn=filename))
+
+    def list_documents(self, max_level: Optional[str] = None) -> List[Dict]:
+        return self._fresh_catalog().list(max_level)
+
     def create_vector_index(self):
         with self.get_connection() as conn:
             cur = conn.cursor()
             try:
-                cur.execute(
-                    """
-                    CREATE VECTOR INDEX idx_segment_vector 
-                    ON content_segments(vector_data) 
-                    ORGANIZATION INMEMORY NEIGHBOR GRAPH 
-                    DISTANCE COSINE WITH TARGET ACCURACY 95
-                    """
-                )
+                cur.execute(CREATE_VECTOR_INDEX_SQL)
                 conn.commit()
                 print("Vector index created")
             except Exception as e:
                 print(f"Vector index existing or error: {e}")
 
     # Removed read-only specific functions (simplified deployment)
-    
+
+    def get_document_file(self, doc_id: int) -> Optional[Dict]:
+        """Access and storage info for a document's PDF (no file bytes)."""
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(DOCUMENT_FILE_SQL, i=doc_id)
+            row = cur.fetchone()
+            return document_file_from_row(row) if row else None
+
+    def move_pdf_to_blob_store(self, doc_id: int, blob_store) -> Optional[str]:
+        """Copy a legacy inline BLOB into the blob store and drop it from the row."""
+        pdf_data, _ = self.get_pdf_file(doc_id)
+        if not pdf_data:
+            return None
+        ref = blob_store.put(pdf_data)
+        with self.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(MOVE_PDF_TO_BLOB_STORE_SQL, r=ref, s=len(pdf_data), i=doc_id)
+            conn.commit()
+        return ref
+
     def get_pdf_file(self, doc_id: int) -> Tuple[Optional[bytes], Optional[str]]:
         """Get PDF file content by document ID."""
         with self.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT file_data, file_name FROM documents WHERE id = :id", id=doc_id)
+            cur.execute(PDF_BY_ID_SQL, id=doc_id)
             row = cur.fetchone()
             if not row:
                 print(f"No document found with doc_id {doc_id}")
@@ -221,7 +880,7 @@ class OracleVectorDB:
         """Get PDF BLOB by filename."""
         with self.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT file_data FROM documents WHERE file_name = :fn", fn=filename)
+            cur.execute(PDF_BY_FILENAME_SQL, fn=filename)
             row = cur.fetchone()
             if row and row[0]:
                 return row[0].read() if hasattr(row[0], 'read') else row[0]
@@ -240,10 +899,9 @@ class OracleVectorDB:
                 has_templates = cur.fetchone() is not None
             except Exception as e:
                 raise RuntimeError(f"Schema check failed: {e}")
-            if not (has_docs and has_segments):
-                raise RuntimeError(
-                    "Schema missing. Run database/setup.sql first (as APPUSER) before starting backend."
-                )
+            error = schema_error(has_docs, has_segments)
+            if error:
+                raise error
 
     # ================= Templates API =================
     def insert_template(self, name: str, original_filename: str, doc_type: str, language: str,
@@ -252,11 +910,7 @@ class OracleVectorDB:
             cur = conn.cursor()
             id_var = cur.var(oracledb.NUMBER)
             cur.execute(
-                """
-                INSERT INTO templates (name, original_filename, doc_type, language, fields_json, content_text, file_data, created_by)
-                VALUES (:name, :original_filename, :doc_type, :language, EMPTY_CLOB(), :content_text, :file_data, :created_by)
-                RETURNING id INTO :id
-                """,
+                INSERT_TEMPLATE_SQL,
                 name=name,
                 original_filename=original_filename,
                 doc_type=doc_type,
@@ -266,77 +920,34 @@ class OracleVectorDB:
                 created_by=created_by,
                 id=id_var
             )
-            raw_val = id_var.getvalue()
-            if isinstance(raw_val, list):
-                raw_val = raw_val[0] if raw_val else None
-            if raw_val is None:
+            new_id = returned_id(id_var)
+            if new_id is None:
                 # fallback
                 cur.execute("SELECT MAX(id) FROM templates")
                 row = cur.fetchone()
                 if not row or row[0] is None:
                     raise RuntimeError("Failed to retrieve new template id")
                 new_id = int(row[0])
-            else:
-                new_id = int(raw_val)
             conn.commit()
             return new_id
 
     def update_template_fields(self, template_id: int, fields_json: str):
         with self.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute("UPDATE templates SET fields_json = :f WHERE id = :i", f=fields_json, i=template_id)
+            cur.execute(UPDATE_TEMPLATE_FIELDS_SQL, f=fields_json, i=template_id)
             conn.commit()
 
     def list_templates(self) -> List[Dict]:
         with self.get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute(
-                """
-                SELECT id, name, original_filename, doc_type, language, created_at, fields_json
-                  FROM templates
-                 ORDER BY created_at DESC
-                """
-            )
-            rows = cur.fetchall()
-            results = []
-            for r in rows:
-                item = {
-                    'id': r[0],
-                    'name': r[1],
-                    'original_filename': r[2],
-                    'doc_type': r[3],
-                    'language': r[4],
-                    'created_at': r[5].isoformat() if r[5] else None,
-                    'fields_json': r[6].read() if hasattr(r[6], 'read') else (r[6] or '')
-                }
-                try:
-                    arr = json.loads(item['fields_json'] or '[]')
-                    item['fields_count'] = len(arr) if isinstance(arr, list) else 0
-                except Exception:
-                    item['fields_count'] = 0
-                results.append(item)
-            return results
+            cur = tune_cursor(conn.cursor())
+            cur.execute(LIST_TEMPLATES_SQL)
+            return [template_summary_from_row(r) for r in cur.fetchall()]
 
     def get_template_by_id(self, template_id: int) -> Optional[Dict]:
         with self.get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT id, name, original_filename, doc_type, language, fields_json, content_text, file_data FROM templates WHERE id = :i",
-                i=template_id
-            )
+            cur = tune_cursor(conn.cursor(), arraysize=1)
+            cur.execute(TEMPLATE_BY_ID_SQL, i=template_id)
             row = cur.fetchone()
             if not row:
                 return None
-            fields_json = row[5].read() if hasattr(row[5], 'read') else (row[5] or '')
-            content_text = row[6].read() if hasattr(row[6], 'read') else (row[6] or '')
-            file_blob = row[7]
-            return {
-                'id': row[0],
-                'name': row[1],
-                'original_filename': row[2],
-                'doc_type': row[3],
-                'language': row[4],
-                'fields_json': fields_json,
-                'content_text': content_text,
-                'file_data': file_blob.read() if hasattr(file_blob, 'read') else file_blob
-            }
+            return template_from_row(row)
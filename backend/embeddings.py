@@ -44,5 +44,33 @@ class EmbeddingGenerator:
             return embeddings[0].tolist()
         return [emb.tolist() for emb in embeddings]
     
+    def document_vector(self, title: str, abstract: str, chunk_embeddings: List[List[float]],
+                        table_of_contents=None, text_weight: float = 0.5) -> List[float]:
+        """Routing vector for a whole document.
+
+        Blends the embedding of title + abstract + table of contents (what the
+        document says it is about) with the centroid of its chunk embeddings
+        (what it actually contains); both halves are L2-normalised first.
+        """
+        parts = [title or '', abstract or '']
+        if table_of_contents:
+            if isinstance(table_of_contents, list):
+                table_of_contents = '\n'.join(str(item) for item in table_of_contents)
+            parts.append(str(table_of_contents))
+        summary_text = '\n'.join(p for p in parts if p).strip()[:4000]
+
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if chunk_embeddings:
+            centroid = np.mean(np.asarray(chunk_embeddings, dtype=np.float32), axis=0)
+            norm = np.linalg.norm(centroid)
+            if norm > 0:
+                vector += (1 - text_weight if summary_text else 1.0) * centroid / norm
+        if summary_text:
+            summary = np.asarray(self.encode(summary_text), dtype=np.float32)
+            vector += (text_weight if chunk_embeddings else 1.0) * summary
+
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
     def get_dimension(self) -> int:
         return self.dimension
\ No newline at end of file
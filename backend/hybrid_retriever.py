@@ -1,26 +1,110 @@
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import json
 import re
+import threading
+from config import Config
 from database import OracleVectorDB
 from embeddings import EmbeddingGenerator
 from retriever import DocumentRetriever
+from lexical_retriever import LexicalRetriever
 from sql_generator import SQLGenerator
-from reranker import Reranker
+from model_registry import model_registry
+from retrieval_cache import retrieval_cache, retrieval_scope
+from query_analysis import QueryAnalysis, analyze_query
+from candidates import CandidateSet, descending_order
 import numpy as np
 
 class HybridRetriever:
-    def __init__(self, db: OracleVectorDB, embedder: EmbeddingGenerator):
+    def __init__(self, db: OracleVectorDB, embedder: EmbeddingGenerator,
+                 vector_retriever: Optional[DocumentRetriever] = None):
         self.db = db
         self.embedder = embedder
-        self.vector_retriever = DocumentRetriever(db, embedder)
+        self.vector_retriever = vector_retriever or DocumentRetriever(db, embedder)
+        self.lexical_retriever = LexicalRetriever(db)
         self.sql_generator = SQLGenerator()
-        self.reranker = Reranker()
+        self.reranker = model_registry.proxy('reranker')
+        self.result_cache = retrieval_cache
         self.use_sql_search = True
+        self.use_lexical_search = Config.USE_LEXICAL_SEARCH
+        self.rrf_k = Config.RRF_K
+        self.use_document_routing = Config.DOC_ROUTING_ENABLED
+        self.route_top_m = Config.DOC_ROUTING_TOP_M
+        # Separate pools so slow SQL branches never starve vector search
+        self._sql_executor = ThreadPoolExecutor(Config.SEARCH_EXECUTOR_WORKERS, thread_name_prefix='sql-search')
+        self._vector_executor = ThreadPoolExecutor(Config.SEARCH_EXECUTOR_WORKERS, thread_name_prefix='vector-search')
+        self.sql_timeout = Config.HYBRID_SQL_TIMEOUT
+        self.vector_timeout = Config.HYBRID_VECTOR_TIMEOUT
+        self.sql_grace = Config.HYBRID_SQL_GRACE
+        # Cross-encoder (query, chunk) pairs actually scored vs. carried over
+        self._metrics_lock = threading.Lock()
+        self.rerank_metrics = {
+            'requests': 0, 'pairs_scored': 0, 'pairs_reused': 0, 'pairs_cached': 0, 'last_request_pairs': 0,
+            'pairs_pruned': 0, 'stage1_ms': 0.0, 'stage2_ms': 0.0
+        }
     
     async def retrieve(self, query: str, doc_filename: Optional[str] = None, 
                       top_k: int = 15, allowed_levels: Optional[List[str]] = None) -> List[Dict]:
-        query_intent = self._analyze_query_intent(query)
+        loop = asyncio.get_event_loop()
+        query_embedding = None
+        scope = retrieval_scope(doc_filename, allowed_levels, top_k)
+        if self.result_cache.enabled:
+            # Cached results are only as fresh as the catalog that invalidates them
+            await loop.run_in_executor(self._vector_executor, self.db.refresh_catalog)
+            query_embedding = await loop.run_in_executor(self._vector_executor, self.embedder.encode, query)
+            cached = self.result_cache.get(scope, query, query_embedding)
+            if cached is not None:
+                print(f"Retrieval cache hit: {len(cached)} chunks")
+                return cached
+        catalog_version = self.db.catalog.version
+
+        rerank_stats = {'pairs_scored': 0, 'pairs_reused': 0, 'pairs_cached': 0,
+                        'pairs_pruned': 0, 'stage1_ms': 0.0, 'stage2_ms': 0.0}
+        chunks = await self._retrieve(query, doc_filename, top_k, allowed_levels, rerank_stats, query_embedding)
+        self._record_rerank_stats(rerank_stats)
+        print(f"Cross-encoder pairs: {rerank_stats['pairs_scored']} scored, "
+              f"{rerank_stats['pairs_reused']} reused, {rerank_stats['pairs_cached']} cached, "
+              f"{rerank_stats['pairs_pruned']} pruned by first stage "
+              f"({rerank_stats['stage1_ms']:.0f} ms + {rerank_stats['stage2_ms']:.0f} ms)")
+
+        # Results computed across a catalog change may already be stale
+        cacheable = (query_embedding is not None and self.db.catalog.version == catalog_version
+                     and not any(c.get('type') == 'system_message' for c in chunks))
+        if cacheable:
+            doc_ids = {c.get('doc_id') for c in chunks}
+            if doc_filename:
+                doc = await loop.run_in_executor(self._vector_executor, self.db.get_document_info, doc_filename)
+                if doc:
+                    doc_ids.add(doc['doc_id'])
+            self.result_cache.put(scope, query, query_embedding, chunks, doc_ids)
+        return chunks
+
+    def _record_rerank_stats(self, rerank_stats: Dict):
+        with self._metrics_lock:
+            self.rerank_metrics['requests'] += 1
+            self.rerank_metrics['pairs_scored'] += rerank_stats['pairs_scored']
+            self.rerank_metrics['pairs_reused'] += rerank_stats['pairs_reused']
+            self.rerank_metrics['pairs_cached'] += rerank_stats['pairs_cached']
+            self.rerank_metrics['pairs_pruned'] += rerank_stats['pairs_pruned']
+            self.rerank_metrics['stage1_ms'] += rerank_stats['stage1_ms']
+            self.rerank_metrics['stage2_ms'] += rerank_stats['stage2_ms']
+            self.rerank_metrics['last_request_pairs'] = rerank_stats['pairs_scored']
+
+    def get_rerank_metrics(self) -> Dict:
+        with self._metrics_lock:
+            metrics = dict(self.rerank_metrics)
+        requests = metrics['requests']
+        metrics['avg_pairs_per_request'] = round(metrics['pairs_scored'] / requests, 1) if requests else 0.0
+        metrics['avg_stage1_ms'] = round(metrics['stage1_ms'] / requests, 1) if requests else 0.0
+        metrics['avg_stage2_ms'] = round(metrics['stage2_ms'] / requests, 1) if requests else 0.0
+        return metrics
+
+    async def _retrieve(self, query: str, doc_filename: Optional[str], top_k: int,
+                        allowed_levels: Optional[List[str]], rerank_stats: Dict,
+                        query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        analysis = analyze_query(query)
+        query_intent = self._analyze_query_intent(analysis)
         print(f"Query intent: {query_intent}")
 
         if query_intent.get('needs_document_selection', False) and not doc_filename:
@@ -34,32 +118,73 @@ class HybridRetriever:
                 'metadata': {'message_type': 'require_document_selection'}
             }]
 
-        needs_sql = self._needs_sql_search(query)
+        # "Which document talks about X" is answered from document vectors alone
+        if not doc_filename and self.use_document_routing and self._is_document_lookup(analysis):
+            matches = await self._async_document_matches(query, top_k, allowed_levels, query_embedding)
+            if matches:
+                return matches
+
+        needs_sql = self._needs_sql_search(analysis)
         print(f"Query: {query}")
         print(f"Needs SQL search: {needs_sql}")
 
-        # Pure vector path
+        # Pure vector path (fused with keyword hits)
         if not needs_sql:
-            chunks = self.vector_retriever.retrieve(query, doc_filename, top_k, allowed_levels=allowed_levels)
-            if allowed_levels:
-                chunks = [c for c in chunks if (c.get('metadata', {}).get('classification') or c.get('classification')) in allowed_levels]
+            chunks = await self._async_fused_search(query, doc_filename, top_k, allowed_levels, rerank_stats,
+                                                    query_embedding)
             if query_intent.get('is_overview_query', False):
-                chunks = self._apply_overview_boosting(chunks, query_intent)
+                chunks = self._apply_overview_boosting(CandidateSet.from_chunks(chunks), query_intent).chunks()
             return chunks[:top_k]
 
-        # SQL + vector hybrid path
-        sql_result = await self._async_sql_search(query, doc_filename, allowed_levels)
-        sql_chunks = sql_result.get('chunks', [])
-        sql_confidence = sql_result.get('confidence', 0.5)
-        sql_query_type = sql_result.get('query_type', 'hybrid')
-
-        if sql_confidence >= 0.9 and sql_query_type == 'metadata' and sql_chunks:
-            print(f"Using SQL-only results due to high confidence ({sql_confidence})")
-            if self.reranker:
-                return self.reranker.rerank(query, sql_chunks, top_k=top_k, query_intent=query_intent)
-            return sql_chunks[:top_k]
+        # SQL + vector hybrid path: both branches run concurrently, each with its own timeout
+        loop = asyncio.get_event_loop()
+        cancel_sql = threading.Event()
+        cancel_vector = threading.Event()
+        # The vector branch's executor threads may outlive this request when it
+        # is abandoned, so they count into their own dict, merged only on use
+        vector_stats = {}
+        sql_task = asyncio.ensure_future(asyncio.wait_for(
+            self._async_sql_search(query, doc_filename, allowed_levels, cancel_sql, analysis), self.sql_timeout
+        ))
+        vector_task = asyncio.ensure_future(asyncio.wait_for(
+            self._async_fused_search(query, doc_filename, top_k * 2, allowed_levels, vector_stats, query_embedding,
+                                     cancel_vector),
+            self.vector_timeout
+        ))
 
-        vector_chunks = await self._async_vector_search(query, doc_filename, top_k, allowed_levels)
+        try:
+            done, _ = await asyncio.wait({sql_task, vector_task}, return_when=asyncio.FIRST_COMPLETED)
+            if sql_task in done:
+                sql_result = self._branch_result(sql_task, 'SQL', self._empty_sql_result())
+                if (sql_result['confidence'] >= 0.9 and sql_result['query_type'] == 'metadata'
+                        and sql_result['chunks']):
+                    print(f"Using SQL-only results due to high confidence ({sql_result['confidence']})")
+                    # Cancelling the task only drops the await; the event stops the executor work
+                    cancel_vector.set()
+                    vector_task.cancel()
+                    return await loop.run_in_executor(
+                        self._vector_executor,
+                        lambda: self.reranker.rerank(query, sql_result['chunks'], top_k=top_k, query_intent=query_intent,
+                                                      rerank_stats=rerank_stats)
+                    )
+                vector_chunks = await self._await_branch(vector_task, 'vector', [])
+            else:
+                vector_chunks = self._branch_result(vector_task, 'vector', [])
+                # Vector results are in: give SQL a short grace period, then drop it.
+                # If the vector branch failed, SQL keeps its full timeout.
+                grace = self.sql_grace if vector_chunks else None
+                sql_result = await self._await_branch(sql_task, 'SQL', self._empty_sql_result(), timeout=grace)
+        finally:
+            # Stops a still-running branch before its next Oracle query or rerank
+            cancel_sql.set()
+            cancel_vector.set()
+        for key, value in vector_stats.items():
+            rerank_stats[key] = rerank_stats.get(key, 0) + value
+
+        sql_chunks = sql_result['chunks']
+        sql_confidence = sql_result['confidence']
+        sql_query_type = sql_result['query_type']
+        print(f"Merging {len(vector_chunks)} vector and {len(sql_chunks)} SQL chunks")
 
         if sql_confidence >= 0.8 and sql_query_type == 'metadata':
             weights = {'vector': 0.2, 'sql': 0.8}
@@ -76,66 +201,187 @@ class HybridRetriever:
 
         print(f"Using weights: {weights}")
 
-        merged_chunks = self._smart_merge(vector_chunks, sql_chunks, weights)
+        candidates = self._smart_merge(vector_chunks, sql_chunks, weights)
 
         if query_intent.get('is_overview_query', False):
-            merged_chunks = self._apply_overview_boosting(merged_chunks, query_intent)
+            self._apply_overview_boosting(candidates, query_intent)
+        merged_chunks = candidates.chunks()
 
         if merged_chunks and self.reranker:
-            merged_chunks = self.reranker.rerank(query, merged_chunks, top_k=top_k, query_intent=query_intent)
+            merged_chunks = await loop.run_in_executor(
+                self._vector_executor,
+                lambda: self.reranker.rerank(query, merged_chunks, top_k=top_k, query_intent=query_intent,
+                                              rerank_stats=rerank_stats)
+            )
 
         return merged_chunks[:top_k]
     
-    def _needs_sql_search(self, query: str) -> bool:
-        sql_indicators = [
-            'มากกว่า', 'น้อยกว่า', 'ระหว่าง', 'เท่ากับ', 'เกิน', 'ไม่เกิน', 'ต่ำกว่า', 'สูงกว่า',
-            'จำนวนหน้า', 'กี่หน้า', 'อัพโหลดเมื่อ', 'วันที่', 'เดือน', 'ปี',
-            'ประเภท', 'ทั้งหมด', 'นับ', 'เฉลี่ย', 'รวม', 'กี่ไฟล์', 'กี่เอกสาร', 'กี่บท', 'กี่ตาราง',
-            'เนื้อหาหน้า', 'ขอเนื้อหา', 'ข้อมูลหน้า',
-            'ตั้งแต่หน้า', 'ถึงหน้า', 'จากหน้า', 'ไปหน้า',
-            'ตั้งแต่', 'ถึง', 'จาก', 'ไป',
-            'more than', 'less than', 'between', 'equal', 'exceed', 'over', 'under',
-            'pages', 'uploaded', 'date', 'month', 'year',
-            'type', 'all', 'count', 'average', 'total', 'how many',
-            'content of page', 'page content',
-            'from page', 'to page', 'page range',
-            '>', '<', '>=', '<=', '=',
-            'ไฟล์ไหน', 'เอกสารไหน', 'วิทยานิพนธ์ไหน', 'which document', 'which file'
-        ]
-
-        query_lower = query.lower()
-        
-        page_patterns = [
-            r'หน้า\s*\d+\s*[-–]\s*\d+',
-            r'page\s*\d+\s*[-–]\s*\d+',
-            r'ตั้งแต่หน้า\s*\d+\s*ถึง\s*\d+',
-            r'จากหน้า\s*\d+\s*ถึง\s*\d+',
-            r'หน้า\s*\d+\s*ถึง\s*\d+',
-            r'from page\s*\d+\s*to\s*\d+',
-        ]
-
-        for pattern in page_patterns:
-            if re.search(pattern, query_lower):
-                return True
-
-        if re.search(r'หน้า\s*\d+|page\s*\d+', query_lower):
-            return True
-
-        return any(indicator in query_lower for indicator in sql_indicators)
+    def _empty_sql_result(self) -> Dict:
+        return {'chunks': [], 'confidence': 0.0, 'query_type': 'hybrid'}
+
+    def _branch_result(self, task: asyncio.Future, name: str, default):
+        """Result of a finished branch, or default if it failed or timed out."""
+        if task.cancelled():
+            return default
+        error = task.exception()
+        if error is None:
+            return task.result()
+        if isinstance(error, asyncio.TimeoutError):
+            print(f"{name} branch timed out")
+        else:
+            print(f"{name} branch failed: {error}")
+        return default
+
+    async def _await_branch(self, task: asyncio.Future, name: str, default, timeout: Optional[float] = None):
+        """Wait for a branch; after timeout seconds (if given) it is cancelled and default returned."""
+        try:
+            return await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            print(f"{name} branch timed out")
+        except Exception as e:
+            print(f"{name} branch failed: {e}")
+        return default
+
+    def _needs_sql_search(self, analysis: QueryAnalysis) -> bool:
+        # Any page reference (single, list or range) or SQL-ish keyword
+        return analysis.page_ref is not None or analysis.has('sql')
     
-    async def _async_vector_search(self, query: str, doc_filename: Optional[str], 
-                                   top_k: int, allowed_levels: Optional[List[str]] = None) -> List[Dict]:
+    async def _async_fused_search(self, query: str, doc_filename: Optional[str],
+                                  top_k: int, allowed_levels: Optional[List[str]] = None,
+                                  rerank_stats: Optional[Dict] = None,
+                                  query_embedding: Optional[List[float]] = None,
+                                  cancel_event: Optional[threading.Event] = None) -> List[Dict]:
+        """Vector and Oracle Text searches run concurrently, merged by reciprocal rank fusion.
+
+        Unscoped queries on a large corpus are first routed to the top-M
+        documents by their document vectors, and chunk search runs only there.
+        cancel_event, once set, stops the vector search before it reranks.
+        """
+        loop = asyncio.get_event_loop()
+        doc_ids = None
+        if not doc_filename and self._should_route():
+            if query_embedding is None:
+                query_embedding = await loop.run_in_executor(self._vector_executor, self.embedder.encode, query)
+            routed = await loop.run_in_executor(
+                self._vector_executor, self.db.search_documents, query_embedding, self.route_top_m, allowed_levels
+            )
+            doc_ids = [d['doc_id'] for d in routed] or None
+            print(f"Routed to documents: {doc_ids}")
+
+        vector_task = loop.run_in_executor(
+            self._vector_executor, self.vector_retriever.retrieve,
+            query, doc_filename, top_k, allowed_levels, doc_ids, query_embedding, rerank_stats, cancel_event
+        )
+        if not self.use_lexical_search:
+            return await vector_task
+
+        lexical_task = loop.run_in_executor(
+            self._vector_executor, self.lexical_retriever.retrieve, query, doc_filename, top_k, allowed_levels, doc_ids
+        )
+        vector_chunks, lexical_chunks = await asyncio.gather(vector_task, lexical_task)
+        print(f"Vector: {len(vector_chunks)} chunks, lexical: {len(lexical_chunks)} chunks")
+        if not lexical_chunks:
+            return vector_chunks
+        return self._rrf_fuse([vector_chunks, lexical_chunks])[:top_k]
+
+    def _should_route(self) -> bool:
+        # Routing only pays off when there are more documents than it keeps
+        return self.use_document_routing and len(self.db.catalog) > self.route_top_m
+
+    def _is_document_lookup(self, analysis: QueryAnalysis) -> bool:
+        # Page counts, dates and other numeric filters still need the SQL path
+        has_filter = bool(analysis.numbers) or analysis.has('lookup_filter')
+        return analysis.has('which_document') and not has_filter
+
+    async def _async_document_matches(self, query: str, top_k: int,
+                                      allowed_levels: Optional[List[str]] = None,
+                                      query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        loop = asyncio.get_event_loop()
+        if query_embedding is None:
+            query_embedding = await loop.run_in_executor(self._vector_executor, self.embedder.encode, query)
+        matches = await loop.run_in_executor(
+            self._vector_executor, self.db.search_documents, query_embedding, min(top_k, self.route_top_m), allowed_levels
+        )
+        chunks = []
+        for match in matches:
+            text = f"เอกสาร: {match['title']} - ไฟล์: {match['filename']}"
+            if match['abstract']:
+                text += f"\n{match['abstract']}"
+            chunks.append({
+                'doc_id': match['doc_id'],
+                'text': text,
+                'type': 'document_match',
+                'page': 0,
+                'filename': match['filename'],
+                'title': match['title'],
+                'classification': match['classification'],
+                'score': 1 - match['distance'],
+                'source': 'document_vector',
+                'metadata': {}
+            })
+        return chunks
+
+    def _rrf_fuse(self, ranked_lists: List[List[Dict]]) -> List[Dict]:
+        """Reciprocal rank fusion: each chunk scores sum(1 / (k + rank)) over the lists it appears in.
+
+        Rank-based, so the cosine/rerank scores and the Oracle Text scores never
+        need to be put on a common scale. 'score' is rescaled to 0-1 afterwards
+        for the downstream weighting.
+        """
+        # Scores and sources live in side arrays by position; only the first dict
+        # seen for each chunk is kept, and it is stamped once at the end
+        positions = {}
+        chunks: List[Dict] = []
+        sources: List[List[str]] = []
+        hits: List[int] = []
+        contributions: List[float] = []
+        for ranked in ranked_lists:
+            for rank, chunk in enumerate(ranked, start=1):
+                key = self._fusion_key(chunk)
+                position = positions.get(key)
+                if position is None:
+                    position = positions[key] = len(chunks)
+                    chunks.append(chunk)
+                    sources.append([])
+                sources[position].append(chunk.get('source', 'vector'))
+                hits.append(position)
+                contributions.append(1.0 / (self.rrf_k + rank))
+
+        if not chunks:
+            return []
+        rrf_scores = np.zeros(len(chunks))
+        np.add.at(rrf_scores, hits, contributions)
+        top = rrf_scores.max()
+        fused = []
+        for i in descending_order(rrf_scores):
+            chunk = chunks[i]
+            chunk['rrf_score'] = float(rrf_scores[i])
+            chunk['fusion_sources'] = sources[i]
+            chunk['score'] = float(rrf_scores[i] / top)
+            fused.append(chunk)
+        return fused
+
+    def _fusion_key(self, chunk: Dict):
+        if chunk.get('chunk_id'):
+            return chunk['chunk_id']
+        return (chunk.get('filename'), chunk.get('page'), chunk.get('text', '')[:200])
+
+    async def _async_sql_search(self, query: str, doc_filename: Optional[str],
+                                allowed_levels: Optional[List[str]] = None,
+                                cancel_event: Optional[threading.Event] = None,
+                                analysis: Optional[QueryAnalysis] = None) -> Dict:
+        # SQL generation awaits the LLM gateway (cancelled with this task on timeout);
+        # the embedding and the cursor are blocking, so they run on the SQL pool
+        sql_result = await self.sql_generator.generate_sql(query, doc_filename, analysis)
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(
-            None, 
-            self.vector_retriever.retrieve,
-            query, doc_filename, top_k * 2, allowed_levels
+            self._sql_executor, self._sql_search, sql_result, doc_filename, allowed_levels, cancel_event
         )
-    
-    async def _async_sql_search(self, query: str, 
-                       doc_filename: Optional[str], allowed_levels: Optional[List[str]] = None) -> Dict:
+
+    def _sql_search(self, sql_result: Dict, doc_filename: Optional[str],
+                    allowed_levels: Optional[List[str]] = None,
+                    cancel_event: Optional[threading.Event] = None) -> Dict:
         try:
-            sql_result = self.sql_generator.generate_sql(query, doc_filename)
             sql = sql_result['sql']
 
             # Ensure classification is selected for downstream filtering/metadata
@@ -154,7 +400,7 @@ class HybridRetriever:
             print(f"Generated SQL: {sql}")
             print(f"Query type: {query_type}, Confidence: {confidence}")
 
-            params = {}
+            params = dict(sql_result.get('params') or {})
             params.update(params_extra)
             if needs_embedding and embedding_terms:
                 combined_text = ' '.join(embedding_terms)
@@ -171,53 +417,32 @@ class HybridRetriever:
             elif doc_filename and ':filename' in sql:
                 params['filename'] = doc_filename
 
-            # Use standard pooled connection (transaction is read-only logically by our queries)
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, params)
-
-                columns = [col[0].lower() for col in cursor.description]
-                results = []
-
-                for row in cursor:
-                    row_dict = {}
-                    for i, col in enumerate(columns):
-                        value = row[i]
-
-                        if hasattr(value, 'read'):
-                            value = value.read()
-                        elif isinstance(value, dict):
-                            pass
-                        elif col == 'metadata' and isinstance(value, str):
-                            try:
-                                value = json.loads(value)
-                            except:
-                                value = {}
-
-                        row_dict[col] = value
-
-                    chunk = self._sql_row_to_chunk(row_dict)
-                    results.append(chunk)
-
-                print(f"SQL returned {len(results)} results")
-
-                # Post-filter (safety net) if classification present
-                if allowed_levels:
-                    filtered = []
-                    for c in results:
-                        c_class = c.get('classification') or c.get('metadata', {}).get('classification')
-                        if not c_class or c_class in allowed_levels:
-                            filtered.append(c)
-                    results = filtered
-
-                return {
-                    'chunks': results,
-                    'confidence': confidence,
-                    'query_type': query_type
-                }
+            if cancel_event is not None and cancel_event.is_set():
+                print("SQL branch abandoned before querying Oracle")
+                return self._empty_sql_result()
+
+            # LOB-free fetch: CLOB/JSON values arrive inline with the rows
+            results = [self._sql_row_to_chunk(row) for row in self.db.fetch_dicts(sql, params, arraysize=50)]
+            print(f"SQL returned {len(results)} results")
+
+            # Post-filter (safety net) if classification present
+            if allowed_levels:
+                filtered = []
+                for c in results:
+                    c_class = c.get('classification') or c.get('metadata', {}).get('classification')
+                    if not c_class or c_class in allowed_levels:
+                        filtered.append(c)
+                results = filtered
+
+            return {
+                'chunks': results,
+                'confidence': confidence,
+                'query_type': query_type
+            }
 
         except Exception as e:
             print(f"SQL search error: {e}")
+            self.sql_generator.forget_plan(sql_result)
             import traceback
             traceback.print_exc()
             return {
@@ -249,6 +474,8 @@ class HybridRetriever:
                     parts.append(f"ไฟล์: {filename}")
                 if total_pages:
                     parts.append(f"จำนวน {total_pages} หน้า")
+                if row.get('created_at'):
+                    parts.append(f"อัพโหลดเมื่อ {row['created_at']:%Y-%m-%d}")
                 chunk_text = ' - '.join(parts)
             else:
                 chunk_text = "ไม่มีข้อมูล"
@@ -297,10 +524,10 @@ class HybridRetriever:
             # insert after WHERE but before any group/order/fetch
             pattern = re.compile(r'where', re.IGNORECASE)
             # To avoid complex parsing just append AND before ORDER BY / FETCH
-            sql = re.sub(r'(where\s+)(.*?)(order by|fetch first|$)', lambda m: f"{m.group(1)}{m.group(2)} AND {clause} {m.group(3)}", sql, flags=re.IGNORECASE | re.DOTALL, count=1)
+            sql = re.sub(r'(where\s+)(.*?)(group by|order by|fetch first|$)', lambda m: f"{m.group(1)}{m.group(2)} AND {clause} {m.group(3)}", sql, flags=re.IGNORECASE | re.DOTALL, count=1)
         else:
-            # insert before ORDER BY / FETCH
-            sql = re.sub(r'(order by|fetch first)', f"WHERE {clause} \1", sql, flags=re.IGNORECASE, count=1)
+            # insert before GROUP BY / ORDER BY / FETCH
+            sql = re.sub(r'(group by|order by|fetch first)', f"WHERE {clause} \\1", sql, flags=re.IGNORECASE, count=1)
             if 'WHERE' not in sql.upper():
                 sql += f" WHERE {clause}"
         return sql, params
@@ -332,87 +559,15 @@ class HybridRetriever:
         return merged
     
     def _smart_merge(self, vector_chunks: List[Dict], sql_chunks: List[Dict], 
-                    weights: Dict[str, float]) -> List[Dict]:
-        all_chunks = []
-
-        for chunk in vector_chunks:
-            chunk['weighted_score'] = chunk.get('score', 0.5) * weights['vector']
-            chunk['sources'] = ['vector']
-            all_chunks.append(chunk)
-
-        for chunk in sql_chunks:
-            existing = self._find_similar_chunk(chunk, all_chunks)
-            if existing:
-                existing['weighted_score'] += 1.0 * weights['sql']
-                existing['sources'].append('sql')
-            else:
-                chunk['weighted_score'] = 1.0 * weights['sql']
-                chunk['sources'] = ['sql']
-                all_chunks.append(chunk)
-
-        all_chunks.sort(key=lambda x: x['weighted_score'], reverse=True)
-
-        return self._apply_smart_diversity(all_chunks)
-    
-    def _find_similar_chunk(self, target_chunk: Dict, chunk_list: List[Dict]) -> Optional[Dict]:
-        target_key = f"{target_chunk.get('doc_id', 0)}_{target_chunk.get('page', 0)}_{target_chunk.get('chunk_id', 0)}"
-
-        for chunk in chunk_list:
-            chunk_key = f"{chunk.get('doc_id', 0)}_{chunk.get('page', 0)}_{chunk.get('chunk_id', 0)}"
-            if chunk_key == target_key:
-                return chunk
-
-        return None
-    
-    def _apply_smart_diversity(self, chunks: List[Dict]) -> List[Dict]:
-        diverse_chunks = []
-        page_counts = {}
-        doc_counts = {}
-
-        for chunk in chunks:
-            page_key = f"{chunk.get('doc_id', 0)}_{chunk.get('page', 0)}"
-            doc_id = chunk.get('doc_id', 0)
-
-            page_count = page_counts.get(page_key, 0)
-            doc_count = doc_counts.get(doc_id, 0)
-
-            diversity_penalty = 1.0
-            if page_count >= 2:
-                diversity_penalty *= 0.7
-            if doc_count >= 5:
-                diversity_penalty *= 0.8
-
-            chunk['final_weighted_score'] = chunk['weighted_score'] * diversity_penalty
-            diverse_chunks.append(chunk)
-
-            page_counts[page_key] = page_count + 1
-            doc_counts[doc_id] = doc_count + 1
-
-        diverse_chunks.sort(key=lambda x: x['final_weighted_score'], reverse=True)
-
-        return diverse_chunks
-    
-    def _analyze_query_intent(self, query: str) -> Dict:
-        query_lower = query.lower()
-    
-        metadata_patterns = {
-            'page_count': ['จำนวนหน้า', 'กี่หน้า', 'pages count', 'how many pages', 'เกิน', 'มากกว่า', 'น้อยกว่า', 'ไม่เกิน'],
-            'date': ['วันที่', 'เมื่อไหร่', 'date', 'when', 'อัพโหลด'],
-            'title': ['ชื่อ', 'title', 'เรื่อง', 'ชื่อเรื่อง'],
-            'list': ['ทั้งหมด', 'all', 'list', 'แสดงรายการ', 'ไหนบ้าง', 'อะไรบ้าง'],
-            'document_query': ['ไฟล์ไหน', 'เอกสารไหน', 'วิทยานิพนธ์ไหน', 'which document', 'which file']
-        }
-    
-        content_patterns = {
-            'summary': ['สรุป', 'summary', 'ย่อ', 'บทคัดย่อ'],
-            'detail': ['รายละเอียด', 'detail', 'อธิบาย', 'explain'],
-            'specific': ['บทที่', 'chapter', 'หัวข้อ', 'section', 'ตอนที่'],
-            'research': ['ผลการวิจัย', 'วิธีการ', 'results', 'methodology'],
-            'page_content': ['เนื้อหาหน้า', 'ขอเนื้อหา', 'content of page', 'ข้อมูลหน้า', 'หน้า \\d+']
-        }
-    
-        overview_patterns = ['สรุป', 'ภาพรวม', 'overview', 'summary', 'เกี่ยวกับอะไร', 'คืออะไร', 'พูดถึงอะไร', 'เนื้อหาหลัก']
+                    weights: Dict[str, float]) -> CandidateSet:
+        candidates = CandidateSet(len(vector_chunks) + len(sql_chunks))
+        candidates.add(vector_chunks, 'vector', weights['vector'])
+        # A SQL hit counts fully whatever its row score
+        candidates.add(sql_chunks, 'sql', weights['sql'], scores=np.ones(len(sql_chunks)))
+        candidates.penalise_repeats()
+        return candidates
     
+    def _analyze_query_intent(self, analysis: QueryAnalysis) -> Dict:
         intent = {
             'primary_focus': 'unknown',
             'requires_content': False,
@@ -421,64 +576,24 @@ class HybridRetriever:
             'is_overview_query': False,
             'needs_document_selection': False,
             'preferred_chunk_types': [],
-            'is_page_range_query': False,
-            'is_page_query': False,
-            'is_multiple_pages_query': False,
-            'page_range': None,
-            'page_numbers': []
+            'is_page_range_query': analysis.is_page_range_query,
+            'is_page_query': analysis.is_page_query,
+            'is_multiple_pages_query': analysis.is_multiple_pages_query,
+            'page_range': analysis.page_range,
+            'page_numbers': list(analysis.page_numbers)
         }
     
-        # Check for single page pattern
-        single_page_match = re.search(r'หน้า\s*(\d+)(?!\s*[-–ถึงและ])|page\s*(\d+)(?!\s*[-–to])', query_lower)
-        if single_page_match:
-            page_num = int(single_page_match.group(1) or single_page_match.group(2))
-            intent['is_page_query'] = True
-            intent['requires_content'] = True
-            intent['page_numbers'] = [page_num]
-            intent['needs_document_selection'] = True
-    
-        # Check for multiple specific pages (e.g., "หน้า 59 และ 78", "หน้า 10, 20, 30")
-        multiple_pages = re.findall(r'\d+', query_lower)
-        if len(multiple_pages) >= 2 and any(word in query_lower for word in ['หน้า', 'page']) and any(word in query_lower for word in ['และ', 'กับ', ',', 'and']):
-            intent['is_multiple_pages_query'] = True
-            intent['requires_content'] = True
-            intent['page_numbers'] = [int(p) for p in multiple_pages]
-            intent['needs_document_selection'] = True
-    
-        # Check for page range patterns
-        page_range_patterns = [
-            r'หน้า\s*(\d+)\s*[-–]\s*(\d+)',
-            r'page\s*(\d+)\s*[-–]\s*(\d+)',
-            r'ตั้งแต่หน้า\s*(\d+)\s*ถึง\s*(\d+)',
-            r'จากหน้า\s*(\d+)\s*ถึง\s*(\d+)',
-            r'หน้า\s*(\d+)\s*ถึง\s*(\d+)',
-            r'from page\s*(\d+)\s*to\s*(\d+)',
-            r'ตั้งแต่หน้า\s*(\d+)\s*ถึงหน้า\s*(\d+)',
-            r'จากหน้า\s*(\d+)\s*ไปถึงหน้า\s*(\d+)',
-        ]
-    
-        page_range_match = None
-        for pattern in page_range_patterns:
-            match = re.search(pattern, query_lower)
-            if match:
-                page_range_match = match
-                break
-            
-        if page_range_match:
-            intent['is_page_range_query'] = True
+        # Single page, several pages ("หน้า 59 และ 78") or a range ("หน้า 10-20")
+        if analysis.is_page_query or analysis.is_multiple_pages_query or analysis.is_page_range_query:
             intent['requires_content'] = True
-            start_page = int(page_range_match.group(1))
-            end_page = int(page_range_match.group(2))
-            intent['page_range'] = (start_page, end_page)
             intent['needs_document_selection'] = True
     
         metadata_score = 0
         content_score = 0
-        overview_score = 0
     
         # ตรวจสอบ metadata patterns
-        for category, patterns in metadata_patterns.items():
-            if any(p in query_lower for p in patterns):
+        for category in ('page_count', 'date', 'title', 'list', 'document_query'):
+            if analysis.has(category):
                 metadata_score += 1
                 intent['requires_metadata'] = True
                 # ถ้าเป็น document_query หรือ page_count ให้ score เพิ่ม
@@ -486,26 +601,21 @@ class HybridRetriever:
                     metadata_score += 1
     
         # ตรวจสอบ content patterns
-        for category, patterns in content_patterns.items():
-            if category == 'page_content':
-                for pattern in patterns:
-                    if re.search(pattern, query_lower):
-                        content_score += 2
-                        intent['requires_content'] = True
-                        break
-            else:
-                if any(p in query_lower for p in patterns):
-                    content_score += 1
-                    intent['requires_content'] = True
+        for category in ('summary', 'detail', 'specific', 'research'):
+            if analysis.has(category):
+                content_score += 1
+                intent['requires_content'] = True
+        if analysis.has('page_content') or analysis.page_ref is not None:
+            content_score += 2
+            intent['requires_content'] = True
     
         # ตรวจสอบ overview patterns
-        for pattern in overview_patterns:
-            if pattern in query_lower:
-                overview_score += 1
-                intent['is_overview_query'] = True
+        overview_score = analysis.count('overview')
+        if overview_score:
+            intent['is_overview_query'] = True
     
         # ตรวจสอบว่าต้องการเลือกเอกสารหรือไม่
-        if ('เอกสารนี้' in query_lower or 'this document' in query_lower) and overview_score > 0:
+        if analysis.has('this_document') and overview_score > 0:
             intent['needs_document_selection'] = True
     
         # กำหนด preferred chunk types สำหรับ overview
@@ -531,38 +641,7 @@ class HybridRetriever:
     
         return intent
     
-    def _apply_overview_boosting(self, chunks: List[Dict], query_intent: Dict) -> List[Dict]:
-        if not query_intent.get('is_overview_query', False):
-            return chunks
-        
-        boosted_chunks = []
-        preferred_types = query_intent.get('preferred_chunk_types', [])
-        
-        for chunk in chunks:
-            boosted_chunk = chunk.copy()
-            boost_factor = 1.0
-            
-            if chunk.get('type') in preferred_types:
-                boost_factor *= 1.5
-            
-            chunk_text_lower = chunk.get('text', '').lower()
-            overview_keywords = ['บทคัดย่อ', 'abstract', 'สรุป', 'summary', 'บทนำ', 'introduction', 
-                               'วัตถุประสงค์', 'objective', 'ภาพรวม', 'overview']
-            
-            keyword_count = sum(1 for keyword in overview_keywords if keyword in chunk_text_lower)
-            if keyword_count > 0:
-                boost_factor *= (1.0 + 0.2 * keyword_count)
-            
-            if 'score' in boosted_chunk:
-                boosted_chunk['score'] *= boost_factor
-            if 'weighted_score' in boosted_chunk:
-                boosted_chunk['weighted_score'] *= boost_factor
-            if 'final_weighted_score' in boosted_chunk:
-                boosted_chunk['final_weighted_score'] *= boost_factor
-            
-            boosted_chunk['overview_boost'] = boost_factor
-            boosted_chunks.append(boosted_chunk)
-        
-        boosted_chunks.sort(key=lambda x: x.get('final_weighted_score', x.get('weighted_score', x.get('score', 0))), reverse=True)
-        
-        return boosted_chunks
\ No newline at end of file
+    def _apply_overview_boosting(self, candidates: CandidateSet, query_intent: Dict) -> CandidateSet:
+        if query_intent.get('is_overview_query', False):
+            candidates.boost_overview(query_intent.get('preferred_chunk_types', []))
+        return candidates
@@ -0,0 +1,81 @@
+from typing import List, Dict, Optional
+import re
+from database import OracleVectorDB
+
+# Thai question words/particles and English filler that carry no search value.
+# Thai is stripped as substrings because it is written without spaces.
+THAI_QUESTION_WORDS = [
+    'คืออะไร', 'หมายถึงอะไร', 'เท่าไหร่', 'เท่าไร', 'อย่างไร', 'ยังไง', 'หรือไม่',
+    'ใช่ไหม', 'อะไร', 'ที่ไหน', 'เมื่อไหร่', 'เมื่อไร', 'ไหม', 'บ้าง', 'ครับ', 'ค่ะ', 'คะ'
+]
+ENGLISH_STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'of', 'in', 'on', 'for', 'to',
+    'and', 'or', 'what', 'which', 'who', 'how', 'when', 'where', 'does', 'do', 'this', 'that'
+}
+
+# Latin/digit/Thai runs; dots, commas, slashes and hyphens are kept inside a
+# term so contract numbers (ABC-2024/001) and amounts (1,500,000.00) survive
+TERM_PATTERN = re.compile(r'[0-9A-Za-z฀-๿](?:[0-9A-Za-z฀-๿.,/\-]*[0-9A-Za-z฀-๿])?')
+
+
+class LexicalRetriever:
+    """Keyword search over content_segments through the Oracle Text index.
+
+    Catches what dense vectors miss (party names, contract numbers, amounts)
+    without an LLM call; HybridRetriever fuses the results with vector hits.
+    """
+
+    def __init__(self, db: OracleVectorDB, max_terms: int = 12):
+        self.db = db
+        self.max_terms = max_terms
+
+    def build_text_query(self, query: str) -> Optional[str]:
+        """Turn free text into a CONTAINS expression, or None if nothing is searchable.
+
+        Each term is wrapped in braces, which escapes Oracle Text operators and
+        reserved words, and terms are joined with ACCUM (,) so segments that
+        match more of them rank higher.
+        """
+        text = query
+        for word in THAI_QUESTION_WORDS:
+            text = text.replace(word, ' ')
+
+        terms = []
+        for term in TERM_PATTERN.findall(text):
+            if term.lower() in ENGLISH_STOPWORDS or len(term) < 2:
+                continue
+            if term not in terms:
+                terms.append(term)
+
+        if not terms:
+            return None
+        return ', '.join('{' + term + '}' for term in terms[:self.max_terms])
+
+    def retrieve(self, query: str, doc_filename: Optional[str] = None,
+                 top_k: int = 20, allowed_levels: Optional[List[str]] = None,
+                 doc_ids: Optional[List[int]] = None) -> List[Dict]:
+        text_query = self.build_text_query(query)
+        if not text_query:
+            return []
+
+        doc_id = None
+        if doc_filename:
+            doc = self.db.get_document_info(doc_filename)
+            if not doc:
+                return []
+            doc_id = doc['doc_id']
+
+        try:
+            chunks = self.db.search_lexical_chunks(
+                text_query, doc_id, top_k, allowed_levels=allowed_levels, doc_ids=doc_ids
+            )
+        except Exception as e:
+            # e.g. the Oracle Text index has not been created yet
+            print(f"Lexical search error: {e}")
+            return []
+
+        for chunk in chunks:
+            # Oracle Text scores are 0-100
+            chunk['score'] = chunk['lexical_score'] / 100.0
+            chunk['source'] = 'lexical'
+        return chunks
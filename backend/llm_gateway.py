@@ -0,0 +1,225 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
+from openai import (
+    AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+)
+from config import Config
+
+# Errors worth another attempt while the call's deadline allows it
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+
+class LLMDeadlineExceeded(Exception):
+    """The call did not complete within its purpose's time budget."""
+
+
+class LLMGateway:
+    """Single async entry point for every DeepSeek chat completion.
+
+    One AsyncOpenAI client over one pooled httpx client is shared by all call
+    sites. Each call names a purpose ('answer', 'sql', 'title', 'template')
+    whose budget is the deadline for the whole call: waiting for a concurrency
+    slot, every attempt and the jittered backoff between attempts. A stream's
+    budget ends at its first token; from then on it fails only when no chunk
+    arrives for stream_idle_timeout seconds. At most max_concurrency
+    completions are in flight per worker.
+    """
+
+    def __init__(self, budgets: Dict[str, float], max_concurrency: int, max_retries: int = 2,
+                 model: str = 'deepseek-chat', stream_idle_timeout: float = 30.0):
+        self.budgets = budgets
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.stream_idle_timeout = stream_idle_timeout
+        self.model = model
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+        self.in_flight = 0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+                timeout=httpx.Timeout(max(self.budgets.values()), connect=5.0)
+            )
+            self._client = AsyncOpenAI(
+                api_key=os.getenv('DEEPSEEK_API_KEY'),
+                base_url="https://api.deepseek.com",
+                http_client=http_client,
+                max_retries=0  # retries are ours, within the deadline
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def chat(self, purpose: str, messages: List[Dict], temperature: float,
+                   max_tokens: int, timeout: Optional[float] = None) -> str:
+        """Completion text for messages, retried within the purpose's budget."""
+        deadline = time.monotonic() + (timeout or self.budgets[purpose])
+        started = time.monotonic()
+        attempt = 0
+        try:
+            async with self._slot(deadline):
+                while True:
+                    try:
+                        # Before creating the coroutine, so a spent deadline leaves none un-awaited
+                        remaining = self._remaining(deadline)
+                        response = await asyncio.wait_for(
+                            self.client.chat.completions.create(
+                                model=self.model,
+                                messages=messages,
+                                temperature=temperature,
+                                max_tokens=max_tokens
+                            ),
+                            remaining
+                        )
+                        self._record(purpose, 'ok', time.monotonic() - started, attempt)
+                        return response.choices[0].message.content or ''
+                    except RETRYABLE_ERRORS as e:
+                        attempt += 1
+                        await self._backoff(purpose, attempt, deadline, e)
+        except (asyncio.TimeoutError, LLMDeadlineExceeded):
+            self._record(purpose, 'timeout', time.monotonic() - started, attempt)
+            raise LLMDeadlineExceeded(f"{purpose} LLM call exceeded its {self.budgets[purpose]}s budget")
+        except Exception:
+            self._record(purpose, 'error', time.monotonic() - started, attempt)
+            raise
+
+    async def stream(self, purpose: str, messages: List[Dict], temperature: float,
+                     max_tokens: int, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Completion deltas as they arrive. Only connecting is retried; once a
+        token has been yielded a failure propagates to the caller.
+
+        The purpose's budget bounds the time to the first token. A long answer
+        may then stream for as long as chunks keep arriving within
+        stream_idle_timeout of each other."""
+        deadline = time.monotonic() + (timeout or self.budgets[purpose])
+        started = time.monotonic()
+        attempt = 0
+        streaming = False
+        try:
+            async with self._slot(deadline):
+                while True:
+                    try:
+                        remaining = self._remaining(deadline)
+                        stream = await asyncio.wait_for(
+                            self.client.chat.completions.create(
+                                model=self.model,
+                                messages=messages,
+                                temperature=temperature,
+                                max_tokens=max_tokens,
+                                stream=True
+                            ),
+                            remaining
+                        )
+                        break
+                    except RETRYABLE_ERRORS as e:
+                        attempt += 1
+                        await self._backoff(purpose, attempt, deadline, e)
+                try:
+                    events = stream.__aiter__()
+                    while True:
+                        wait = self.stream_idle_timeout if streaming else self._remaining(deadline)
+                        try:
+                            event = await asyncio.wait_for(events.__anext__(), wait)
+                        except StopAsyncIteration:
+                            break
+                        if event.choices and event.choices[0].delta.content:
+                            streaming = True
+                            yield event.choices[0].delta.content
+                finally:
+                    # Also runs when the consumer stops early (client went away)
+                    await stream.close()
+            self._record(purpose, 'ok', time.monotonic() - started, attempt)
+        except (asyncio.TimeoutError, LLMDeadlineExceeded):
+            self._record(purpose, 'timeout', time.monotonic() - started, attempt)
+            if streaming:
+                raise LLMDeadlineExceeded(
+                    f"{purpose} LLM stream stalled for {self.stream_idle_timeout}s between chunks"
+                )
+            raise LLMDeadlineExceeded(f"{purpose} LLM stream got no token within its {self.budgets[purpose]}s budget")
+        except Exception:
+            self._record(purpose, 'error', time.monotonic() - started, attempt)
+            raise
+
+    @asynccontextmanager
+    async def _slot(self, deadline: float):
+        await asyncio.wait_for(self.semaphore.acquire(), self._remaining(deadline))
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def _remaining(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded()
+        return remaining
+
+    async def _backoff(self, purpose: str, attempt: int, deadline: float, error: Exception):
+        if attempt > self.max_retries:
+            raise error
+        # Full jitter: sleep anywhere in [0, 0.5 * 2^attempt] seconds
+        delay = random.uniform(0, 0.5 * 2 ** attempt)
+        if delay >= self._remaining(deadline):
+            raise LLMDeadlineExceeded()
+        print(f"LLM {purpose} call failed ({type(error).__name__}), retry {attempt} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    def _record(self, purpose: str, outcome: str, seconds: float, retries: int):
+        with self._stats_lock:
+            stats = self._stats.setdefault(purpose, {
+                'calls': 0, 'ok': 0, 'timeout': 0, 'error': 0, 'retries': 0, 'total_seconds': 0.0
+            })
+            stats['calls'] += 1
+            stats[outcome] += 1
+            stats['retries'] += retries
+            stats['total_seconds'] += seconds
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            purposes = {}
+            for purpose, s in self._stats.items():
+                purposes[purpose] = dict(s, avg_seconds=round(s['total_seconds'] / s['calls'], 2) if s['calls'] else 0.0)
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'budgets': self.budgets,
+            'purposes': purposes,
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+llm_gateway = LLMGateway(
+    budgets={
+        'answer': Config.LLM_TIMEOUT_ANSWER,
+        'sql': Config.LLM_TIMEOUT_SQL,
+        'title': Config.LLM_TIMEOUT_TITLE,
+        'template': Config.LLM_TIMEOUT_TEMPLATE,
+    },
+    max_concurrency=Config.LLM_MAX_CONCURRENCY,
+    max_retries=Config.LLM_MAX_RETRIES,
+    stream_idle_timeout=Config.LLM_STREAM_IDLE_TIMEOUT
+)
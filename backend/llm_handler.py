@@ -1,24 +1,88 @@
-import os
 import re
 import json
-from openai import OpenAI
-from typing import List, Dict
-from dotenv import load_dotenv
-
-load_dotenv()
+from typing import List, Dict, AsyncIterator, Optional, Tuple
+from answer_cache import answer_cache, context_fingerprint
+from llm_gateway import llm_gateway
+from query_analysis import analyze_query
 
 class LLMHandler:
+    # Part of every answer-cache key: bump when the answer prompt, model or
+    # sampling settings change so old answers are not served
+    ANSWER_PROMPT_VERSION = 'deepseek-chat/t0.15/v1'
+
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv('DEEPSEEK_API_KEY'),
-            base_url="https://api.deepseek.com"
-        )
+        self.llm = llm_gateway
+        self.answer_cache = answer_cache
     
-    def generate_answer(self, query: str, context_chunks: List[Dict]) -> Dict:
-        page_match = re.search(r'หน้า\s*(\d+)|page\s*(\d+)', query.lower())
+    async def generate_answer(self, query: str, context_chunks: List[Dict], use_cache: bool = True) -> Dict:
+        missing_page = self._missing_page_answer(query, context_chunks)
+        if missing_page:
+            return missing_page
+
+        context = self._format_context(context_chunks)
+        cache_key = self._answer_cache_key(query, context_chunks, context, use_cache)
+        if cache_key and use_cache:
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                print("Answer cache hit")
+                return cached
+
+        answer = await self.llm.chat(
+            'answer', self._answer_messages(query, context), temperature=0.15, max_tokens=3500
+        )
+
+        result = {
+            'answer': answer,
+            'sources': self._extract_sources(context_chunks)
+        }
+        if cache_key and answer:
+            self.answer_cache.put(cache_key, result)
+        return result
+
+    async def stream_answer(self, query: str, context_chunks: List[Dict],
+                            use_cache: bool = True) -> AsyncIterator[Tuple[str, object]]:
+        """generate_answer as a stream of (event, data) pairs.
+
+        Yields ('sources', [...]) before the model is called, then one
+        ('token', text) per streamed delta and finally ('done', {'cached': bool}).
+        Cached and canned answers arrive as a single token.
+        """
+        missing_page = self._missing_page_answer(query, context_chunks)
+        if missing_page:
+            yield 'sources', missing_page['sources']
+            yield 'token', missing_page['answer']
+            yield 'done', {'cached': False}
+            return
+
+        sources = self._extract_sources(context_chunks)
+        yield 'sources', sources
 
-        if page_match and not context_chunks:
-            page_number = page_match.group(1) or page_match.group(2)
+        context = self._format_context(context_chunks)
+        cache_key = self._answer_cache_key(query, context_chunks, context, use_cache)
+        if cache_key and use_cache:
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                print("Answer cache hit")
+                yield 'token', cached['answer']
+                yield 'done', {'cached': True}
+                return
+
+        parts = []
+        async for delta in self.llm.stream(
+            'answer', self._answer_messages(query, context), temperature=0.15, max_tokens=3500
+        ):
+            parts.append(delta)
+            yield 'token', delta
+
+        answer = ''.join(parts)
+        if cache_key and answer:
+            self.answer_cache.put(cache_key, {'answer': answer, 'sources': sources})
+        yield 'done', {'cached': False}
+
+    def _missing_page_answer(self, query: str, context_chunks: List[Dict]) -> Optional[Dict]:
+        page_number = analyze_query(query).page_ref
+
+        if page_number is not None and not context_chunks:
             return {
                 'answer': f"ไม่พบข้อมูลในหน้า {page_number} ของเอกสารที่เลือก อาจเป็นเพราะ:\n\n"
                          f"1. เอกสารมีจำนวนหน้าน้อยกว่า {page_number} หน้า\n"
@@ -27,9 +91,19 @@ class LLMHandler:
                          f"กรุณาตรวจสอบหมายเลขหน้าอีกครั้ง",
                 'sources': []
             }
+        return None
+
+    def _answer_cache_key(self, query: str, context_chunks: List[Dict], context: str,
+                          use_cache: bool) -> Optional[Tuple]:
+        if not self.answer_cache.enabled:
+            return None
+        if not use_cache:
+            self.answer_cache.record_bypass()
+        return self.answer_cache.key(
+            self.ANSWER_PROMPT_VERSION, query, context_fingerprint(context_chunks, context)
+        )
 
-        context = self._format_context(context_chunks)
-
+    def _answer_messages(self, query: str, context: str) -> List[Dict]:
         system_prompt = """คุณเป็นผู้ช่วยวิเคราะห์สัญญาและเอกสารทางกฎหมาย
         ตอบคำถามโดยอ้างอิงจากข้อมูลที่ให้มาเท่านั้น 
         ระบุแหล่งอ้างอิง (ชื่อไฟล์และหน้า) ทุกครั้ง
@@ -44,26 +118,12 @@ class LLMHandler:
         
         สำหรับคำถามเกี่ยวกับหน้าเฉพาะเจาะจง ให้แสดงเนื้อหาทั้งหมดในหน้านั้นอย่างละเอียด"""
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Context:\n{context}\n\nคำถาม: {query}"}
         ]
 
-        response = self.client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            temperature=0.15,
-            max_tokens=3500
-        )
-
-        answer = response.choices[0].message.content
-
-        return {
-            'answer': answer,
-            'sources': self._extract_sources(context_chunks)
-        }
-
-    def analyze_template_placeholders(self, template_text: str) -> List[Dict]:
+    async def analyze_template_placeholders(self, template_text: str) -> List[Dict]:
         """Return JSON array of placeholders from a template text.
 
         Output format: [{ "placeholder_name": str, "label": str, "context": str }]
@@ -81,13 +141,7 @@ class LLMHandler:
             {"role": "user", "content": user_prompt}
         ]
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                temperature=0.1,
-                max_tokens=2000
-            )
-            raw = response.choices[0].message.content.strip()
+            raw = (await self.llm.chat('template', messages, temperature=0.1, max_tokens=2000)).strip()
         except Exception:
             return []
 
@@ -108,7 +162,7 @@ class LLMHandler:
                 return []
         return []
 
-    def fill_template_with_values(self, template_text: str, values: Dict[str, str]) -> str:
+    async def fill_template_with_values(self, template_text: str, values: Dict[str, str]) -> str:
         """Use LLM to fill in placeholders in template_text with provided values; return final text."""
         system_prompt = (
             "คุณคือผู้ช่วยจัดทำสัญญา นำค่าที่ผู้ใช้กรอกเติมลงในช่องว่างของแม่แบบ (เช่น .... หรือ ____) \n"
@@ -125,17 +179,11 @@ class LLMHandler:
             {"role": "user", "content": user_prompt}
         ]
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                temperature=0.1,
-                max_tokens=6000
-            )
-            return response.choices[0].message.content.strip()
+            return (await self.llm.chat('template', messages, temperature=0.1, max_tokens=6000)).strip()
         except Exception as e:
             return template_text
     
-    def generate_document_title(self, document_info: Dict) -> str:
+    async def generate_document_title(self, document_info: Dict) -> str:
         doc_type = document_info.get('document_type', 'document')
         language = document_info.get('language', 'unknown')
 
@@ -175,14 +223,7 @@ class LLMHandler:
             {"role": "user", "content": prompt}
         ]
 
-        response = self.client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            temperature=0.15,
-            max_tokens=200
-        )
-
-        title = response.choices[0].message.content.strip()
+        title = (await self.llm.chat('title', messages, temperature=0.15, max_tokens=200)).strip()
 
         title = re.sub(r'^["\'](.*)["\']$', r'\1', title)
         title = title.replace('"', '').replace("'", '')
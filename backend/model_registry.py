@@ -0,0 +1,159 @@
+import gc
+import threading
+import time
+from typing import Callable, Dict, List
+from config import Config
+
+
+def _load_embedder():
+    from embeddings import EmbeddingGenerator
+    return EmbeddingGenerator()
+
+
+def _load_reranker():
+    from reranker import Reranker
+    return Reranker()
+
+
+def _load_ocr():
+    import easyocr
+    try:
+        import torch
+        gpu_available = torch.cuda.is_available()
+    except ImportError:
+        gpu_available = False
+    print("Initializing EasyOCR (Thai + English)...")
+    reader = easyocr.Reader(['th', 'en'], gpu=gpu_available, verbose=False)
+    print(f"EasyOCR initialized successfully (GPU: {gpu_available})")
+    return reader
+
+
+def _warm_embedder(model):
+    model.encode("warm-up")
+
+
+def _warm_reranker(model):
+    model.model.predict([["warm-up", "warm-up"]])
+    if model.first_stage_model is not None:
+        model.first_stage_model.predict([["warm-up", "warm-up"]])
+
+
+class ModelProxy:
+    """Stands in for a registry model; loads it on first attribute access."""
+
+    def __init__(self, registry: 'ModelRegistry', name: str):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+
+class ModelRegistry:
+    """Process-wide owner of the embedding model, cross-encoder and OCR reader.
+
+    Each model is loaded once, on first use or by warm_up() in the background,
+    and shared by every retriever. Models that are not in the warm-up list
+    (by default the OCR reader) are unloaded after sitting idle.
+    """
+
+    def __init__(self, idle_unload_seconds: float = 0):
+        self.idle_unload_seconds = idle_unload_seconds
+        self._factories: Dict[str, Callable] = {
+            'embedder': _load_embedder,
+            'reranker': _load_reranker,
+            'ocr': _load_ocr,
+        }
+        self._warmers: Dict[str, Callable] = {
+            'embedder': _warm_embedder,
+            'reranker': _warm_reranker,
+        }
+        self._models: Dict[str, object] = {}
+        self._last_used: Dict[str, float] = {}
+        self._load_locks = {name: threading.Lock() for name in self._factories}
+        self._pinned = set()
+        self._warming = False
+        self._stop = threading.Event()
+        self.ready = False
+        # Warm-up model name -> error; ready stays False while any is set
+        self.warm_up_errors: Dict[str, str] = {}
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is None:
+            with self._load_locks[name]:
+                model = self._models.get(name)
+                if model is None:
+                    started = time.time()
+                    model = self._factories[name]()
+                    self._models[name] = model
+                    print(f"Model '{name}' loaded in {time.time() - started:.1f}s")
+        self._last_used[name] = time.monotonic()
+        return model
+
+    def proxy(self, name: str) -> ModelProxy:
+        return ModelProxy(self, name)
+
+    def warm_up(self, names: List[str]):
+        """Load and exercise names in a background thread. Sets ready only if
+        every model loaded and warmed; failures are kept in warm_up_errors."""
+        self._pinned.update(names)
+        self._warming = True
+
+        def run():
+            errors = {}
+            for name in names:
+                try:
+                    model = self.get(name)
+                    if name in self._warmers:
+                        self._warmers[name](model)
+                except Exception as e:
+                    print(f"Model warm-up failed for '{name}': {e}")
+                    errors[name] = f"{type(e).__name__}: {e}"
+            self.warm_up_errors = errors
+            self._warming = False
+            self.ready = not errors
+            if errors:
+                print(f"Model warm-up finished with failures: {sorted(errors)}; worker stays not ready")
+            else:
+                print("Model warm-up complete")
+
+        threading.Thread(target=run, name='model-warm-up', daemon=True).start()
+        if self.idle_unload_seconds > 0:
+            threading.Thread(target=self._unload_loop, name='model-idle-unload', daemon=True).start()
+
+    def unload(self, name: str):
+        with self._load_locks[name]:
+            if self._models.pop(name, None) is None:
+                return
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        print(f"Model '{name}' unloaded")
+
+    def _unload_loop(self):
+        while not self._stop.wait(min(60, self.idle_unload_seconds)):
+            now = time.monotonic()
+            for name in list(self._models):
+                if name in self._pinned:
+                    continue
+                if now - self._last_used.get(name, now) >= self.idle_unload_seconds:
+                    self.unload(name)
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'warming': self._warming,
+            'loaded': sorted(self._models),
+            'failed': dict(self.warm_up_errors),
+        }
+
+
+model_registry = ModelRegistry(Config.MODEL_IDLE_UNLOAD_SECONDS)
@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import numpy as np
+from typing import List
+from config import Config
+
+ONNX_MODEL_FILE = 'model_quantized.onnx'
+# Max absolute score difference the int8 export may show against PyTorch
+PARITY_TOLERANCE = 0.05
+
+# Question/passage pairs for the parity check: Thai and English, short table
+# rows and long paragraphs, relevant and irrelevant
+PARITY_PAIRS = [
+    ["ระยะเวลาของสัญญาคือเท่าไร", "สัญญานี้มีผลใช้บังคับเป็นระยะเวลา 3 ปี นับตั้งแต่วันที่ลงนามในสัญญา"],
+    ["ระยะเวลาของสัญญาคือเท่าไร", "[ตาราง] ลำดับ | รายการ | จำนวนเงิน (บาท) 1 | ค่าบำรุงรักษา | 120,000"],
+    ["ค่าปรับกรณีส่งมอบล่าช้า", "หากผู้รับจ้างส่งมอบงานล่าช้ากว่ากำหนด ผู้รับจ้างต้องชำระค่าปรับเป็นรายวัน "
+     "ในอัตราร้อยละ 0.1 ของค่าจ้างทั้งหมด จนกว่าจะส่งมอบงานครบถ้วน ทั้งนี้ ผู้ว่าจ้างมีสิทธิบอกเลิกสัญญา "
+     "เมื่อค่าปรับรวมเกินร้อยละ 10 ของค่าจ้าง"],
+    ["ค่าปรับกรณีส่งมอบล่าช้า", "[หน้า 1] บันทึกข้อตกลงความร่วมมือทางวิชาการระหว่างมหาวิทยาลัยและบริษัท"],
+    ["What is the termination notice period?", "Either party may terminate this agreement by giving thirty (30) "
+     "days written notice to the other party."],
+    ["What is the termination notice period?", "Payment shall be made within 45 days of receipt of a valid invoice."],
+    ["who signs on behalf of the company", "[หมวด: ผู้ลงนาม] ลงชื่อ ................ ผู้มีอำนาจลงนาม (นายสมชาย ใจดี) "
+     "กรรมการผู้จัดการ"],
+    ["ขอบเขตของงาน", "ขอบเขตของงานประกอบด้วย การออกแบบระบบ การพัฒนาซอฟต์แวร์ การทดสอบ การติดตั้ง "
+     "และการฝึกอบรมผู้ใช้งาน รวมถึงการบำรุงรักษาระบบเป็นระยะเวลา 1 ปี หลังการส่งมอบ " * 4],
+]
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+
+class OnnxCrossEncoder:
+    """CrossEncoder.predict-compatible scorer running an int8 ONNX export.
+
+    Expects a directory written by `python onnx_reranker.py export`: the
+    quantized graph plus the tokenizer. Single-logit models get the same
+    sigmoid CrossEncoder applies, so scores are interchangeable with the
+    PyTorch backend. Batches run in the order given; Reranker._predict sorts
+    pairs by token length first so each batch pads to a similar length.
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 512, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = os.path.join(model_dir, ONNX_MODEL_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run `python onnx_reranker.py export` first")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+    def predict(self, pairs: List[List[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+                show_progress_bar: bool = False) -> np.ndarray:
+        scores = []
+        for i in range(0, len(pairs), batch_size):
+            batch = pairs[i:i + batch_size]
+            encoded = self.tokenizer(
+                [p[0] for p in batch], [p[1] for p in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors='np'
+            )
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            logits = self.session.run(None, feed)[0]
+            scores.append(_sigmoid(logits[:, 0]) if logits.shape[1] == 1 else logits)
+        return np.concatenate(scores) if scores else np.array([], dtype=np.float32)
+
+
+def export(model_name: str, out_dir: str, arch: str = 'avx2'):
+    """Export model_name to ONNX and quantize its weights to int8 (dynamic quantization)."""
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    except ImportError:
+        print("Export needs optimum: pip install 'optimum[onnxruntime]'")
+        sys.exit(1)
+    from transformers import AutoTokenizer
+
+    started = time.time()
+    fp32_dir = os.path.join(out_dir, 'fp32')
+    model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+    model.save_pretrained(fp32_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(out_dir)
+
+    configs = {
+        'avx2': AutoQuantizationConfig.avx2,
+        'avx512': AutoQuantizationConfig.avx512,
+        'avx512_vnni': AutoQuantizationConfig.avx512_vnni,
+        'arm64': AutoQuantizationConfig.arm64,
+    }
+    quantizer = ORTQuantizer.from_pretrained(fp32_dir)
+    quantizer.quantize(save_dir=out_dir, quantization_config=configs[arch](is_static=False, per_channel=True))
+    print(f"Wrote {os.path.join(out_dir, ONNX_MODEL_FILE)} in {time.time() - started:.0f}s")
+
+
+def parity_scores(model_name: str, model_dir: str):
+    """PARITY_PAIRS scored by the PyTorch CrossEncoder and by the ONNX export,
+    with the time each took (ms)."""
+    from sentence_transformers import CrossEncoder
+
+    reference = CrossEncoder(model_name, max_length=512, device='cpu', trust_remote_code=True)
+    quantized = OnnxCrossEncoder(model_dir)
+
+    started = time.perf_counter()
+    expected = np.asarray(reference.predict(PARITY_PAIRS, convert_to_numpy=True, show_progress_bar=False))
+    torch_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    got = quantized.predict(PARITY_PAIRS)
+    onnx_ms = (time.perf_counter() - started) * 1000
+    return expected, got, torch_ms, onnx_ms
+
+
+def same_ranking(expected: np.ndarray, got: np.ndarray) -> bool:
+    """True if both score arrays order every query's passages the same way."""
+    queries = {}
+    for i, pair in enumerate(PARITY_PAIRS):
+        queries.setdefault(pair[0], []).append(i)
+    return all(
+        sorted(rows, key=lambda i: -expected[i]) == sorted(rows, key=lambda i: -got[i])
+        for rows in queries.values()
+    )
+
+
+def parity(model_name: str, model_dir: str, tolerance: float) -> bool:
+    """Score PARITY_PAIRS with both backends; True if every score is within tolerance
+    and both rank every query's passages the same way."""
+    expected, got, torch_ms, onnx_ms = parity_scores(model_name, model_dir)
+
+    diff = np.abs(expected - got)
+    for pair, e, g in zip(PARITY_PAIRS, expected, got):
+        print(f"  torch {e:.4f}  onnx {g:.4f}  diff {abs(e - g):.4f} | {pair[0][:30]} / {pair[1][:40]}")
+
+    same_order = same_ranking(expected, got)
+    print(f"max diff {diff.max():.4f}, mean diff {diff.mean():.4f}, same ranking: {same_order}")
+    print(f"torch {torch_ms:.0f} ms, onnx int8 {onnx_ms:.0f} ms for {len(PARITY_PAIRS)} pairs")
+    return bool(diff.max() <= tolerance) and same_order
+
+
+if __name__ == '__main__':
+    # python onnx_reranker.py export [avx2|avx512|avx512_vnni|arm64]
+    # python onnx_reranker.py parity [tolerance]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'parity'
+    if command == 'export':
+        export(Config.RERANK_MODEL, Config.RERANK_ONNX_DIR, sys.argv[2] if len(sys.argv) > 2 else 'avx2')
+    elif command == 'parity':
+        tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else PARITY_TOLERANCE
+        sys.exit(0 if parity(Config.RERANK_MODEL, Config.RERANK_ONNX_DIR, tolerance) else 1)
+    else:
+        print("Usage: python onnx_reranker.py export [arch] | parity [tolerance]")
+        sys.exit(2)
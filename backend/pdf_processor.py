@@ -9,30 +9,22 @@ import json
 import base64
 from collections import Counter
 import numpy as np
-import easyocr
+from model_registry import model_registry
 
 class PDFProcessor:
     def __init__(self):
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'googlecloudvisionservice.json'
         self.vision_client = vision.ImageAnnotatorClient()
-        self.easyocr_reader = None
         self.chunk_size = 1500
         self.chunk_overlap = 300
         self.min_chunk_size = 100
         self.use_ocr_for_images = True
         self.use_ocr_for_failed_text = True
         
-    def _init_easyocr(self):
-        if self.easyocr_reader is None:
-            print("Initializing EasyOCR (Thai + English)...")
-            try:
-                import torch
-                gpu_available = torch.cuda.is_available()
-            except ImportError:
-                gpu_available = False
-            
-            self.easyocr_reader = easyocr.Reader(['th', 'en'], gpu=gpu_available, verbose=False)
-            print(f"EasyOCR initialized successfully (GPU: {gpu_available})")
+    @property
+    def easyocr_reader(self):
+        # Shared reader from the model registry; loaded on first OCR use
+        return model_registry.get('ocr')
         
     def extract_pdf_content(self, pdf_path: str, use_cloud_ocr: bool = True) -> Dict:
         document_data = {
@@ -211,8 +203,6 @@ class PDFProcessor:
     
     def _ocr_full_page_local(self, page) -> str:
         try:
-            self._init_easyocr()
-            
             # เพิ่ม resolution เป็น 300 dpi สำหรับภาษาไทย
             img = page.to_image(resolution=300)
             img_buffer = io.BytesIO()
@@ -312,8 +302,6 @@ class PDFProcessor:
     
     def _process_image_local(self, page, img_obj, img_idx: int) -> Optional[Dict]:
         try:
-            self._init_easyocr()
-            
             if isinstance(img_obj, dict) and 'x0' in img_obj and 'top' in img_obj:
                 bbox = (img_obj['x0'], img_obj['top'], img_obj['x1'], img_obj['bottom'])
             elif isinstance(img_obj, dict) and 'bbox' in img_obj:
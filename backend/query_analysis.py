@@ -0,0 +1,211 @@
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Every keyword list the retrieval modules test a question against, by group.
+# A keyword may sit in several groups; all are matched in one pass.
+KEYWORD_GROUPS: Dict[str, List[str]] = {
+    'page': ['หน้า', 'page'],
+    # HybridRetriever: anything that may need the SQL branch
+    'sql': [
+        'มากกว่า', 'น้อยกว่า', 'ระหว่าง', 'เท่ากับ', 'เกิน', 'ไม่เกิน', 'ต่ำกว่า', 'สูงกว่า',
+        'จำนวนหน้า', 'กี่หน้า', 'อัพโหลดเมื่อ', 'วันที่', 'เดือน', 'ปี',
+        'ประเภท', 'ทั้งหมด', 'นับ', 'เฉลี่ย', 'รวม', 'กี่ไฟล์', 'กี่เอกสาร', 'กี่บท', 'กี่ตาราง',
+        'เนื้อหาหน้า', 'ขอเนื้อหา', 'ข้อมูลหน้า',
+        'ตั้งแต่หน้า', 'ถึงหน้า', 'จากหน้า', 'ไปหน้า',
+        'ตั้งแต่', 'ถึง', 'จาก', 'ไป',
+        'more than', 'less than', 'between', 'equal', 'exceed', 'over', 'under',
+        'pages', 'uploaded', 'date', 'month', 'year',
+        'type', 'all', 'count', 'average', 'total', 'how many',
+        'content of page', 'page content',
+        'from page', 'to page', 'page range',
+        '>', '<', '>=', '<=', '=',
+        'ไฟล์ไหน', 'เอกสารไหน', 'วิทยานิพนธ์ไหน', 'which document', 'which file'
+    ],
+    'which_document': [
+        'ไฟล์ไหน', 'เอกสารไหน', 'วิทยานิพนธ์ไหน', 'เอกสารใด', 'ไฟล์ใด', 'สัญญาไหน', 'สัญญาฉบับไหน', 'ฉบับไหน',
+        'which document', 'which file', 'which contract'
+    ],
+    # Numeric and date filters keep a document lookup on the SQL path
+    'lookup_filter': ['หน้า', 'page', 'วันที่', 'date', 'อัพโหลด', 'upload'],
+    # Query intent: metadata, content and overview signals
+    'page_count': ['จำนวนหน้า', 'กี่หน้า', 'pages count', 'how many pages', 'เกิน', 'มากกว่า', 'น้อยกว่า', 'ไม่เกิน'],
+    'date': ['วันที่', 'เมื่อไหร่', 'date', 'when', 'อัพโหลด'],
+    'title': ['ชื่อ', 'title', 'เรื่อง', 'ชื่อเรื่อง'],
+    'list': ['ทั้งหมด', 'all', 'list', 'แสดงรายการ', 'ไหนบ้าง', 'อะไรบ้าง'],
+    'document_query': ['ไฟล์ไหน', 'เอกสารไหน', 'วิทยานิพนธ์ไหน', 'which document', 'which file'],
+    'summary': ['สรุป', 'summary', 'ย่อ', 'บทคัดย่อ'],
+    'detail': ['รายละเอียด', 'detail', 'อธิบาย', 'explain'],
+    'specific': ['บทที่', 'chapter', 'หัวข้อ', 'section', 'ตอนที่'],
+    'research': ['ผลการวิจัย', 'วิธีการ', 'results', 'methodology'],
+    'page_content': ['เนื้อหาหน้า', 'ขอเนื้อหา', 'content of page', 'ข้อมูลหน้า'],
+    'overview': ['สรุป', 'ภาพรวม', 'overview', 'summary', 'เกี่ยวกับอะไร', 'คืออะไร', 'พูดถึงอะไร', 'เนื้อหาหลัก'],
+    'this_document': ['เอกสารนี้', 'this document'],
+    # DocumentRetriever: candidate count and neighbour expansion
+    'comprehensive': [
+        'สรุป', 'อธิบาย', 'เปรียบเทียบ', 'วิเคราะห์', 'ทั้งหมด', 'รายละเอียด', 'summary', 'explain',
+        'compare', 'analyze', 'detail', 'ขั้นตอน', 'วิธีการ', 'comprehensive', 'ภาพรวม', 'overview'
+    ],
+    'specific_answer': [
+        'คืออะไร', 'หมายถึง', 'definition', 'what is', 'กี่', 'เท่าไหร่', 'how many', 'how much',
+        'ใช่หรือไม่', 'จริงหรือไม่', 'yes or no'
+    ],
+    'visual': ['ตาราง', 'table', 'รูป', 'figure', 'กราฟ', 'chart'],
+    'extended_context': [
+        'บทที่', 'chapter', 'section', 'ทั้งบท', 'ผลการวิจัย', 'results', 'methodology',
+        'สรุปผล', 'conclusion', 'discussion', 'ขั้นตอน', 'process', 'procedure'
+    ],
+    # Reranker: spread results over pages and sections
+    'diversity': ['ทั้งหมด', 'สรุป', 'เปรียบเทียบ', 'วิเคราะห์', 'ภาพรวม', 'all', 'summary', 'compare', 'analyze', 'overview'],
+    # sql_plans.compile_plan
+    'page_count_question': ['จำนวนหน้า', 'กี่หน้า', 'how many pages', 'page count'],
+    'table': ['ตาราง', 'table'],
+    'listing': [
+        'กี่ไฟล์', 'กี่เอกสาร', 'กี่ฉบับ', 'จำนวนเอกสาร', 'จำนวนไฟล์', 'เอกสารทั้งหมด', 'ไฟล์ทั้งหมด',
+        'เอกสารอะไรบ้าง', 'ไฟล์อะไรบ้าง', 'how many documents', 'how many files', 'list documents',
+        'list files', 'all documents', 'all files'
+    ],
+    'conjunction': ['และ', 'กับ', ',', 'and'],
+    'comparison': [
+        'ไม่เกิน', 'ไม่มากกว่า', 'at most', 'no more than', 'อย่างน้อย', 'ไม่น้อยกว่า', 'at least',
+        'น้อยกว่า', 'ต่ำกว่า', 'less than', 'fewer than', 'under', 'มากกว่า', 'เกิน', 'more than', 'over',
+        'เท่ากับ', 'equal', 'exactly'
+    ],
+    'upload': ['อัพโหลด', 'อัปโหลด', 'นำเข้า', 'เพิ่มเข้า', 'upload', 'added'],
+    'latest': ['ล่าสุด', 'latest', 'most recent', 'newest'],
+    'classification': [
+        'ระดับ', 'ชั้น', 'เอกสารลับ', 'classified', 'classification', 'level',
+        'secret', 'confidential', 'internal', 'public'
+    ],
+    'today': ['วันนี้', 'today'],
+    'yesterday': ['เมื่อวาน', 'yesterday'],
+    'this_week': ['สัปดาห์นี้', 'อาทิตย์นี้', 'this week'],
+    'this_month': ['เดือนนี้', 'this month'],
+    'this_year': ['ปีนี้', 'this year'],
+}
+
+WHITESPACE = re.compile(r'\s+')
+NUMBER = re.compile(r'\d+')
+PAGE_REF = re.compile(r'(?:หน้า|page)\s*(\d+)')
+# หน้า 5-10, page 5 to 10, ตั้งแต่หน้า 5 ถึงหน้า 10, จากหน้า 5 ไปถึงหน้า 10
+PAGE_RANGE = re.compile(r'(?:หน้า|page)\s*(\d+)\s*(?:-|–|ถึง(?:หน้า)?|ไปถึงหน้า|to(?:\s*page)?)\s*(\d+)')
+
+
+class KeywordAutomaton:
+    """Aho-Corasick matcher: one pass over the text finds every keyword
+    occurrence, overlapping ones included ('ไม่เกิน' also yields 'เกิน').
+
+    Failure links are folded into each state's transition dict, so matching
+    is a single dict lookup per character.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[Set[str]] = [set()]
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    outputs.append(set())
+                    goto[state][ch] = nxt
+                state = nxt
+            outputs[state].add(keyword)
+
+        fail = [0] * len(goto)
+        delta: List[Optional[Dict[str, int]]] = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] |= outputs[fail[state]]
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+        self._delta = delta
+        self._outputs = [tuple(o) for o in outputs]
+
+    def find(self, text: str) -> Set[str]:
+        delta, outputs = self._delta, self._outputs
+        state = 0
+        found = set()
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+
+def _keyword_index(groups: Dict[str, List[str]]) -> Dict[str, Tuple[str, ...]]:
+    index: Dict[str, List[str]] = {}
+    for group, words in groups.items():
+        for word in words:
+            index.setdefault(word, []).append(group)
+    return {word: tuple(names) for word, names in index.items()}
+
+
+KEYWORD_INDEX = _keyword_index(KEYWORD_GROUPS)
+KEYWORD_AUTOMATON = KeywordAutomaton(KEYWORD_INDEX)
+
+
+class QueryAnalysis:
+    """What a question asks for, computed once and shared by the retrieval
+    modules instead of each re-scanning the text with its own keyword lists."""
+
+    def __init__(self, query: str):
+        self.query = query
+        self.text = WHITESPACE.sub(' ', query.lower()).strip()
+        self.keywords = KEYWORD_AUTOMATON.find(self.text)
+        self.groups: Dict[str, int] = {}
+        for keyword in self.keywords:
+            for group in KEYWORD_INDEX[keyword]:
+                self.groups[group] = self.groups.get(group, 0) + 1
+
+        self.numbers = NUMBER.findall(self.text) if any(c.isdigit() for c in self.text) else []
+        self.page_ref: Optional[int] = None
+        self.page_range: Optional[Tuple[int, int]] = None
+        self.page_numbers: List[int] = []
+        if self.numbers and 'page' in self.groups:
+            ref = PAGE_REF.search(self.text)
+            self.page_ref = int(ref.group(1)) if ref else None
+            page_range = PAGE_RANGE.search(self.text)
+            if page_range:
+                self.page_range = (int(page_range.group(1)), int(page_range.group(2)))
+            elif len(self.numbers) >= 2 and 'conjunction' in self.groups:
+                self.page_numbers = [int(n) for n in self.numbers]
+            elif self.page_ref is not None:
+                self.page_numbers = [self.page_ref]
+
+    @property
+    def is_page_range_query(self) -> bool:
+        return self.page_range is not None
+
+    @property
+    def is_multiple_pages_query(self) -> bool:
+        return len(self.page_numbers) > 1
+
+    @property
+    def is_page_query(self) -> bool:
+        return len(self.page_numbers) == 1
+
+    def has(self, *groups: str) -> bool:
+        """True if any keyword of any of the groups occurs in the question."""
+        return any(group in self.groups for group in groups)
+
+    def count(self, group: str) -> int:
+        """Distinct keywords of group found in the question."""
+        return self.groups.get(group, 0)
+
+    def __repr__(self) -> str:
+        return f"QueryAnalysis(groups={sorted(self.groups)}, numbers={self.numbers}, page_ref={self.page_ref})"
+
+
+@lru_cache(maxsize=1024)
+def analyze_query(query: str) -> QueryAnalysis:
+    """Shared, memoised analysis: every module asking about the same question
+    within a request gets the same object. Treat it as read-only."""
+    return QueryAnalysis(query)
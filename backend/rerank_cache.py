@@ -0,0 +1,86 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from config import Config
+
+
+def normalize_query(query: str) -> str:
+    """Case/whitespace/trailing-punctuation insensitive form of a question."""
+    return re.sub(r'\s+', ' ', query.strip().lower()).rstrip(' ?？!.')
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=12).hexdigest()
+
+
+class RerankScoreCache:
+    """Bounded LRU of cross-encoder scores.
+
+    Keyed by reranker model version, normalised-query hash, chunk id and a
+    hash of the exact text the model saw, so a rephrased-identically follow-up
+    question skips inference for every chunk it has already scored. Entries
+    are dropped per document when the catalog reports it deleted or changed.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._scores: OrderedDict = OrderedDict()
+        self._keys_by_doc: Dict[int, Set[Tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model_version: str, query: str, chunk: Dict, context: str) -> Optional[Tuple]:
+        chunk_id = chunk.get('chunk_id')
+        if not chunk_id or self.max_entries <= 0:
+            return None
+        return (model_version, _digest(normalize_query(query)), chunk_id, _digest(context))
+
+    def get(self, key: Tuple) -> Optional[float]:
+        with self._lock:
+            entry = self._scores.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._scores.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple, doc_id: Optional[int], score: float):
+        with self._lock:
+            self._scores[key] = (score, doc_id)
+            self._scores.move_to_end(key)
+            if doc_id is not None:
+                self._keys_by_doc.setdefault(doc_id, set()).add(key)
+            while len(self._scores) > self.max_entries:
+                old_key, (_, old_doc) = self._scores.popitem(last=False)
+                if old_doc in self._keys_by_doc:
+                    self._keys_by_doc[old_doc].discard(old_key)
+
+    def invalidate_documents(self, doc_ids: set):
+        """Catalog listener: forget scores for deleted or re-indexed documents."""
+        with self._lock:
+            for doc_id in doc_ids:
+                for key in self._keys_by_doc.pop(doc_id, ()):
+                    self._scores.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self._keys_by_doc.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._scores),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+rerank_score_cache = RerankScoreCache(Config.RERANK_CACHE_SIZE)
@@ -3,9 +3,14 @@ import torch
 from typing import List, Dict, Tuple
 import numpy as np
 import os
+import time
+from config import Config
+from rerank_cache import rerank_score_cache
+from query_analysis import analyze_query
+from candidates import descending_order, occurrence_rank
 
 class Reranker:
-    def __init__(self, model_name: str = "BAAI/bge-reranker-v2-m3"):
+    def __init__(self, model_name: str = Config.RERANK_MODEL, backend: str = Config.RERANK_BACKEND):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         
         if self.device == 'cuda':
@@ -18,8 +23,33 @@ class Reranker:
         else:
             print("⚠ No GPU detected, using CPU")
         
-        print(f"Loading reranker model: {model_name}")
+        print(f"Loading reranker model: {model_name} ({backend})")
+        # Part of every score-cache key, so a model swap never reuses old scores
+        self.model_version = model_name
+        self.score_cache = rerank_score_cache
+        self.backend = 'torch'
+        self.model = None
         
+        if backend == 'onnx':
+            try:
+                from onnx_reranker import OnnxCrossEncoder
+                self.model = OnnxCrossEncoder(Config.RERANK_ONNX_DIR, threads=Config.RERANK_ONNX_THREADS)
+                self.model_version = f"{model_name}:onnx-int8"
+                self.backend = 'onnx'
+            except Exception as e:
+                print(f"Failed to load ONNX reranker, using PyTorch: {e}")
+        
+        if self.model is None:
+            self._load_torch_model(model_name)
+        
+        self.first_stage_model = None
+        self.cascade_min_keep = Config.RERANK_CASCADE_MIN_KEEP
+        self.cascade_max_keep = Config.RERANK_CASCADE_MAX_KEEP
+        self.cascade_margin = Config.RERANK_CASCADE_MARGIN
+        if Config.RERANK_CASCADE:
+            self.load_first_stage(Config.RERANK_FIRST_STAGE_MODEL)
+    
+    def _load_torch_model(self, model_name: str):
         try:
             self.model = CrossEncoder(
                 model_name, 
@@ -38,76 +68,177 @@ class Reranker:
                 'cross-encoder/ms-marco-MiniLM-L-6-v2', 
                 device=self.device
             )
+            self.model_version = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+    
+    def load_first_stage(self, model_name: str):
+        """Enable cascade reranking with model_name as the cheap first stage."""
+        try:
+            print(f"Loading first-stage reranker model: {model_name}")
+            self.first_stage_model = CrossEncoder(model_name, max_length=256, device=self.device)
+        except Exception as e:
+            print(f"Failed to load first-stage reranker, cascade disabled: {e}")
+            self.first_stage_model = None
+    
+    def _token_lengths(self, model, pairs: List[List[str]]) -> List[int]:
+        try:
+            encoded = model.tokenizer(
+                [p[0] for p in pairs], [p[1] for p in pairs],
+                truncation=True, max_length=512
+            )
+            return [len(ids) for ids in encoded['input_ids']]
+        except Exception:
+            return [len(p[0]) + len(p[1]) for p in pairs]
+    
+    def _predict(self, model, pairs: List[List[str]]) -> List[float]:
+        """Score pairs in batches of similar token length.
+        
+        Batches pad to their longest pair, so scoring in ranking order pads a
+        one-line table row to the length of a 512-token paragraph. Sorting by
+        token length first keeps padding small; scores come back in input order.
+        """
+        batch_size = 64 if self.device == 'cuda' else 32
+        order = sorted(range(len(pairs)), key=self._token_lengths(model, pairs).__getitem__)
+        all_scores = [0.0] * len(pairs)
+        
+        with torch.no_grad():
+            if self.device == 'cuda':
+                torch.cuda.synchronize()
+            
+            for i in range(0, len(order), batch_size):
+                batch_index = order[i:i + batch_size]
+                
+                batch_scores = model.predict(
+                    [pairs[j] for j in batch_index],
+                    convert_to_numpy=True,
+                    show_progress_bar=False
+                )
+                for j, score in zip(batch_index, batch_scores):
+                    all_scores[j] = score
+            
+            if self.device == 'cuda':
+                torch.cuda.synchronize()
+        
+        return all_scores
+    
+    def _cascade_survivors(self, pairs: List[List[str]], floor: int,
+                           rerank_stats: Dict = None) -> List[int]:
+        """Indexes into pairs worth scoring with the large model.
+        
+        The first-stage model scores every pair; pairs within cascade_margin of
+        the best first-stage score survive, so a query whose top results clearly
+        separate sends only a few pairs to the large model. The survivor count is
+        kept between floor and cascade_max_keep.
+        """
+        started = time.perf_counter()
+        stage1_scores = self._predict(self.first_stage_model, pairs)
+        order = sorted(range(len(pairs)), key=lambda j: stage1_scores[j], reverse=True)
+        best = stage1_scores[order[0]]
+        within_margin = sum(1 for score in stage1_scores if score >= best - self.cascade_margin)
+        keep = min(max(within_margin, floor), max(self.cascade_max_keep, floor))
+        
+        if rerank_stats is not None:
+            rerank_stats['stage1_pairs'] = rerank_stats.get('stage1_pairs', 0) + len(pairs)
+            rerank_stats['pairs_pruned'] = rerank_stats.get('pairs_pruned', 0) + len(pairs) - keep
+            rerank_stats['stage1_ms'] = rerank_stats.get('stage1_ms', 0.0) + (time.perf_counter() - started) * 1000
+        
+        return sorted(order[:keep])
     
     def rerank(self, query: str, chunks: List[Dict], top_k: int = None,
-         query_intent: Dict = None) -> List[Dict]:
-        """Rerank with query intent awareness"""
+         query_intent: Dict = None, rerank_stats: Dict = None) -> List[Dict]:
+        """Rerank with query intent awareness.
+
+        Chunks already scored for this query (rerank_query == query) keep their
+        rerank_score, so each (query, chunk) pair goes through the model at most
+        once per request; pairs scored by earlier requests come from the score
+        cache. With a first-stage model loaded, the remaining pairs are trimmed
+        by _cascade_survivors and the pruned chunks are dropped; at least top_k
+        chunks always survive. rerank_stats, if given, accumulates pairs_scored,
+        pairs_reused, pairs_cached and stage2_ms, plus stage1_pairs,
+        pairs_pruned and stage1_ms when cascading.
+
+        The chunks are updated in place, not copied: every surviving chunk gets
+        rerank_score, rerank_query and final_score, and the returned list holds
+        the same dicts. Callers that rerank one candidate list more than once
+        as independent runs must pass copies.
+        """
         
         if not chunks:
             return []
         
+        scores = [chunk.get('rerank_score') for chunk in chunks]
+        to_score = []
         pairs = []
-        for chunk in chunks:
+        cache_keys = []
+        cache_hits = 0
+        for i, chunk in enumerate(chunks):
+            if chunk.get('rerank_query') == query:
+                continue
             chunk_context = self._prepare_chunk_context(chunk)
+            key = self.score_cache.key(self.model_version, query, chunk, chunk_context)
+            cached = self.score_cache.get(key) if key else None
+            if cached is not None:
+                scores[i] = cached
+                cache_hits += 1
+                continue
+            to_score.append(i)
             pairs.append([query, chunk_context])
+            cache_keys.append(key)
+        
+        pruned = set()
+        floor = max(self.cascade_min_keep, top_k or 0) - (len(chunks) - len(pairs))
+        if self.first_stage_model is not None and len(pairs) > max(floor, 0):
+            try:
+                survivors = self._cascade_survivors(pairs, max(floor, 0), rerank_stats)
+                pruned = set(to_score) - {to_score[j] for j in survivors}
+                to_score = [to_score[j] for j in survivors]
+                pairs = [pairs[j] for j in survivors]
+                cache_keys = [cache_keys[j] for j in survivors]
+            except Exception as e:
+                print(f"First-stage reranking error, scoring all candidates: {e}")
         
         try:
-            batch_size = 64 if self.device == 'cuda' else 32
-            all_scores = []
-            
-            with torch.no_grad():
-                if self.device == 'cuda':
-                    torch.cuda.synchronize()
-                
-                for i in range(0, len(pairs), batch_size):
-                    batch_pairs = pairs[i:i + batch_size]
-                    
-                    batch_scores = self.model.predict(
-                        batch_pairs, 
-                        convert_to_numpy=True,
-                        show_progress_bar=False
-                    )
-                    all_scores.extend(batch_scores)
-                
-                if self.device == 'cuda':
-                    torch.cuda.synchronize()
+            started = time.perf_counter()
+            all_scores = self._predict(self.model, pairs)
             
-            scores = np.array(all_scores)
+            for i, key, score in zip(to_score, cache_keys, all_scores):
+                scores[i] = score
+                if key:
+                    self.score_cache.put(key, chunks[i].get('doc_id'), float(score))
             
         except Exception as e:
             print(f"Reranking error: {e}")
             return chunks
         
-        reranked_chunks = []
-        for chunk, score in zip(chunks, scores):
-            reranked_chunk = chunk.copy()
-            reranked_chunk['rerank_score'] = float(score)
-            
-            if 'score' in chunk:
-                reranked_chunk['final_score'] = 0.7 * float(score) + 0.3 * chunk['score']
-            else:
-                reranked_chunk['final_score'] = float(score)
-            
-            reranked_chunks.append(reranked_chunk)
+        if rerank_stats is not None:
+            rerank_stats['pairs_scored'] = rerank_stats.get('pairs_scored', 0) + len(pairs)
+            rerank_stats['pairs_reused'] = rerank_stats.get('pairs_reused', 0) + len(chunks) - len(pairs) - len(pruned) - cache_hits
+            rerank_stats['pairs_cached'] = rerank_stats.get('pairs_cached', 0) + cache_hits
+            rerank_stats['stage2_ms'] = rerank_stats.get('stage2_ms', 0.0) + (time.perf_counter() - started) * 1000
+        
+        # Scores are set on the caller's chunk dicts (see the docstring)
+        kept = [i for i in range(len(chunks)) if i not in pruned]
+        reranked_chunks = [chunks[i] for i in kept]
+        rerank_scores = np.array([scores[i] for i in kept], dtype=np.float64)
+        first_scores = np.array([c.get('score', np.nan) for c in reranked_chunks], dtype=np.float64)
+        final_scores = np.where(np.isnan(first_scores), rerank_scores, 0.7 * rerank_scores + 0.3 * first_scores)
         
         # Apply intent-based boosting
         if query_intent:
-            for chunk in reranked_chunks:
-                # Boost SQL results for metadata queries
-                if query_intent['primary_focus'] == 'metadata' and 'sql' in chunk.get('sources', []):
-                    chunk['final_score'] *= 1.2
-                # Boost vector results for content queries
-                elif query_intent['primary_focus'] == 'content' and 'vector' in chunk.get('sources', []):
-                    chunk['final_score'] *= 1.1
-                # Boost chunks from both sources for hybrid queries
-                elif query_intent['primary_focus'] == 'hybrid' and len(chunk.get('sources', [])) > 1:
-                    chunk['final_score'] *= 1.15
-        
-        # Sort by final score
-        reranked_chunks.sort(key=lambda x: x['final_score'], reverse=True)
+            final_scores *= self._intent_boost(reranked_chunks, query_intent['primary_focus'])
         
         # Apply diversity
-        reranked_chunks = self._apply_diversity(reranked_chunks, query)
+        if self._needs_diversity(query):
+            final_scores = self._apply_diversity(reranked_chunks, final_scores)
+        
+        # Sort by final score
+        order = descending_order(final_scores)
+        rerank_values = rerank_scores.tolist()
+        final_values = final_scores.tolist()
+        for i, chunk in enumerate(reranked_chunks):
+            chunk['rerank_score'] = rerank_values[i]
+            chunk['rerank_query'] = query
+            chunk['final_score'] = final_values[i]
+        reranked_chunks = [reranked_chunks[i] for i in order]
         
         if self.device == 'cuda' and len(chunks) > 100:
             torch.cuda.empty_cache()
@@ -136,44 +267,36 @@ class Reranker:
         
         return ' '.join(parts)
     
-    def _apply_diversity(self, chunks: List[Dict], query: str) -> List[Dict]:
-        if not self._needs_diversity(query):
-            return chunks
-        
-        diverse_chunks = []
-        seen_pages = {}
-        seen_sections = {}
-        
-        for chunk in chunks:
-            page = chunk.get('page', 0)
-            section = chunk.get('metadata', {}).get('section', 'unknown')
-            
-            if seen_pages.get(page, 0) >= 2:
-                chunk['final_score'] *= 0.85
-            
-            if seen_sections.get(section, 0) >= 3:
-                chunk['final_score'] *= 0.8
-            
-            diverse_chunks.append(chunk)
-            seen_pages[page] = seen_pages.get(page, 0) + 1
-            seen_sections[section] = seen_sections.get(section, 0) + 1
-        
-        diverse_chunks.sort(key=lambda x: x['final_score'], reverse=True)
-        
-        return diverse_chunks
+    def _intent_boost(self, chunks: List[Dict], primary_focus: str) -> np.ndarray:
+        sources = [chunk.get('sources', []) for chunk in chunks]
+        # Boost SQL results for metadata queries
+        if primary_focus == 'metadata':
+            return np.array([1.2 if 'sql' in s else 1.0 for s in sources])
+        # Boost vector results for content queries
+        if primary_focus == 'content':
+            return np.array([1.1 if 'vector' in s else 1.0 for s in sources])
+        # Boost chunks from both sources for hybrid queries
+        if primary_focus == 'hybrid':
+            return np.array([1.15 if len(s) > 1 else 1.0 for s in sources])
+        return np.ones(len(chunks))
+    
+    def _apply_diversity(self, chunks: List[Dict], final_scores: np.ndarray) -> np.ndarray:
+        """Damp a chunk that comes after two better ones from its page or three
+        from its section."""
+        order = descending_order(final_scores)
+        pages = occurrence_rank([chunks[i].get('page', 0) for i in order])
+        sections = occurrence_rank([chunks[i].get('metadata', {}).get('section', 'unknown') for i in order])
+        penalty = np.empty(len(chunks))
+        penalty[order] = np.where(pages >= 2, 0.85, 1.0) * np.where(sections >= 3, 0.8, 1.0)
+        return final_scores * penalty
     
     def _needs_diversity(self, query: str) -> bool:
-        diversity_keywords = [
-            'ทั้งหมด', 'สรุป', 'เปรียบเทียบ', 'วิเคราะห์', 'ภาพรวม',
-            'all', 'summary', 'compare', 'analyze', 'overview'
-        ]
-        
-        query_lower = query.lower()
-        return any(keyword in query_lower for keyword in diversity_keywords)
+        return analyze_query(query).has('diversity')
     
     def get_device_info(self) -> Dict:
         info = {
             'device': self.device,
+            'backend': self.backend,
             'device_name': 'CPU',
             'memory_gb': None
         }
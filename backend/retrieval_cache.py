@@ -0,0 +1,133 @@
+import copy
+import itertools
+import re
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from rerank_cache import normalize_query
+
+
+def retrieval_scope(doc_filename: Optional[str], allowed_levels: Optional[List[str]], top_k: int) -> Tuple:
+    """Entries are only ever shared within one scope, so a cached list never
+    reaches a user with a different clearance, document or result size."""
+    levels = tuple(sorted(allowed_levels)) if allowed_levels is not None else None
+    return (doc_filename, levels, top_k)
+
+
+def _numbers(query: str) -> Tuple[str, ...]:
+    # "หน้า 5" and "หน้า 6" embed almost identically but must not share results
+    return tuple(re.findall(r'\d+', query))
+
+
+class RetrievalCache:
+    """Bounded LRU of final HybridRetriever results, looked up semantically.
+
+    A query hits when an entry in the same scope has the same normalised text,
+    or a query embedding with cosine similarity >= min_similarity and the same
+    numbers. Entries expire after ttl_seconds and are dropped when the catalog
+    reports a change to any document they were drawn from or scoped to;
+    unscoped entries are dropped on any catalog change, since a new document
+    could now outrank their chunks.
+    """
+
+    def __init__(self, max_entries: int, min_similarity: float = 0.97, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._ids = itertools.count()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, scope: Tuple, query: str, embedding) -> Optional[List[Dict]]:
+        if not self.enabled:
+            return None
+        text = normalize_query(query)
+        numbers = _numbers(query)
+        vector = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for entry_id, entry in list(self._entries.items()):
+                if now - entry['created'] > self.ttl_seconds:
+                    del self._entries[entry_id]
+                    continue
+                if entry['scope'] != scope or entry['numbers'] != numbers:
+                    continue
+                if entry['text'] == text:
+                    return self._hit(entry_id, semantic=False)
+                candidates.append(entry_id)
+            if candidates:
+                similarities = np.stack([self._entries[i]['vector'] for i in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.min_similarity:
+                    return self._hit(candidates[best], semantic=True)
+            self.misses += 1
+            return None
+
+    def _hit(self, entry_id: int, semantic: bool) -> List[Dict]:
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        if semantic:
+            self.semantic_hits += 1
+        return copy.deepcopy(self._entries[entry_id]['chunks'])
+
+    def put(self, scope: Tuple, query: str, embedding, chunks: List[Dict], doc_ids: set):
+        if not self.enabled or not chunks:
+            return
+        entry = {
+            'scope': scope,
+            'text': normalize_query(query),
+            'numbers': _numbers(query),
+            'vector': self._unit(embedding),
+            'chunks': copy.deepcopy(chunks),
+            'doc_ids': {d for d in doc_ids if d is not None},
+            'created': time.monotonic(),
+        }
+        with self._lock:
+            self._entries[next(self._ids)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_documents(self, doc_ids: set):
+        """Catalog listener: drop entries that depend on changed documents."""
+        with self._lock:
+            for entry_id, entry in list(self._entries.items()):
+                if entry['scope'][0] is None or entry['doc_ids'] & doc_ids:
+                    del self._entries[entry_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+retrieval_cache = RetrievalCache(
+    Config.RETRIEVAL_CACHE_SIZE, Config.RETRIEVAL_CACHE_SIMILARITY, Config.RETRIEVAL_CACHE_TTL
+)
@@ -0,0 +1,40 @@
+import asyncio
+import copy
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls onto one in-flight execution.
+
+    The first caller for a key (the leader) starts the work as a task; callers
+    with the same key that arrive before it finishes await that task instead
+    of running their own. Every caller gets its own copy of the result, or the
+    same exception. The task is shielded, so a caller going away never cancels
+    the work the others are waiting on.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable]):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(work())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.followers += 1
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def stats(self) -> Dict:
+        calls = self.leaders + self.followers
+        return {
+            'in_flight': len(self._in_flight),
+            'executions': self.leaders,
+            'coalesced': self.followers,
+            'coalescing_ratio': round(self.followers / calls, 3) if calls else 0.0,
+        }
@@ -1,18 +1,17 @@
 from typing import Dict, List, Optional
 import re
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
 import json
-
-load_dotenv()
+import threading
+from llm_gateway import llm_gateway
+from sql_plans import bind_literals, compile_plan, sql_plan_cache
+from query_analysis import QueryAnalysis
 
 class SQLGenerator:
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv('DEEPSEEK_API_KEY'),
-            base_url="https://api.deepseek.com"
-        )
+        self.llm = llm_gateway
+        self.plan_cache = sql_plan_cache
+        self._stats_lock = threading.Lock()
+        self._sources = {'compiled': 0, 'cached': 0, 'llm': 0}
         
         # แก้ไข schema ให้ตรงกับเวอร์ชันใหม่
         self.schema = """
@@ -47,126 +46,21 @@ class SQLGenerator:
             'COMMIT', 'ROLLBACK', 'SAVEPOINT'
         ]
     
-    def generate_sql(self, query: str, doc_filename: Optional[str] = None) -> Dict:
-        query_lower = query.lower()
-        
-        # Single page patterns - แก้ไขให้ใช้ชื่อ column ใหม่
-        single_page_match = re.search(r'หน้า\s*(\d+)(?!\s*[-–ถึงและ])|page\s*(\d+)(?!\s*[-–to])', query_lower)
-        if single_page_match:
-            page_num = single_page_match.group(1) or single_page_match.group(2)
-            sql = f'''SELECT c.content, c.page_ref, c.category, d.file_name, d.name 
-                     FROM content_segments c 
-                     JOIN documents d ON c.document_id = d.id 
-                     WHERE c.page_ref = {page_num}'''
-            
-            if doc_filename:
-                sql += ' AND d.file_name = :filename'
-            
-            sql += ' ORDER BY c.sequence_num FETCH FIRST 50 ROWS ONLY'
-            
-            return {
-                'sql': sql,
-                'needs_embedding': False,
-                'embedding_terms': [],
-                'query_type': 'content',
-                'confidence': 0.95
-            }
-        
-        # Multiple pages - แก้ไขให้ใช้ชื่อ column ใหม่
-        multiple_pages = re.findall(r'\d+', query_lower)
-        if len(multiple_pages) >= 2 and any(word in query_lower for word in ['หน้า', 'page']) and any(word in query_lower for word in ['และ', 'กับ', ',', 'and']):
-            page_list = ','.join(multiple_pages)
-            sql = f'''SELECT c.content, c.page_ref, c.category, d.file_name, d.name 
-                     FROM content_segments c 
-                     JOIN documents d ON c.document_id = d.id 
-                     WHERE c.page_ref IN ({page_list})'''
-            
-            if doc_filename:
-                sql += ' AND d.file_name = :filename'
-            
-            sql += ' ORDER BY c.page_ref, c.sequence_num FETCH FIRST 50 ROWS ONLY'
-            
-            return {
-                'sql': sql,
-                'needs_embedding': False,
-                'embedding_terms': [],
-                'query_type': 'content',
-                'confidence': 0.95
-            }
-        
-        # Page range patterns - แก้ไขให้ใช้ชื่อ column ใหม่
-        page_match = re.search(r'หน้า\s*(\d+)\s*[-–ถึง]\s*(\d+)|page\s*(\d+)\s*[-–to]\s*(\d+)', query_lower)
-        if page_match:
-            start = page_match.group(1) or page_match.group(3)
-            end = page_match.group(2) or page_match.group(4)
-            sql = f'''SELECT c.content, c.page_ref, c.category, d.file_name, d.name 
-                     FROM content_segments c 
-                     JOIN documents d ON c.document_id = d.id 
-                     WHERE c.page_ref BETWEEN {start} AND {end}'''
-            
-            if doc_filename:
-                sql += ' AND d.file_name = :filename'
-            
-            sql += ' ORDER BY c.page_ref, c.sequence_num FETCH FIRST 50 ROWS ONLY'
-            
-            return {
-                'sql': sql,
-                'needs_embedding': False,
-                'embedding_terms': [],
-                'query_type': 'content',
-                'confidence': 0.95
-            }
-        
-        # Document count/pages queries - แก้ไขให้ใช้ชื่อ column ใหม่
-        if any(word in query_lower for word in ['จำนวนหน้า', 'กี่หน้า', 'how many pages']):
-            sql = 'SELECT d.name, d.file_name, d.page_count FROM documents d'
-            conditions = []
-            
-            numbers = re.findall(r'\d+', query_lower)
-            
-            if ('มากกว่า' in query_lower or 'เกิน' in query_lower or 'more than' in query_lower) and numbers:
-                conditions.append(f'd.page_count > {numbers[0]}')
-            elif ('น้อยกว่า' in query_lower or 'ไม่เกิน' in query_lower or 'ต่ำกว่า' in query_lower or 'less than' in query_lower) and numbers:
-                conditions.append(f'd.page_count < {numbers[0]}')
-            elif ('เท่ากับ' in query_lower or 'equal' in query_lower) and numbers:
-                conditions.append(f'd.page_count = {numbers[0]}')
-            
-            if doc_filename:
-                conditions.append('d.file_name = :filename')
-            
-            if conditions:
-                sql += ' WHERE ' + ' AND '.join(conditions)
-            
-            sql += ' ORDER BY d.page_count DESC FETCH FIRST 50 ROWS ONLY'
-            
-            return {
-                'sql': sql,
-                'needs_embedding': False,
-                'embedding_terms': [],
-                'query_type': 'metadata',
-                'confidence': 0.9
-            }
-        
-        # Table queries - แก้ไขให้ใช้ชื่อ column ใหม่
-        if any(word in query_lower for word in ['ตาราง', 'table', 'กี่ตาราง']):
-            sql = '''SELECT c.content, c.page_ref, d.file_name, d.name 
-                    FROM content_segments c 
-                    JOIN documents d ON c.document_id = d.id 
-                    WHERE c.category = 'table' '''
-            
-            if doc_filename:
-                sql += 'AND d.file_name = :filename '
-            
-            sql += 'ORDER BY c.page_ref FETCH FIRST 50 ROWS ONLY'
-            
-            return {
-                'sql': sql,
-                'needs_embedding': False,
-                'embedding_terms': [],
-                'query_type': 'content',
-                'confidence': 0.8
-            }
-        
+    async def generate_sql(self, query: str, doc_filename: Optional[str] = None,
+                           analysis: Optional[QueryAnalysis] = None) -> Dict:
+        plan = compile_plan(query, doc_filename, analysis=analysis)
+        if plan:
+            self._count('compiled')
+            return plan
+
+        plan_key, values = self.plan_cache.key(query, doc_filename)
+        cached = self.plan_cache.get(plan_key, values)
+        if cached:
+            self._count('cached')
+            return cached
+
+        self._count('llm')
+
         # Use LLM for complex queries
         prompt = f"""You are a SQL expert for Oracle Database with Vector support.
 
@@ -192,14 +86,7 @@ Return ONLY the JSON object, no markdown, no code blocks, no explanations."""
         ]
 
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                temperature=0.1,
-                max_tokens=500
-            )
-
-            result_text = response.choices[0].message.content.strip()
+            result_text = (await self.llm.chat('sql', messages, temperature=0.1, max_tokens=500)).strip()
 
             # Parse JSON response
             if '```json' in result_text:
@@ -228,6 +115,11 @@ Return ONLY the JSON object, no markdown, no code blocks, no explanations."""
             result.setdefault('query_type', 'hybrid')
             result.setdefault('confidence', 0.5)
 
+            plan = self.plan_cache.put(plan_key, values, result)
+            if plan:
+                return plan
+            # Not reusable, but still executed with binds rather than literals
+            result['sql'], result['params'] = bind_literals(sql)
             return result
 
         except json.JSONDecodeError as e:
@@ -254,6 +146,26 @@ Return ONLY the JSON object, no markdown, no code blocks, no explanations."""
                 'confidence': 0.0
             }
     
+    def forget_plan(self, sql_result: Dict):
+        """Drop a cached LLM plan that Oracle rejected."""
+        if sql_result.get('plan_key') is not None:
+            self.plan_cache.forget(sql_result['plan_key'])
+
+    def _count(self, source: str):
+        with self._stats_lock:
+            self._sources[source] += 1
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            sources = dict(self._sources)
+        total = sum(sources.values())
+        return dict(
+            sources,
+            questions=total,
+            llm_share=round(sources['llm'] / total, 3) if total else 0.0,
+            plan_cache=self.plan_cache.stats()
+        )
+    
     def _validate_sql(self, sql: str):
         sql_upper = sql.upper()
         
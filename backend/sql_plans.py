@@ -0,0 +1,440 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from database import json_id_list
+from query_analysis import QueryAnalysis, analyze_query
+
+SEGMENT_SELECT = """SELECT c.id, c.document_id, c.content, c.page_ref, c.category, d.file_name, d.name, d.classification_level
+                     FROM content_segments c
+                     JOIN documents d ON c.document_id = d.id"""
+
+# d.id is aliased so document rows never look like segment ids downstream
+DOCUMENT_COLUMNS = "d.id AS document_id, d.name, d.file_name, d.page_count, d.created_at, d.classification_level"
+
+LATEST_PATTERN = re.compile(r'(?:เอกสาร|ไฟล์|สัญญา|อัพโหลด|อัปโหลด)\S*\s*ล่าสุด'
+                            r'|(?:latest|most recent|newest)\s+(?:documents?|files?|contracts?|uploads?)')
+YEAR_PATTERN = re.compile(r'(?<!\d)(25\d\d|20\d\d)(?!\d)')
+
+# Checked in order: 'ไม่เกิน' before 'เกิน'
+PAGE_COMPARISONS = [
+    ('<=', ['ไม่เกิน', 'ไม่มากกว่า', 'at most', 'no more than']),
+    ('>=', ['อย่างน้อย', 'ไม่น้อยกว่า', 'at least']),
+    ('<', ['น้อยกว่า', 'ต่ำกว่า', 'less than', 'fewer than', 'under']),
+    ('>', ['มากกว่า', 'เกิน', 'more than', 'over']),
+    ('=', ['เท่ากับ', 'equal', 'exactly']),
+]
+PAGE_COUNT_PATTERNS = [
+    (op, re.compile(rf"(?:{'|'.join(words)})\s*(\d+)\s*(?:หน้า|pages?)"
+                    rf"|(?:จำนวนหน้า|page count|pages)\s*(?:{'|'.join(words)})\s*(\d+)"))
+    for op, words in PAGE_COMPARISONS
+]
+# A level counts only in a classification phrase: bare 'ลับ', 'ภายใน' and
+# 'confidential' are everyday contract words (กลับ, ภายใน 30 วัน, confidential information)
+LEVEL_PREFIX = r'(?:ระดับ|ชั้น(?:ความลับ)?)\s*'
+CLASSIFICATION_LEVELS = [
+    ('SECRET', rf'{LEVEL_PREFIX}ลับ(?:ที่สุด|มาก)|เอกสารลับ(?:ที่สุด|มาก)', 'secret'),
+    ('CONFIDENTIAL', rf'{LEVEL_PREFIX}ลับ|เอกสารลับ', 'confidential'),
+    ('INTERNAL', rf'{LEVEL_PREFIX}ภายใน', 'internal'),
+    ('PUBLIC', rf'{LEVEL_PREFIX}(?:สาธารณะ|เปิดเผย)', 'public'),
+]
+CLASSIFICATION_PATTERNS = [
+    (level, re.compile(thai + rf"|\b(?:classified as|classification|level)\s*:?\s*{english}\b"
+                              rf"|\b{english}\s+(?:documents?|files?|level)\b"))
+    for level, thai, english in CLASSIFICATION_LEVELS
+]
+MONTHS = [
+    ('มกราคม', 'january'), ('กุมภาพันธ์', 'february'), ('มีนาคม', 'march'), ('เมษายน', 'april'),
+    ('พฤษภาคม', 'may'), ('มิถุนายน', 'june'), ('กรกฎาคม', 'july'), ('สิงหาคม', 'august'),
+    ('กันยายน', 'september'), ('ตุลาคม', 'october'), ('พฤศจิกายน', 'november'), ('ธันวาคม', 'december'),
+]
+MONTH_PATTERNS = [
+    re.compile(rf'{thai}|\bin {english}\b|\b{english}\s+\d{{4}}\b') for thai, english in MONTHS
+]
+
+
+def _plan(sql: str, params: Dict, query_type: str, confidence: float, name: str,
+          embedding_terms: Optional[List[str]] = None) -> Dict:
+    return {
+        'sql': sql,
+        'params': params,
+        'needs_embedding': bool(embedding_terms),
+        'embedding_terms': embedding_terms or [],
+        'query_type': query_type,
+        'confidence': confidence,
+        'plan': f'compiled:{name}'
+    }
+
+
+class DocumentFilters:
+    """WHERE conditions on documents d plus their bind values."""
+
+    def __init__(self, doc_filename: Optional[str]):
+        self.conditions: List[str] = []
+        self.params: Dict = {}
+        self.metadata = False  # any condition beyond the document scope
+        if doc_filename:
+            self.conditions.append('d.file_name = :filename')
+
+    def add(self, condition: str, **params):
+        self.conditions.append(condition)
+        self.params.update(params)
+        self.metadata = True
+
+    def where(self) -> str:
+        return f" WHERE {' AND '.join(self.conditions)}" if self.conditions else ''
+
+
+def _page_plan(a: QueryAnalysis, doc_filename: Optional[str]) -> Optional[Dict]:
+    scope = ' AND d.file_name = :filename' if doc_filename else ''
+    order = ' ORDER BY c.page_ref, c.sequence_num FETCH FIRST 50 ROWS ONLY'
+
+    if a.is_page_range_query:
+        first, last = sorted(a.page_range)
+        return _plan(f"{SEGMENT_SELECT} WHERE c.page_ref BETWEEN :first_page AND :last_page{scope}{order}",
+                     {'first_page': first, 'last_page': last}, 'content', 0.95, 'page_range')
+
+    if a.is_multiple_pages_query:
+        return _plan(f"{SEGMENT_SELECT} WHERE c.page_ref IN "
+                     f"(SELECT p.page FROM JSON_TABLE(:pages, '$[*]' COLUMNS (page NUMBER PATH '$')) p){scope}{order}",
+                     {'pages': json_id_list(a.page_numbers)}, 'content', 0.95, 'page_list')
+
+    if a.is_page_query:
+        return _plan(f"{SEGMENT_SELECT} WHERE c.page_ref = :page{scope} ORDER BY c.sequence_num FETCH FIRST 50 ROWS ONLY",
+                     {'page': a.page_numbers[0]}, 'content', 0.95, 'page')
+    return None
+
+
+def _page_count_filter(a: QueryAnalysis, filters: DocumentFilters):
+    if not (a.numbers and a.has('comparison')):
+        return
+    for op, pattern in PAGE_COUNT_PATTERNS:
+        match = pattern.search(a.text)
+        if match:
+            filters.add(f'd.page_count {op} :page_count', page_count=int(match.group(1) or match.group(2)))
+            return
+
+
+def _year(value: str) -> int:
+    year = int(value)
+    return year - 543 if year > 2400 else year  # Buddhist era (พ.ศ.)
+
+
+def _upload_window(a: QueryAnalysis, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if a.has('today'):
+        return today, today + timedelta(days=1)
+    if a.has('yesterday'):
+        return today - timedelta(days=1), today
+    if a.has('this_week'):
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=7)
+
+    year_match = YEAR_PATTERN.search(a.text) if a.numbers else None
+    year = _year(year_match.group(1)) if year_match else None
+    month = next((i + 1 for i, pattern in enumerate(MONTH_PATTERNS) if pattern.search(a.text)), None)
+    if month is None and a.has('this_month'):
+        month, year = today.month, today.year
+    if year is None and a.has('this_year'):
+        year = today.year
+    if month is not None:
+        year = year or today.year
+        start = datetime(year, month, 1)
+        end = datetime(year + (month == 12), month % 12 + 1, 1)
+        return start, end
+    if year is not None:
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    return None
+
+
+def _upload_date_filter(a: QueryAnalysis, filters: DocumentFilters, now: datetime):
+    # Only upload dates are metadata; "สิ้นสุดปี 2568" is about the contract's content
+    if not a.has('upload'):
+        return
+    window = _upload_window(a, now)
+    if window:
+        filters.add('d.created_at >= :uploaded_from AND d.created_at < :uploaded_to',
+                    uploaded_from=window[0], uploaded_to=window[1])
+
+
+def _classification_filter(a: QueryAnalysis, filters: DocumentFilters):
+    if not a.has('classification'):
+        return
+    for level, pattern in CLASSIFICATION_PATTERNS:
+        if pattern.search(a.text):
+            filters.add('d.classification_level = :classification', classification=level)
+            return
+
+
+def compile_plan(query: str, doc_filename: Optional[str] = None, now: Optional[datetime] = None,
+                 analysis: Optional[QueryAnalysis] = None) -> Optional[Dict]:
+    """Fixed, parameterised SQL for the common question shapes, or None when
+    only the LLM can write it. Numbers and dates are bind values, never text."""
+    a = analysis or analyze_query(query)
+
+    page_plan = _page_plan(a, doc_filename)
+    if page_plan:
+        return page_plan
+
+    if a.has('table'):
+        scope = ' AND d.file_name = :filename' if doc_filename else ''
+        return _plan(f"{SEGMENT_SELECT} WHERE c.category = 'table'{scope} ORDER BY c.page_ref FETCH FIRST 50 ROWS ONLY",
+                     {}, 'content', 0.8, 'tables')
+
+    filters = DocumentFilters(doc_filename)
+    _page_count_filter(a, filters)
+    _upload_date_filter(a, filters, now or datetime.now())
+    _classification_filter(a, filters)
+
+    asks_page_count = a.has('page_count_question')
+    asks_listing = a.has('listing')
+    asks_latest = a.has('latest') and LATEST_PATTERN.search(a.text) is not None
+
+    if a.has('which_document') and not filters.metadata:
+        # "Which document talks about X": documents ranked by their closest
+        # segment. Always has a WHERE so the clearance filter lands on it
+        where = filters.where() or ' WHERE 1 = 1'
+        group_by = DOCUMENT_COLUMNS.replace('d.id AS document_id', 'd.id')
+        return _plan(f"SELECT {DOCUMENT_COLUMNS}, MIN(VECTOR_DISTANCE(c.vector_data, :query_embedding, COSINE)) AS distance "
+                     f"FROM documents d JOIN content_segments c ON c.document_id = d.id{where} "
+                     f"GROUP BY {group_by} ORDER BY distance FETCH FIRST 10 ROWS ONLY",
+                     filters.params, 'hybrid', 0.8, 'which_document', embedding_terms=[query])
+
+    if asks_page_count or asks_listing or asks_latest or filters.metadata:
+        if asks_latest or 'uploaded_from' in filters.params:
+            order = 'd.created_at DESC'
+        elif asks_page_count or 'page_count' in filters.params:
+            order = 'd.page_count DESC'
+        else:
+            order = 'd.name'
+        return _plan(f"SELECT {DOCUMENT_COLUMNS} FROM documents d{filters.where()} "
+                     f"ORDER BY {order} FETCH FIRST 50 ROWS ONLY",
+                     filters.params, 'metadata', 0.9, 'documents')
+    return None
+
+
+# Literals abstracted out of a question: quoted text, then bare numbers
+LITERAL_PATTERN = re.compile(r'["“\'‘]([^"”\'’]+)["”\'’]|(\d+(?:\.\d+)?)')
+SQL_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_PATTERN = re.compile(r'(?<![\w.:])\d+(?:\.\d+)?(?![\w.])')
+# A number right after these is a row limit, not a value from the question
+ROW_LIMIT_TAIL = re.compile(
+    r'\b(?:fetch\s+(?:first|next)|rownum\s*(?:<=|<|=)|limit|offset)\s*$', re.IGNORECASE
+)
+
+
+def question_template(query: str) -> Tuple[str, List]:
+    """('เอกสารที่มีมากกว่า <n> หน้า', [10]) for 'เอกสารที่มีมากกว่า 10 หน้า'."""
+    values = []
+
+    def abstract(m):
+        if m.group(1) is not None:
+            values.append(m.group(1))
+            return '<s>'
+        number = m.group(2)
+        values.append(float(number) if '.' in number else int(number))
+        return '<n>'
+
+    text = re.sub(r'\s+', ' ', query.strip()).rstrip(' ?？!.')
+    return LITERAL_PATTERN.sub(abstract, text).lower(), values
+
+
+def parameterize_sql(sql: str, values: List) -> Optional[str]:
+    """Replace the question's literals in LLM SQL with :q0, :q1, ... binds.
+
+    Row limits (FETCH FIRST 50 ROWS ONLY, ROWNUM <= 50) are never bound, even
+    when the question contains the same number. Returns None when the SQL can't
+    safely be reused for other values: a literal is ambiguous (appears twice in
+    the question or in more than one place in the SQL), was transformed rather
+    than copied (e.g. a พ.ศ. year turned into a date string), or isn't used at all.
+    """
+    texts = [str(v) for v in values]
+    if len(set(texts)) != len(texts):
+        return None
+    uses = [0] * len(texts)
+
+    def bind_number(m):
+        if m.group(0) in texts and not ROW_LIMIT_TAIL.search(m.string, 0, m.start()):
+            index = texts.index(m.group(0))
+            uses[index] += 1
+            return f':q{index}'
+        return m.group(0)
+
+    pieces, last = [], 0
+    for m in SQL_STRING_PATTERN.finditer(sql):
+        pieces.append(SQL_NUMBER_PATTERN.sub(bind_number, sql[last:m.start()]))
+        literal = m.group(0)[1:-1].replace("''", "'")
+        core = literal.strip('%')
+        if core in texts:
+            # '%ค่าปรับ%' -> '%' || :q0 || '%'
+            index = texts.index(core)
+            uses[index] += 1
+            lead, trail = literal[:len(literal) - len(literal.lstrip('%'))], literal[len(literal.rstrip('%')):]
+            pieces.append(' || '.join(([f"'{lead}'"] if lead else []) + [f':q{index}'] + ([f"'{trail}'"] if trail else [])))
+        elif any(text in literal for text in texts):
+            return None
+        else:
+            pieces.append(m.group(0))
+        last = m.end()
+    pieces.append(SQL_NUMBER_PATTERN.sub(bind_number, sql[last:]))
+    if any(count != 1 for count in uses):
+        return None
+    return ''.join(pieces)
+
+
+# Contexts where a literal is syntax, not a value, and must stay in the text
+TYPE_SIZE_TAIL = re.compile(
+    r'\b(?:n?varchar2|n?char|number|raw|vector|timestamp|float|interval)\s*\(\s*(?:\d+\s*,\s*)?$', re.IGNORECASE
+)
+POSITIONAL_TAIL = re.compile(r'\b(?:order|group)\s+by\s+(?:\d+\s*(?:asc|desc)?\s*,\s*)*$', re.IGNORECASE)
+COMPARISON_TAIL = re.compile(r'(?:=|<>|!=|<|>|\blike)\s*$', re.IGNORECASE)
+LITERAL_LIST = r"(?:'(?:[^']|'')*'|-?\d+(?:\.\d+)?)"
+IN_LIST_PATTERN = re.compile(rf'\bIN\s*\(\s*({LITERAL_LIST}(?:\s*,\s*{LITERAL_LIST})*)\s*\)', re.IGNORECASE)
+DATE_LITERAL_PATTERN = re.compile(r"\bDATE\s*'(\d{4}-\d{2}-\d{2})'", re.IGNORECASE)
+
+
+def _sql_value(literal: str):
+    if literal.startswith("'"):
+        return literal[1:-1].replace("''", "'")
+    return float(literal) if '.' in literal else int(literal)
+
+
+def bind_literals(sql: str) -> Tuple[str, Dict]:
+    """Move the values an LLM wrote into its SQL into :lit0, :lit1, ... binds.
+
+    Numbers and compared strings become scalar binds, IN lists one JSON array
+    bind (JSON_TABLE, as PAGE_SET_SQL does) and DATE '...' a TO_DATE of a bind,
+    so questions differing only in values share one cursor. Type sizes,
+    positional ORDER BY and function arguments such as JSON paths stay literal.
+    """
+    params = {}
+
+    def bind(value) -> str:
+        name = f'lit{len(params)}'
+        params[name] = value
+        return f':{name}'
+
+    def bind_list(m):
+        values = [_sql_value(v) for v in re.findall(LITERAL_LIST, m.group(1))]
+        column = 'VARCHAR2(4000)' if any(isinstance(v, str) for v in values) else 'NUMBER'
+        return (f"IN (SELECT j.v FROM JSON_TABLE({bind(json.dumps(values, ensure_ascii=False))}, "
+                f"'$[*]' COLUMNS (v {column} PATH '$')) j)")
+
+    sql = IN_LIST_PATTERN.sub(bind_list, sql)
+    sql = DATE_LITERAL_PATTERN.sub(lambda m: f"TO_DATE({bind(m.group(1))}, 'YYYY-MM-DD')", sql)
+
+    pieces, last = [], 0
+    for m in re.finditer(f'{SQL_STRING_PATTERN.pattern}|{SQL_NUMBER_PATTERN.pattern}', sql):
+        literal = m.group(0)
+        tail = sql[max(0, m.start() - 60):m.start()]
+        if literal.startswith("'"):
+            keep = not COMPARISON_TAIL.search(tail)
+        else:
+            keep = TYPE_SIZE_TAIL.search(tail) or POSITIONAL_TAIL.search(tail)
+        pieces.append(sql[last:m.start()])
+        pieces.append(literal if keep else bind(_sql_value(literal)))
+        last = m.end()
+    pieces.append(sql[last:])
+    return ''.join(pieces), params
+
+
+class SqlPlanCache:
+    """Bounded LRU of validated LLM SQL plans keyed by question template.
+
+    A plan is stored with the question's literals replaced by :q binds and any
+    other literal by a fixed :lit bind, so 'มากกว่า 10 หน้า' and 'มากกว่า 40 หน้า'
+    share one LLM call and one Oracle cursor. Plans depend only
+    on the schema, not on the data, so they never expire; a plan that fails in
+    Oracle is forgotten.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.forgotten = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, query: str, doc_filename: Optional[str]) -> Tuple[Tuple, List]:
+        template, values = question_template(query)
+        return (template, bool(doc_filename)), values
+
+    def get(self, key: Tuple, values: List) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(key)
+            self.hits += 1
+        return self._bound(plan, values)
+
+    def put(self, key: Tuple, values: List, result: Dict) -> Optional[Dict]:
+        """Store a validated LLM result; returns it as a bound plan, or None
+        if it can't be reused for other values."""
+        if not self.enabled:
+            return None
+        sql = parameterize_sql(result['sql'], values)
+        terms = result.get('embedding_terms') or []
+        # Embedding terms are free text; if they quote a literal they only fit this question
+        if sql is None or any(str(v) in term for v in values for term in terms):
+            with self._lock:
+                self.uncacheable += 1
+            return None
+        sql, fixed_params = bind_literals(sql)
+        plan = {
+            'sql': sql,
+            'fixed_params': fixed_params,
+            'needs_embedding': result.get('needs_embedding', False),
+            'embedding_terms': list(terms),
+            'query_type': result.get('query_type', 'hybrid'),
+            'confidence': result.get('confidence', 0.5),
+            'plan': 'cached',
+            'plan_key': key,
+        }
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return self._bound(plan, values)
+
+    @staticmethod
+    def _bound(plan: Dict, values: List) -> Dict:
+        params = dict(plan['fixed_params'])
+        params.update({f'q{i}': v for i, v in enumerate(values)})
+        bound = {k: v for k, v in plan.items() if k != 'fixed_params'}
+        bound.update(params=params, embedding_terms=list(plan['embedding_terms']))
+        return bound
+
+    def forget(self, key: Tuple):
+        with self._lock:
+            if self._plans.pop(key, None) is not None:
+                self.forgotten += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._plans),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'uncacheable': self.uncacheable,
+                'forgotten': self.forgotten,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+sql_plan_cache = SqlPlanCache(Config.SQL_PLAN_CACHE_SIZE)
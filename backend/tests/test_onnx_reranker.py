@@ -0,0 +1,31 @@
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('onnxruntime')
+pytest.importorskip('sentence_transformers')
+
+from config import Config
+from onnx_reranker import ONNX_MODEL_FILE, PARITY_TOLERANCE, parity_scores, same_ranking
+
+
+def _reference_model_available(model_name: str) -> bool:
+    if os.path.isdir(model_name):
+        return True
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache(model_name, 'config.json'), str)
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(Config.RERANK_ONNX_DIR, ONNX_MODEL_FILE)),
+                    reason='no ONNX export; run `python onnx_reranker.py export`')
+@pytest.mark.skipif(not _reference_model_available(Config.RERANK_MODEL),
+                    reason='PyTorch reranker model not downloaded')
+def test_onnx_scores_match_torch():
+    expected, got, _, _ = parity_scores(Config.RERANK_MODEL, Config.RERANK_ONNX_DIR)
+
+    assert got.shape == expected.shape
+    assert np.abs(expected - got).max() <= PARITY_TOLERANCE
+    assert same_ranking(expected, got)
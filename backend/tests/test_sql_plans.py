@@ -0,0 +1,42 @@
+import re
+import pytest
+
+pytest.importorskip('oracledb')
+pytest.importorskip('dotenv')
+pytest.importorskip('numpy')
+
+from sql_plans import SqlPlanCache, parameterize_sql
+
+OVER_50_PAGES_SQL = ("SELECT d.id AS document_id, d.name, d.file_name, d.page_count FROM documents d "
+                     "WHERE d.page_count > 50 ORDER BY d.page_count DESC FETCH FIRST 50 ROWS ONLY")
+
+
+def test_row_limit_is_not_bound_to_a_question_number():
+    cache = SqlPlanCache(10)
+    key, values = cache.key('เอกสารที่มีมากกว่า 50 หน้า', None)
+    assert values == [50]
+    stored = cache.put(key, values, {'sql': OVER_50_PAGES_SQL, 'query_type': 'metadata', 'confidence': 0.9})
+    assert stored is not None
+
+    key, values = cache.key('เอกสารที่มีมากกว่า 3 หน้า', None)
+    plan = cache.get(key, values)
+    assert plan['sql'].count(':q0') == 1
+    assert 'd.page_count > :q0' in plan['sql']
+    assert plan['params']['q0'] == 3
+    # The row limit stays 50, whether left inline or moved to a fixed :lit bind
+    limit = re.search(r'FETCH FIRST (\S+) ROWS ONLY', plan['sql']).group(1)
+    assert plan['params'].get(limit[1:]) == 50 if limit.startswith(':') else limit == '50'
+
+
+def test_rownum_limit_is_not_bound():
+    sql = "SELECT * FROM (SELECT d.name FROM documents d WHERE d.page_count < 20) WHERE ROWNUM <= 20"
+    assert parameterize_sql(sql, [20]) == (
+        "SELECT * FROM (SELECT d.name FROM documents d WHERE d.page_count < :q0) WHERE ROWNUM <= 20"
+    )
+
+
+def test_literal_used_twice_in_sql_is_not_cacheable():
+    sql = "SELECT d.name FROM documents d WHERE d.page_count > 10 OR d.file_size > 10"
+    assert parameterize_sql(sql, [10]) is None
+    assert parameterize_sql("SELECT c.content FROM content_segments c WHERE c.content LIKE '%ค่าปรับ%' "
+                            "OR c.category = 'ค่าปรับ'", ['ค่าปรับ']) is None
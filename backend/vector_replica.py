@@ -0,0 +1,350 @@
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from catalog import LEVEL_RANK
+
+try:
+    import hnswlib
+except ImportError:  # Exact numpy search is used instead
+    hnswlib = None
+
+# Rows from Oracle per sync round-trip
+SYNC_BATCH_SIZE = 2000
+# Segment ids are sequence-generated but commit out of order under concurrent
+# uploads, so each sync re-reads this many ids below the watermark
+SYNC_OVERLAP = 500
+# Below this many allowed rows a filtered query uses the exact scan
+EXACT_SCAN_MAX_ROWS = 20000
+
+REPLICA_BATCH_SQL = """
+    SELECT c.id, c.document_id, d.classification_level, c.vector_data
+    FROM content_segments c JOIN documents d ON d.id = c.document_id
+    WHERE c.id > :after_id
+    ORDER BY c.id
+    FETCH FIRST :batch ROWS ONLY
+"""
+
+REPLICA_IDS_SQL = "SELECT id FROM content_segments ORDER BY id"
+
+
+class VectorReplica:
+    """Read-only local copy of content_segments.vector_data for candidate generation.
+
+    Vectors live in a float32 memory-mapped file (normalised, one row per
+    segment) with parallel doc-id / classification-rank / segment-id arrays,
+    plus an HNSW index when hnswlib is installed. Oracle stays the source of
+    truth: the replica only yields candidate segment ids, which are hydrated
+    from Oracle, and it syncs incrementally by segment-id watermark.
+    """
+
+    def __init__(self, path: str, dim: int = 1024):
+        self.path = path
+        self.dim = dim
+        self.count = 0
+        self.watermark = 0
+        self.ready = False
+        self._lock = threading.RLock()
+        self._row_of: Dict[int, int] = {}
+        self._index = None
+        self._stop = threading.Event()
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    # ---- storage ----
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _map(self, name: str, dtype, capacity: int, width: int = 0):
+        shape = (capacity, width) if width else (capacity,)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        filename = self._file(name)
+        with open(filename, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+
+    def _open_arrays(self, capacity: int):
+        self.capacity = capacity
+        self.vectors = self._map('vectors.f32', np.float32, capacity, self.dim)
+        self.segment_ids = self._map('segment_ids.i64', np.int64, capacity)
+        self.doc_ids = self._map('doc_ids.i64', np.int64, capacity)
+        # 0 marks a deleted row; otherwise LEVEL_RANK of the classification
+        self.levels = self._map('levels.u1', np.uint8, capacity)
+
+    def _load(self):
+        state = {}
+        if os.path.exists(self._file('state.json')):
+            with open(self._file('state.json')) as f:
+                state = json.load(f)
+        if state.get('dim', self.dim) != self.dim:
+            raise ValueError(f"Replica at {self.path} has dim {state['dim']}, expected {self.dim}")
+        self.count = state.get('count', 0)
+        self.watermark = state.get('watermark', 0)
+        self._open_arrays(max(1024, state.get('capacity', 0)))
+        self._row_of = {int(sid): row for row, sid in enumerate(self.segment_ids[:self.count])}
+
+        if hnswlib is not None:
+            self._index = hnswlib.Index(space='ip', dim=self.dim)
+            index_file = self._file('index.bin')
+            if os.path.exists(index_file) and state.get('indexed', 0) == self.count:
+                self._index.load_index(index_file, max_elements=self.capacity)
+            else:
+                self._index.init_index(max_elements=self.capacity, ef_construction=200, M=16)
+                if self.count:
+                    self._index.add_items(np.asarray(self.vectors[:self.count]), np.arange(self.count))
+                    # Deletions are persisted in index.bin but not in a fresh build
+                    for row in np.flatnonzero(self.levels[:self.count] == 0):
+                        self._index.mark_deleted(int(row))
+            self._index.set_ef(100)
+
+    def _save(self):
+        for array in (self.vectors, self.segment_ids, self.doc_ids, self.levels):
+            array.flush()
+        if self._index is not None:
+            self._index.save_index(self._file('index.bin'))
+        state = {
+            'dim': self.dim,
+            'count': self.count,
+            'capacity': self.capacity,
+            'watermark': self.watermark,
+            'indexed': self.count if self._index is not None else 0,
+        }
+        tmp = self._file('state.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._file('state.json'))
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        for array in (self.vectors, self.segment_ids, self.doc_ids, self.levels):
+            array.flush()
+        self._open_arrays(capacity)
+        if self._index is not None:
+            self._index.resize_index(capacity)
+
+    # ---- sync ----
+
+    def _append(self, rows: List[Tuple]):
+        new_rows = [r for r in rows if int(r[0]) not in self._row_of]
+        if not new_rows:
+            return
+        start = self.count
+        self._grow(start + len(new_rows))
+        vectors = np.array([np.asarray(r[3], dtype=np.float32) for r in new_rows], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        end = start + len(new_rows)
+        self.vectors[start:end] = vectors
+        self.segment_ids[start:end] = [int(r[0]) for r in new_rows]
+        self.doc_ids[start:end] = [int(r[1]) for r in new_rows]
+        self.levels[start:end] = [LEVEL_RANK.get(r[2], LEVEL_RANK['SECRET']) for r in new_rows]
+        if self._index is not None:
+            self._index.add_items(vectors, np.arange(start, end))
+        for offset, r in enumerate(new_rows):
+            self._row_of[int(r[0])] = start + offset
+        self.count = end
+
+    def sync(self, db) -> int:
+        """Pull segments above the watermark from Oracle; returns rows added."""
+        added = 0
+        after_id = max(0, self.watermark - SYNC_OVERLAP)
+        with db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.arraysize = SYNC_BATCH_SIZE
+            while True:
+                cur.execute(REPLICA_BATCH_SQL, {'after_id': after_id, 'batch': SYNC_BATCH_SIZE})
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                with self._lock:
+                    before = self.count
+                    self._append(rows)
+                    added += self.count - before
+                    after_id = int(rows[-1][0])
+                    self.watermark = max(self.watermark, after_id)
+                if len(rows) < SYNC_BATCH_SIZE:
+                    break
+        if added:
+            with self._lock:
+                self._save()
+            print(f"Vector replica: +{added} segments (total {self.count}, watermark {self.watermark})")
+        self.ready = True
+        return added
+
+    def apply_catalog_changes(self, catalog, doc_ids: set):
+        """Catalog listener: drop rows of deleted documents, refresh reclassified ones."""
+        with self._lock:
+            doc_col = self.doc_ids[:self.count]
+            for doc_id in doc_ids:
+                rows = np.flatnonzero((doc_col == doc_id) & (self.levels[:self.count] > 0))
+                if not len(rows):
+                    continue
+                entry = catalog.get_by_id(doc_id)
+                if entry is None:
+                    self.levels[rows] = 0
+                    if self._index is not None:
+                        for row in rows:
+                            self._index.mark_deleted(int(row))
+                    for sid in self.segment_ids[rows]:
+                        self._row_of.pop(int(sid), None)
+                else:
+                    self.levels[rows] = LEVEL_RANK.get(entry['classification'], LEVEL_RANK['SECRET'])
+            self._save()
+
+    def start(self, db, interval: float):
+        """Initial sync plus a daemon thread that keeps syncing every interval seconds."""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.sync(db)
+                except Exception as e:
+                    print(f"Vector replica sync error: {e}")
+                self._stop.wait(interval)
+
+        threading.Thread(target=loop, name='vector-replica-sync', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ---- search ----
+
+    def search(self, query_embedding: List[float], top_k: int = 10, doc_id: Optional[int] = None,
+               allowed_levels: Optional[List[str]] = None,
+               doc_ids: Optional[List[int]] = None) -> List[Tuple[int, float]]:
+        """Nearest (segment_id, cosine distance) pairs, filtered like similar_chunks_query."""
+        query = np.array(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        ranks = {LEVEL_RANK[l] for l in allowed_levels if l in LEVEL_RANK} if allowed_levels else None
+
+        with self._lock:
+            n = self.count
+            if n == 0:
+                return []
+            mask = self.levels[:n] > 0
+            if ranks is not None:
+                mask &= np.isin(self.levels[:n], list(ranks))
+            if doc_id is not None:
+                mask &= self.doc_ids[:n] == doc_id
+            elif doc_ids:
+                mask &= np.isin(self.doc_ids[:n], list(doc_ids))
+            allowed = int(mask.sum())
+            if allowed == 0:
+                return []
+            k = min(top_k, allowed)
+
+            rows = None
+            # Selective filters (one document, few allowed rows) are cheaper to
+            # scan exactly than to walk the graph skipping filtered nodes
+            if self._index is not None and allowed > EXACT_SCAN_MAX_ROWS:
+                try:
+                    labels, distances = self._index.knn_query(query, k=k, filter=lambda row: bool(mask[row]))
+                    rows, dists = labels[0], distances[0]
+                except RuntimeError:
+                    rows = None  # Graph walk found fewer than k allowed rows
+            if rows is None:
+                # Exact scan over the memory-mapped matrix
+                candidates = np.flatnonzero(mask)
+                sims = np.asarray(self.vectors[candidates]) @ query
+                best = np.argpartition(-sims, k - 1)[:k]
+                best = best[np.argsort(-sims[best])]
+                rows, dists = candidates[best], 1.0 - sims[best]
+
+            return [(int(self.segment_ids[row]), float(dist)) for row, dist in zip(rows, dists)]
+
+    def stats(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'segments': self.count - int((self.levels[:self.count] == 0).sum()),
+            'watermark': self.watermark,
+            'index': 'hnsw' if self._index is not None else 'exact',
+        }
+
+    # ---- consistency ----
+
+    def check(self, db, sample: int = 50) -> Dict:
+        """Compare the replica with Oracle: missing/extra ids and a vector sample."""
+        with db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.arraysize = 10000
+            cur.execute(REPLICA_IDS_SQL)
+            oracle_ids = {int(r[0]) for r in cur.fetchall()}
+            local_ids = set(self._row_of)
+            mismatched = []
+            common = sorted(oracle_ids & local_ids)
+            sample_ids = common[::max(1, len(common) // sample)][:sample]
+            for sid in sample_ids:
+                cur.execute("SELECT vector_data FROM content_segments WHERE id = :id", {'id': sid})
+                remote = np.asarray(cur.fetchone()[0], dtype=np.float32)
+                remote /= np.linalg.norm(remote) or 1.0
+                if not np.allclose(remote, self.vectors[self._row_of[sid]], atol=1e-5):
+                    mismatched.append(sid)
+        return {
+            'oracle_segments': len(oracle_ids),
+            'replica_segments': len(local_ids),
+            'missing_in_replica': len(oracle_ids - local_ids),
+            'extra_in_replica': len(local_ids - oracle_ids),
+            'sampled': len(sample_ids),
+            'vector_mismatches': mismatched,
+            'watermark': self.watermark,
+            'consistent': oracle_ids == local_ids and not mismatched,
+        }
+
+
+def _lock_replica_dir(path: str):
+    """Exclusive lock so only one process writes a replica directory."""
+    os.makedirs(path, exist_ok=True)
+    lock_file = open(os.path.join(path, '.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def create_vector_replica() -> Optional[VectorReplica]:
+    """The configured replica, or None (disabled, or owned by another worker)."""
+    if not Config.VECTOR_REPLICA_ENABLED:
+        return None
+    lock_file = _lock_replica_dir(Config.VECTOR_REPLICA_PATH)
+    if lock_file is None:
+        print(f"Vector replica at {Config.VECTOR_REPLICA_PATH} is used by another process; "
+              "this worker searches Oracle directly")
+        return None
+    replica = VectorReplica(Config.VECTOR_REPLICA_PATH, dim=Config.EMBEDDING_DIM)
+    replica.lock_file = lock_file  # Held for the life of the process
+    return replica
+
+
+if __name__ == '__main__':
+    # python vector_replica.py sync|check
+    from database import OracleVectorDB
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    if command == 'sync' and _lock_replica_dir(Config.VECTOR_REPLICA_PATH) is None:
+        print("Replica is locked by a running backend, which keeps it in sync")
+        sys.exit(1)
+    replica = VectorReplica(Config.VECTOR_REPLICA_PATH, dim=Config.EMBEDDING_DIM)
+    db = OracleVectorDB()
+    if command == 'sync':
+        started = time.time()
+        added = replica.sync(db)
+        print(f"Synced {added} segments in {time.time() - started:.1f}s")
+    elif command == 'check':
+        report = replica.check(db)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['consistent'] else 1)
+    else:
+        print("Usage: python vector_replica.py sync|check")
+        sys.exit(2)
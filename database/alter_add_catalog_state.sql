@@ -0,0 +1,21 @@
+-- Safe migration: version counter for the backend's in-process document
+-- catalog. The trigger bumps it on any change to cached document columns so
+-- every worker reloads its catalog within CATALOG_REFRESH_SECONDS.
+BEGIN
+    EXECUTE IMMEDIATE 'CREATE TABLE catalog_state (id NUMBER PRIMARY KEY, version NUMBER NOT NULL)';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -955 THEN RAISE; END IF; -- table exists
+END;
+/
+
+MERGE INTO catalog_state s
+USING (SELECT 1 id FROM dual) src ON (s.id = src.id)
+WHEN NOT MATCHED THEN INSERT (id, version) VALUES (1, 0);
+COMMIT;
+
+CREATE OR REPLACE TRIGGER trg_documents_catalog
+AFTER INSERT OR DELETE OR UPDATE OF file_name, name, page_count, classification_level, file_ref ON documents
+BEGIN
+    UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+END;
+/
@@ -0,0 +1,14 @@
+-- Safe migration: one routing vector per document for two-stage retrieval
+-- (title/abstract/TOC embedding blended with the chunk centroid).
+-- Afterwards run backend/backfill_document_vectors.py for existing documents.
+BEGIN
+    EXECUTE IMMEDIATE 'CREATE TABLE document_vectors (
+        document_id NUMBER PRIMARY KEY,
+        vector_data VECTOR(1024, FLOAT32) NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT fk_document_vector FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+    )';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -955 THEN RAISE; END IF; -- table exists
+END;
+/
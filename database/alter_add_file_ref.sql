@@ -0,0 +1,9 @@
+-- Safe migration: reference original PDFs in the content-addressed blob store
+-- instead of keeping them inline in documents.file_data. Existing BLOBs are
+-- moved lazily by the backend the first time each PDF is requested.
+BEGIN
+    EXECUTE IMMEDIATE 'ALTER TABLE documents ADD (file_ref VARCHAR2(64), file_size NUMBER)';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -1430 THEN RAISE; END IF; -- columns exist
+END;
+/
@@ -0,0 +1,40 @@
+-- Safe migration: copy classification onto content_segments for the vector
+-- replica. Search filters on documents.classification_level; the copy is kept
+-- in sync by a trigger and has no default, so a segment is never readable at
+-- a lower level than its document.
+BEGIN
+    EXECUTE IMMEDIATE 'ALTER TABLE content_segments ADD (classification_level VARCHAR2(20))';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -1430 THEN RAISE; END IF; -- column exists
+END;
+/
+
+UPDATE content_segments c
+   SET c.classification_level = (SELECT d.classification_level FROM documents d WHERE d.id = c.document_id);
+COMMIT;
+
+-- Databases migrated earlier got DEFAULT 'PUBLIC'; remove it
+ALTER TABLE content_segments MODIFY (classification_level DEFAULT NULL);
+
+BEGIN
+    EXECUTE IMMEDIATE 'ALTER TABLE content_segments MODIFY (classification_level NOT NULL)';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -1442 THEN RAISE; END IF; -- already NOT NULL
+END;
+/
+
+CREATE OR REPLACE TRIGGER trg_documents_segment_class
+AFTER UPDATE OF classification_level ON documents
+FOR EACH ROW
+BEGIN
+    UPDATE content_segments SET classification_level = :NEW.classification_level
+     WHERE document_id = :NEW.id;
+END;
+/
+
+BEGIN
+    EXECUTE IMMEDIATE 'CREATE INDEX idx_segment_class_doc ON content_segments(classification_level, document_id)';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -955 THEN RAISE; END IF; -- index exists
+END;
+/
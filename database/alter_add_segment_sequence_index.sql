@@ -0,0 +1,8 @@
+-- Safe migration: index for neighbour windows by sequence_num
+-- (OracleVectorDB.get_chunk_neighbours)
+BEGIN
+    EXECUTE IMMEDIATE 'CREATE INDEX idx_segment_doc_seq ON content_segments(document_id, sequence_num)';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE NOT IN (-955, -1408) THEN RAISE; END IF; -- already exists
+END;
+/
@@ -0,0 +1,22 @@
+-- Safe migration: Oracle Text index for lexical (keyword) search over segment
+-- content, used by lexical_retriever.py. WORLD_LEXER segments Thai, which is
+-- written without spaces between words, and handles Latin text as usual.
+-- APPUSER needs the CTXAPP role (as SYSTEM: GRANT CTXAPP TO APPUSER).
+BEGIN
+    CTX_DDL.CREATE_PREFERENCE('segment_lexer', 'WORLD_LEXER');
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -20000 THEN RAISE; END IF; -- preference already exists
+END;
+/
+
+BEGIN
+    EXECUTE IMMEDIATE q'[CREATE INDEX idx_segment_text ON content_segments(content)
+        INDEXTYPE IS CTXSYS.CONTEXT
+        PARAMETERS ('LEXER segment_lexer SYNC (ON COMMIT)')]';
+EXCEPTION WHEN OTHERS THEN
+    IF SQLCODE != -955 THEN RAISE; END IF; -- already exists
+END;
+/
+
+-- Per-commit sync fragments the index over time; compact it off-peak with:
+-- EXEC CTX_DDL.OPTIMIZE_INDEX('idx_segment_text', 'FULL');
@@ -7,14 +7,26 @@ BEGIN EXECUTE IMMEDIATE 'DROP INDEX idx_segment_page'; EXCEPTION WHEN OTHERS THE
 /
 BEGIN EXECUTE IMMEDIATE 'DROP INDEX idx_segment_doc'; EXCEPTION WHEN OTHERS THEN NULL; END;
 /
+BEGIN EXECUTE IMMEDIATE 'DROP INDEX idx_segment_class_doc'; EXCEPTION WHEN OTHERS THEN NULL; END;
+/
+BEGIN EXECUTE IMMEDIATE 'DROP INDEX idx_segment_doc_seq'; EXCEPTION WHEN OTHERS THEN NULL; END;
+/
+BEGIN EXECUTE IMMEDIATE 'DROP INDEX idx_segment_text FORCE'; EXCEPTION WHEN OTHERS THEN NULL; END;
+/
+BEGIN CTX_DDL.DROP_PREFERENCE('segment_lexer'); EXCEPTION WHEN OTHERS THEN NULL; END;
+/
 BEGIN EXECUTE IMMEDIATE 'DROP INDEX idx_file_name'; EXCEPTION WHEN OTHERS THEN NULL; END;
 /
+BEGIN EXECUTE IMMEDIATE 'DROP TABLE document_vectors CASCADE CONSTRAINTS PURGE'; EXCEPTION WHEN OTHERS THEN NULL; END;
+/
 BEGIN EXECUTE IMMEDIATE 'DROP TABLE content_segments CASCADE CONSTRAINTS PURGE'; EXCEPTION WHEN OTHERS THEN NULL; END;
 /
 BEGIN EXECUTE IMMEDIATE 'DROP TABLE documents CASCADE CONSTRAINTS PURGE'; EXCEPTION WHEN OTHERS THEN NULL; END;
 /
 BEGIN EXECUTE IMMEDIATE 'DROP TABLE users CASCADE CONSTRAINTS PURGE'; EXCEPTION WHEN OTHERS THEN NULL; END;
 /
+BEGIN EXECUTE IMMEDIATE 'DROP TABLE catalog_state CASCADE CONSTRAINTS PURGE'; EXCEPTION WHEN OTHERS THEN NULL; END;
+/
 BEGIN EXECUTE IMMEDIATE 'DROP SEQUENCE segment_seq'; EXCEPTION WHEN OTHERS THEN NULL; END;
 /
 BEGIN EXECUTE IMMEDIATE 'DROP SEQUENCE doc_seq'; EXCEPTION WHEN OTHERS THEN NULL; END;
@@ -33,6 +45,10 @@ CREATE TABLE documents (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     classification_level VARCHAR2(20) DEFAULT 'PUBLIC' NOT NULL,
     properties JSON,
+    -- SHA-256 key of the original PDF in the backend blob store
+    file_ref VARCHAR2(64),
+    file_size NUMBER,
+    -- Legacy inline PDF storage; new uploads leave this NULL
     file_data BLOB
 );
 
@@ -45,13 +61,58 @@ CREATE TABLE content_segments (
     sequence_num NUMBER,
     vector_data VECTOR(1024, FLOAT32),
     attributes JSON,
+    -- Copy of documents.classification_level for the vector replica; kept in
+    -- sync by trg_documents_segment_class. No default: a segment must never
+    -- be readable at a lower level than its document
+    classification_level VARCHAR2(20) NOT NULL,
     CONSTRAINT fk_document FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
 );
 
+-- Document-level routing vectors (two-stage retrieval)
+CREATE TABLE document_vectors (
+    document_id NUMBER PRIMARY KEY,
+    vector_data VECTOR(1024, FLOAT32) NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_document_vector FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+);
+
 CREATE UNIQUE INDEX idx_file_name ON documents(file_name);
 CREATE INDEX idx_docs_classification ON documents(classification_level);
 CREATE INDEX idx_segment_doc ON content_segments(document_id);
 CREATE INDEX idx_segment_doc_page ON content_segments(document_id, page_ref);
+-- Neighbour windows by sequence_num (get_chunk_neighbours)
+CREATE INDEX idx_segment_doc_seq ON content_segments(document_id, sequence_num);
+
+-- Lexical search (Oracle Text); WORLD_LEXER segments Thai words. Needs CTXAPP.
+BEGIN CTX_DDL.CREATE_PREFERENCE('segment_lexer', 'WORLD_LEXER'); END;
+/
+CREATE INDEX idx_segment_text ON content_segments(content)
+    INDEXTYPE IS CTXSYS.CONTEXT
+    PARAMETERS ('LEXER segment_lexer SYNC (ON COMMIT)');
+CREATE INDEX idx_segment_class_doc ON content_segments(classification_level, document_id);
+
+-- Version counter for the backend document catalog cache (catalog.py)
+CREATE TABLE catalog_state (
+    id NUMBER PRIMARY KEY,
+    version NUMBER NOT NULL
+);
+INSERT INTO catalog_state (id, version) VALUES (1, 0);
+
+CREATE OR REPLACE TRIGGER trg_documents_catalog
+AFTER INSERT OR DELETE OR UPDATE OF file_name, name, page_count, classification_level, file_ref ON documents
+BEGIN
+    UPDATE catalog_state SET version = version + 1 WHERE id = 1;
+END;
+/
+
+CREATE OR REPLACE TRIGGER trg_documents_segment_class
+AFTER UPDATE OF classification_level ON documents
+FOR EACH ROW
+BEGIN
+    UPDATE content_segments SET classification_level = :NEW.classification_level
+     WHERE document_id = :NEW.id;
+END;
+/
 
 -- Optional later:
 -- CREATE VECTOR INDEX idx_segment_vector ON content_segments(vector_data)
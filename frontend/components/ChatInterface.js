@@ -1,6 +1,6 @@
 'use client'
 import { useState, useRef, useEffect } from 'react'
-import { askQuestion } from '@/utils/api'
+import { askQuestionStream } from '@/utils/api'
 import ReactMarkdown from 'react-markdown'
 import styles from './ChatInterface.module.css'
 
@@ -31,26 +31,36 @@ export default function ChatInterface({ selectedDocument }) {
     setInputValue('')
     setLoading(true)
 
+    // The answer replaces the loading dots at the first token and fills in as tokens arrive
+    const aiMessageId = Date.now() + 1
+    let sources = []
+    const updateAiMessage = (update) => {
+      setMessages(prev => {
+        if (!prev.some(m => m.id === aiMessageId)) {
+          return [...prev, { id: aiMessageId, role: 'assistant', content: '', sources, ...update({ content: '' }) }]
+        }
+        return prev.map(m => (m.id === aiMessageId ? { ...m, ...update(m) } : m))
+      })
+    }
+
     try {
-      const response = await askQuestion(
+      await askQuestionStream(
         inputValue, 
-        selectedDocument?.filename || null
+        selectedDocument?.filename || null,
+        15,
+        {
+          onSources: (retrieved) => { sources = retrieved },
+          onToken: (text) => {
+            setLoading(false)
+            updateAiMessage(m => ({ content: m.content + text }))
+          },
+        }
       )
-
-      const aiMessage = {
-        id: Date.now() + 1,
-        role: 'assistant',
-        content: response.answer,
-        sources: response.sources,
-      }
-      setMessages(prev => [...prev, aiMessage])
     } catch (error) {
-      const errorMessage = {
-        id: Date.now() + 1,
-        role: 'assistant',
+      updateAiMessage(() => ({
         content: 'ขออภัย เกิดข้อผิดพลาดในการประมวลผลคำถามของคุณ กรุณาลองใหม่อีกครั้ง',
-      }
-      setMessages(prev => [...prev, errorMessage])
+        sources: [],
+      }))
     } finally {
       setLoading(false)
     }
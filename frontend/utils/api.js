@@ -60,6 +60,58 @@ export const askQuestion = async (question, documentFilename = null, topK = 15)
   return response.data
 }
 
+// Ask question, streaming the answer (Server-Sent Events over a POST)
+// handlers: { onSources(sources), onToken(text), onDone(info) }
+export const askQuestionStream = async (question, documentFilename = null, topK = 15, handlers = {}) => {
+  const token = typeof window !== 'undefined' ? localStorage.getItem('token') : null
+  const response = await fetch(`${API_BASE_URL}/ask/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { 'Authorization': `Bearer ${token}` } : {})
+    },
+    body: JSON.stringify({
+      question,
+      document_filename: documentFilename,
+      top_k: topK
+    })
+  })
+  if (!response.ok || !response.body) {
+    throw new Error(`Ask failed: ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  const dispatch = (block) => {
+    let event = 'message'
+    let data = ''
+    for (const line of block.split('\n')) {
+      if (line.startsWith('event:')) event = line.slice(6).trim()
+      else if (line.startsWith('data:')) data += line.slice(5).trim()
+    }
+    if (!data) return
+    const payload = JSON.parse(data)
+    if (event === 'sources') handlers.onSources?.(payload)
+    else if (event === 'token') handlers.onToken?.(payload)
+    else if (event === 'done') handlers.onDone?.(payload)
+    else if (event === 'error') throw new Error(payload.detail || 'Stream error')
+  }
+
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      dispatch(buffer.slice(0, boundary))
+      buffer = buffer.slice(boundary + 2)
+    }
+  }
+  if (buffer.trim()) dispatch(buffer)
+}
+
 // Get specific page content
 export const getPageContent = async (filename, pageNumber) => {
   const response = await api.post('/page', {